@@ -0,0 +1,47 @@
+"""
+Reference configurations for the ClLike benchmarks. They reuse the Cobaya
+inputs of the tests in cl_like/tests, so that the benchmarks run on the same
+data files and settings that are checked for correctness.
+
+Each configuration is defined by the test module providing `get_info` and
+the arguments passed to it.
+"""
+import importlib
+import os
+import sys
+
+
+CLLIKE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.join(CLLIKE_DIR, 'cl_like', 'tests')
+
+CONFIGS = {}
+for bias in ['Linear', 'EulerianPT', 'LagrangianPT', 'BaccoPT']:
+    CONFIGS[f'5x2pt_{bias}'] = {'module': 'test_bias_models',
+                                'kwargs': {'bias': bias}}
+CONFIGS.update({
+    'sh_bcm_Linear': {'module': 'test_bcm',
+                      'kwargs': {'bias': 'Linear'}},
+    'sh_PkmmBacco_bcm_BaccoPT': {'module': 'test_bcm',
+                                 'kwargs': {'bias': 'BaccoPT'}},
+    'sh_baccoemu_baryons': {'module': 'test_bacco_baryons',
+                            'kwargs': {}},
+    'sh_hmcode2020_TAGN': {'module': 'test_baryons_HMCode2020',
+                           'kwargs': {'T_AGN': 7.8}},
+})
+
+# Parameter varied to trigger a full recomputation (all the theory stages)
+# and one only used by the last stages (ClFinal and ClLike)
+FULL_PARAM = 'A_sE9'
+FAST_PARAM = 'bias_sh0_m'
+
+
+def get_info(name):
+    """ Return the Cobaya info of the configuration `name`. The relative
+    data paths in the test inputs assume that the working directory is
+    ClLike (see run_benchmarks.py).
+    """
+    config = CONFIGS[name]
+    if TESTS_DIR not in sys.path:
+        sys.path.insert(0, TESTS_DIR)
+    module = importlib.import_module(config['module'])
+    return module.get_info(**config['kwargs'])
@@ -0,0 +1,287 @@
+"""
+Benchmarks of the ClLike pipeline. For each reference configuration (see
+configs.py) it measures, in a separate process:
+
+- the model initialization time,
+- the time of the first likelihood evaluation,
+- the time of full evaluations (varying A_sE9, so that all the theory
+  stages are recomputed) and of fast evaluations (varying a shear
+  calibration parameter, so that only ClFinal and ClLike are recomputed),
+- the mean time per evaluation of each stage and the counters recorded by
+  the `timing` option of the cl_like classes (see cl_like/timing.py),
+- the peak memory (maximum resident set size) of the process.
+
+The results are written to a JSON report. A configuration that fails,
+crashes or runs for longer than --timeout seconds is recorded with an 'error'
+entry. If a baseline report is given, the evaluation times and peak memory
+are compared with it and the script exits with an error if any of them is
+slower (larger) than allowed by the tolerance.
+
+Usage:
+    python benchmarks/run_benchmarks.py -o report.json
+    python benchmarks/run_benchmarks.py -c 5x2pt_Linear -n 20 \\
+        -o new.json --baseline report.json --tolerance 0.1
+"""
+import argparse
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+from queue import Empty
+import subprocess
+import sys
+import time
+import traceback
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from configs import CONFIGS, CLLIKE_DIR, FULL_PARAM, FAST_PARAM, \
+    get_info  # noqa: E402
+
+
+def get_peak_memory():
+    """ Peak resident set size of this process in MB. """
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB on Linux
+    if sys.platform == 'darwin':
+        return maxrss / 1024**2
+    return maxrss / 1024
+
+
+def enable_timing(info):
+    """ Switch on the timing option of all the cl_like components. """
+    for kind in ['theory', 'likelihood']:
+        for component in info.get(kind, {}).values():
+            cls = component.get('external')
+            if hasattr(cls, 'timing'):
+                component['timing'] = True
+
+
+def sample_params(info, names):
+    """ Turn the fixed parameters `names` into sampled ones. Returns their
+    fiducial values.
+    """
+    fiducial = {}
+    for p in names:
+        v = info['params'].get(p)
+        if not isinstance(v, (int, float)):
+            continue
+        width = max(0.5*abs(v), 0.1)
+        info['params'][p] = {'prior': {'min': v - width, 'max': v + width}}
+        fiducial[p] = v
+    return fiducial
+
+
+def get_timers(model):
+    components = list(model.theory.values()) + \
+        list(model.likelihood.values())
+    return {c.get_name(): c.timer for c in components
+            if hasattr(c, 'timer')}
+
+
+def snapshot(model):
+    return {name: (dict(t.time_total), dict(t.count_total))
+            for name, t in get_timers(model).items()}
+
+
+def diff_snapshots(after, before, n_eval):
+    """ Mean time of each stage and mean counts per evaluation. """
+    stages = {}
+    counters = {}
+    for name, (times, counts) in after.items():
+        times0, counts0 = before.get(name, ({}, {}))
+        stages[name] = {s: (t - times0.get(s, 0)) / n_eval
+                        for s, t in times.items()}
+        counters[name] = {c: (n - counts0.get(c, 0)) / n_eval
+                          for c, n in counts.items()}
+    return stages, counters
+
+
+def time_evaluations(model, point, param, n_eval):
+    """ Time n_eval likelihood evaluations with slightly different values of
+    param, so that the Cobaya caches are not used.
+    """
+    times = []
+    point = point.copy()
+    v0 = point[param]
+    before = snapshot(model)
+    for i in range(n_eval):
+        point[param] = v0 * (1 + 1E-3 * (i+1) * (-1)**i)
+        t0 = time.perf_counter()
+        model.loglike(point, return_derived=False)
+        times.append(time.perf_counter() - t0)
+    stages, counters = diff_snapshots(snapshot(model), before, n_eval)
+    times = np.array(times)
+    return {'mean': times.mean(), 'min': times.min(), 'std': times.std(),
+            'n': n_eval, 'stages': stages, 'counters': counters}
+
+
+def run_config(name, n_eval, info=None):
+    """ Benchmark the configuration `name` (or the Cobaya input `info`, if
+    given). Runs in its own process.
+    """
+    os.chdir(CLLIKE_DIR)
+    from cobaya.model import get_model
+
+    if info is None:
+        info = get_info(name)
+    enable_timing(info)
+    info['debug'] = False
+    point = sample_params(info, [FULL_PARAM, FAST_PARAM])
+
+    result = {}
+    t0 = time.perf_counter()
+    model = get_model(info)
+    result['init_time'] = time.perf_counter() - t0
+
+    # First evaluation: includes the lazy initializations (e.g. emulators)
+    t0 = time.perf_counter()
+    result['loglike'] = float(model.loglike(point, return_derived=False))
+    result['first_eval_time'] = time.perf_counter() - t0
+
+    if FULL_PARAM in point:
+        result['full_eval'] = time_evaluations(model, point, FULL_PARAM,
+                                               n_eval)
+    if FAST_PARAM in point:
+        result['fast_eval'] = time_evaluations(model, point, FAST_PARAM,
+                                               n_eval)
+    result['ndata'] = int(model.likelihood['ClLike'].ndata)
+    result['peak_memory_mb'] = get_peak_memory()
+    return result
+
+
+def _worker(name, n_eval, info, queue):
+    try:
+        queue.put(run_config(name, n_eval, info))
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+
+
+def run_in_process(name, n_eval, info=None, timeout=None, poll=1.):
+    # Separate processes, so that the peak memory is that of this
+    # configuration only. A process that crashes (e.g. killed by the OOM
+    # killer) or runs for longer than timeout seconds is recorded as an
+    # error.
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_worker, args=(name, n_eval, info, queue))
+    process.start()
+    t0 = time.perf_counter()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=poll)
+        except Empty:
+            if process.exitcode is not None:
+                # The result might have been sent right before exiting
+                try:
+                    result = queue.get(timeout=poll)
+                except Empty:
+                    result = {'error': 'The benchmark process exited with '
+                              f'code {process.exitcode} without a result'}
+            elif (timeout is not None) and \
+                    (time.perf_counter() - t0 > timeout):
+                process.terminate()
+                result = {'error': f'Timed out after {timeout}s'}
+    process.join()
+    return result
+
+
+def get_metadata():
+    meta = {'date': datetime.datetime.now().isoformat(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'omp_num_threads': os.environ.get('OMP_NUM_THREADS')}
+    for module in ['numpy', 'pyccl', 'cobaya', 'sacc']:
+        try:
+            meta[module] = __import__(module).__version__
+        except Exception:
+            meta[module] = None
+    try:
+        meta['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=CLLIKE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        meta['git_commit'] = None
+    return meta
+
+
+def compare(report, baseline, tolerance):
+    """ Compare report with baseline. Returns the list of regressions. """
+    regressions = []
+    for name, res in report['results'].items():
+        ref = baseline['results'].get(name)
+        if (ref is None) or ('error' in res) or ('error' in ref):
+            continue
+        quantities = [(f'{kind}.min', res[kind]['min'], ref[kind]['min'])
+                      for kind in ['full_eval', 'fast_eval']
+                      if (kind in res) and (kind in ref)]
+        quantities.append(('peak_memory_mb', res['peak_memory_mb'],
+                           ref['peak_memory_mb']))
+        for q, new, old in quantities:
+            ratio = new / old
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  <-- REGRESSION'
+                regressions.append((name, q, ratio))
+            print(f"{name:<28s} {q:<16s} {old:10.4g} -> {new:10.4g} "
+                  f"({ratio:6.3f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--configs', nargs='+', default=None,
+                        help='Configurations to run (default: all). '
+                        f'Available: {", ".join(CONFIGS)}')
+    parser.add_argument('-n', '--n-eval', type=int, default=10,
+                        help='Number of timed evaluations of each kind')
+    parser.add_argument('-o', '--output', default='benchmark_report.json',
+                        help='Output JSON report')
+    parser.add_argument('--baseline', default=None,
+                        help='Report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative slowdown allowed with respect to '
+                        'the baseline')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Maximum time in seconds for each '
+                        'configuration (default: no limit)')
+    args = parser.parse_args()
+
+    names = args.configs or list(CONFIGS)
+    for name in names:
+        if name not in CONFIGS:
+            parser.error(f"Unknown configuration {name}")
+
+    report = {'metadata': get_metadata(), 'n_eval': args.n_eval,
+              'results': {}}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        res = run_in_process(name, args.n_eval, timeout=args.timeout)
+        report['results'][name] = res
+        if 'error' in res:
+            print(f"  failed:\n{res['error']}")
+            continue
+        msg = f"  init {res['init_time']:.2f}s"
+        for kind in ['full_eval', 'fast_eval']:
+            if kind in res:
+                msg += f", {kind} {1E3*res[kind]['mean']:.1f}ms"
+        msg += f", peak memory {res['peak_memory_mb']:.0f}MB"
+        print(msg, flush=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
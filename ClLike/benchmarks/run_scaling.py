@@ -0,0 +1,129 @@
+"""
+Scaling of the ClLike pipeline with the number of tracers and of data
+points. It generates synthetic sacc files with
+cl_like/tests/data/mk_data_scaling.py and benchmarks each of them as in
+run_benchmarks.py (evaluation times, per-stage times and peak memory).
+
+- Tracer scaling: n_gc = n_sh = n for each n in --n-bins, with --dell.
+- Data scaling: the first value of --n-bins, for each bandpower width in
+  --dell-scan.
+
+Usage:
+    python benchmarks/run_scaling.py --n-bins 1 2 4 8 --dell-scan 40 20 10 \\
+        -o scaling.json --plot scaling.png
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from configs import CLLIKE_DIR  # noqa: E402
+from run_benchmarks import run_in_process, get_metadata  # noqa: E402
+
+sys.path.insert(0, os.path.join(CLLIKE_DIR, 'cl_like', 'tests', 'data'))
+import mk_data_scaling  # noqa: E402
+
+
+def run_point(outdir, n_bins, n_kp, lmax, dell, ell_corr, n_eval):
+    # The sacc files are reused, so the name has to identify all the
+    # settings they are generated with
+    name = (f'scaling_gc{n_bins}_sh{n_bins}_kp{n_kp}_lmax{lmax}_dell{dell}'
+            f'_ellcorr{ell_corr:g}')
+    fname = os.path.abspath(os.path.join(outdir, f'{name}.fits'))
+    if not os.path.isfile(fname):
+        print(f"Generating {fname}", flush=True)
+        mk_data_scaling.make_sacc(fname, n_gc=n_bins, n_sh=n_bins,
+                                  n_kp=n_kp, lmax=lmax, dell=dell,
+                                  ell_corr=ell_corr)
+    info = mk_data_scaling.get_info(fname, n_gc=n_bins, n_sh=n_bins,
+                                    n_kp=n_kp, lmax=lmax)
+
+    print(f"Running {name}...", flush=True)
+    res = run_in_process(name, n_eval, info)
+    res.update({'name': name, 'n_tracers': 2*n_bins + n_kp, 'dell': dell})
+    if 'error' in res:
+        print(f"  failed:\n{res['error']}")
+    else:
+        print(f"  ndata {res['ndata']}, full_eval "
+              f"{1E3*res['full_eval']['mean']:.1f}ms, peak memory "
+              f"{res['peak_memory_mb']:.0f}MB", flush=True)
+    return res
+
+
+def plot(report, fname):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2, 2, figsize=(10, 8))
+    for row, (key, xlabel) in enumerate([('tracers', 'n_tracers'),
+                                         ('data', 'ndata')]):
+        points = [r for r in report[key] if 'error' not in r]
+        if not points:
+            continue
+        x = [r[xlabel] for r in points]
+        ax = axes[row, 0]
+        ax.plot(x, [r['full_eval']['mean'] for r in points], 'ko-',
+                label='full evaluation')
+        # All the stages of all the components
+        stages = sorted({(c, s) for r in points
+                         for c, st in r['full_eval']['stages'].items()
+                         for s in st})
+        for c, s in stages:
+            ax.plot(x, [r['full_eval']['stages'].get(c, {}).get(s, 0)
+                        for r in points], '.--', label=f'{c}: {s}')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('time per evaluation [s]')
+        ax.loglog()
+        ax.legend(fontsize=6)
+        ax = axes[row, 1]
+        ax.plot(x, [r['peak_memory_mb'] for r in points], 'ko-')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('peak memory [MB]')
+        ax.set_xscale('log')
+    fig.tight_layout()
+    fig.savefig(fname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--n-bins', type=int, nargs='+', default=[1, 2, 4],
+                        help='Number of clustering (and shear) bins')
+    parser.add_argument('--n-kp', type=int, default=1,
+                        help='Number of CMB lensing tracers')
+    parser.add_argument('--lmax', type=int, default=2000)
+    parser.add_argument('--dell', type=int, default=20,
+                        help='Bandpower width for the tracer scaling')
+    parser.add_argument('--dell-scan', type=int, nargs='*',
+                        default=[80, 40, 20, 10],
+                        help='Bandpower widths for the data scaling')
+    parser.add_argument('--ell-corr', type=float, default=0.)
+    parser.add_argument('-n', '--n-eval', type=int, default=5)
+    parser.add_argument('--outdir', default='scaling_data',
+                        help='Directory for the synthetic sacc files')
+    parser.add_argument('-o', '--output', default='scaling_report.json')
+    parser.add_argument('--plot', default=None,
+                        help='Save the scaling curves to this file')
+    args = parser.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    report = {'metadata': get_metadata(), 'n_eval': args.n_eval,
+              'tracers': [], 'data': []}
+    for n in args.n_bins:
+        report['tracers'].append(run_point(args.outdir, n, args.n_kp,
+                                           args.lmax, args.dell,
+                                           args.ell_corr, args.n_eval))
+    for dell in args.dell_scan:
+        report['data'].append(run_point(args.outdir, args.n_bins[0],
+                                        args.n_kp, args.lmax, dell,
+                                        args.ell_corr, args.n_eval))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.plot is not None:
+        plot(report, args.plot)
+
+
+if __name__ == '__main__':
+    main()
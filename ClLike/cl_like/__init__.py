@@ -11,5 +11,6 @@ except:
     pass
 from .clccl import CLCCL  # noqa
 from .power_spectrum import Pk # noqa
+from .baryon_boost import BaryonBoost # noqa
 from .limber import Limber # noqa
 from .cl_final import ClFinal
@@ -2,8 +2,6 @@ import numpy as np
 import pyccl as ccl
 import baccoemu
 import warnings
-import copy
-from scipy import optimize
 
 class BaccoCalculator(object):
     """ This class implements a set of methods that can be
@@ -53,25 +51,40 @@ class BaccoCalculator(object):
             raise ValueError("baccoemu only defined for scale factors between "
                              f"1 and {amin}")
         self.a_s = a_arr
+        # Emulator inputs shared by all the baccoemu calls for the current
+        # cosmology (see _get_emu_context)
+        self._emu_ctx = None
+        # Pk2Ds computed for the current emulator outputs and the context
+        # they were computed for
+        self.pk2d_computed = {}
+        self._pk2d_ctx = None
 
-    def _check_baccoemu_baryon_pars_for_extrapolation(self, cosmopars_in):
+    def _check_baccoemu_baryon_pars_for_extrapolation(self, cosmopars_in,
+                                                      within_bounds=None):
         """ Check passed parameters, if pars for baryon emu out of range,
         return a new dictionary apt for extrapolation.
 
         Extrapolation of the bcm emulator in cosmology is done by evaluating
         the emu at the closest cosmology within the allowed parameter space,
         while modifying Ob and Oc to keep the baryon fraction fixed
+
+        If `within_bounds` (as returned by `_check_within_bounds`) is passed,
+        `cosmopars_in` is assumed to already contain sigma8_cold instead of
+        A_s and the bounds are not checked again.
         """
-        cosmopars = copy.deepcopy(cosmopars_in)
+        if within_bounds is None:
+            # Return cosmopars to get the sigma8_cold equivalent to the input
+            # As
+            within_bounds, cosmopars = \
+                self._check_within_bounds(cosmopars_in, return_cosmopars=True)
+        else:
+            cosmopars = cosmopars_in.copy()
 
-        # Return cosmopars to get the sigma8_cold equivalent to the input As
-        within_bounds, cosmopars = self._check_within_bounds(cosmopars,
-                                                             return_cosmopars=True)
         if (not self.allow_bcm_emu_extrapolation_for_shear) or \
             within_bounds['baryon']:
-            return copy.deepcopy(cosmopars), copy.deepcopy(self.a_s)
+            return cosmopars, self.a_s.copy()
 
-        cosmopars_out = copy.deepcopy(cosmopars)
+        cosmopars_out = cosmopars.copy()
 
         b_frac_orig = cosmopars['omega_baryon']/cosmopars['omega_cold']
 
@@ -90,20 +103,52 @@ class BaccoCalculator(object):
 
         b_frac = cosmopars_out['omega_baryon']/cosmopars_out['omega_cold']
         if np.round(b_frac_orig, 4) != np.round(b_frac, 4):
-            min_func = lambda o: np.abs(o[1] / o[0] - b_frac_orig)
             Oc_bounds = emulator['bounds'][0]
             Ob_bounds = emulator['bounds'][2]
-            res = optimize.minimize(min_func,
-                                    np.array([cosmopars_out['omega_cold'], cosmopars_out['omega_baryon']]),
-                                    bounds=(Oc_bounds, Ob_bounds))
-            cosmopars_out['omega_cold'] = res.x[0]
-            cosmopars_out['omega_baryon'] = res.x[1]
+            Oc, Ob = self._project_to_baryon_fraction(
+                cosmopars_out['omega_cold'], cosmopars_out['omega_baryon'],
+                b_frac_orig, Oc_bounds, Ob_bounds)
+            cosmopars_out['omega_cold'] = Oc
+            cosmopars_out['omega_baryon'] = Ob
 
-        a_s_out = copy.deepcopy(self.a_s)
+        a_s_out = self.a_s.copy()
         a_s_out[a_s_out < emulator['bounds'][-1][0]] = emulator['bounds'][-1][0]
 
         return cosmopars_out, a_s_out
 
+    def _project_to_baryon_fraction(self, omega_cold, omega_baryon, b_frac,
+                                    Oc_bounds, Ob_bounds):
+        """ Return the point (omega_cold, omega_baryon) of the emulator box
+        closest to the input one with omega_baryon / omega_cold = b_frac.
+
+        The points with the right baryon fraction lie on the line
+        omega_baryon = b_frac * omega_cold, so this is the orthogonal
+        projection onto the segment of that line within the box. If the line
+        does not cross the box, the corner with the closest baryon fraction
+        is returned.
+
+        Args:
+            omega_cold (float): input omega_cold.
+            omega_baryon (float): input omega_baryon.
+            b_frac (float): baryon fraction to preserve.
+            Oc_bounds (array_like): emulator bounds for omega_cold.
+            Ob_bounds (array_like): emulator bounds for omega_baryon.
+        """
+        Oc_min, Oc_max = Oc_bounds
+        Ob_min, Ob_max = Ob_bounds
+        if b_frac > Ob_max / Oc_min:
+            return Oc_min, Ob_max
+        elif b_frac < Ob_min / Oc_max:
+            return Oc_max, Ob_min
+
+        # Range of omega_cold for which both parameters are within bounds
+        Oc_lo = max(Oc_min, Ob_min / b_frac)
+        Oc_hi = min(Oc_max, Ob_max / b_frac)
+        Oc = (omega_cold + b_frac * omega_baryon) / (1 + b_frac**2)
+        Oc = min(max(Oc, Oc_lo), Oc_hi)
+
+        return Oc, b_frac * Oc
+
     def _check_within_bounds(self, cosmopars, return_cosmopars=False):
         """
         Check if cosmological parameters are within bounds
@@ -111,7 +156,8 @@ class BaccoCalculator(object):
         Return: dict with keys 'nonlinear' and 'baryon'. If return_cosmopars is
         True, returns the cosmopars with sigma8_cold instead of A_s.
         """
-        cosmopars = copy.deepcopy(cosmopars)
+        # The parameters are scalars, so a shallow copy is enough
+        cosmopars = cosmopars.copy()
         if 'A_s' in cosmopars:
             cosmopars['sigma8_cold'] = self.mpk.get_sigma8(**cosmopars, cold=True)
             del cosmopars['A_s']
@@ -121,7 +167,7 @@ class BaccoCalculator(object):
             if parname != 'expfactor':
                 val = cosmopars[parname]
             else:
-                val = copy.deepcopy(self.a_s)
+                val = self.a_s
             within_bounds.append(np.all(val >= self.mpk.emulator['baryon']['bounds'][i][0]) & np.all(val <= self.mpk.emulator['baryon']['bounds'][i][1]))
             within_bounds_mpk.append(np.all(val >= self.mpk.emulator['nonlinear']['bounds'][i][0]) & np.all(val <= self.mpk.emulator['nonlinear']['bounds'][i][1]))
 
@@ -132,6 +178,70 @@ class BaccoCalculator(object):
 
         return output
 
+    def _get_emu_context(self, cosmo):
+        """ Return the emulator inputs for `cosmo`, computing them only once
+        per cosmology.
+
+        The context holds the baccoemu parameters (with and without the
+        scale factor array), sigma8_cold, the result of the bounds check and
+        the k masks, so that every emulator call within a step shares them.
+        The baryon-emulator parameters (which might need extrapolation) and
+        the emulator outputs are added lazily.
+
+        The context is tied to the cosmology object (kept as a reference, so
+        that the identity check cannot match a new object at the same
+        address).
+        """
+        ctx = self._emu_ctx
+        if (ctx is not None) and (ctx['cosmo'] is cosmo):
+            return ctx
+
+        cospar = self._get_bacco_pars_from_cosmo(cosmo)
+        h = cospar['hubble']
+        within_bounds, cospar_sigma8_cold = \
+            self._check_within_bounds(cospar, return_cosmopars=True)
+
+        # HEFT
+        k_for_bacco = self.ks/h
+        # TODO: Use lbias.emulator['nonlinear']['k'].max() instead of 0.75?
+        mask_ks = np.squeeze(np.where(k_for_bacco <= 0.75))
+
+        # Shear - Shear (and baryons). The kmax depends on whether the
+        # baryon emulator is used or not
+        k_sh_sh_for_bacco = self.ks_sh_sh/h
+        masks_sh_sh = {}
+        for emu_kind in ['baryon', 'nonlinear']:
+            kmax = self.mpk.emulator[emu_kind]['k'].max()
+            masks_sh_sh[emu_kind] = \
+                np.squeeze(np.where(k_sh_sh_for_bacco <= kmax))
+
+        ctx = {'cosmo': cosmo,
+               'cospar': cospar,
+               'cospar_and_a': self._get_pars_and_a_for_bacco(cospar,
+                                                              self.a_s),
+               'cospar_sigma8_cold': cospar_sigma8_cold,
+               'within_bounds': within_bounds,
+               'h': h,
+               'mask_ks': mask_ks,
+               'masks_ks_sh_sh': masks_sh_sh}
+        self._emu_ctx = ctx
+
+        return ctx
+
+    def _get_bcm_pars_from_context(self, ctx):
+        """ Return the (possibly extrapolated) cosmological parameters and
+        scale factors for the baryon emulator, caching them in the context.
+        """
+        if 'cospar_for_bcm' not in ctx:
+            cospar_for_bcm, a_s_for_bcm = \
+                self._check_baccoemu_baryon_pars_for_extrapolation(
+                    ctx['cospar_sigma8_cold'],
+                    within_bounds=ctx['within_bounds'])
+            ctx['cospar_for_bcm'] = cospar_for_bcm
+            ctx['a_s_for_bcm'] = a_s_for_bcm
+
+        return ctx['cospar_for_bcm'], ctx['a_s_for_bcm']
+
     def _sigma8tot_2_sigma8cold(self, emupars, sigma8tot):
         """Use baccoemu to convert sigma8 total matter to sigma8 cdm+baryons
         """
@@ -151,66 +261,122 @@ class BaccoCalculator(object):
     def update_pk(self, cosmo, bcmpar=None, **kwargs):
         """ Update the internal PT arrays.
 
+        The emulator outputs that only depend on the cosmology (the HEFT
+        power spectra and the matter power spectrum for shear) are cached
+        for the current cosmology, separately from the baryonic boost. If
+        only the baryonic parameters change, only the baryon emulator is
+        called.
+
         Args:
-            pk (array_like): linear power spectrum sampled at the
-                internal `k` values used by this calculator.
+            cosmo (:obj:`ccl.Cosmology`): cosmology.
+            bcmpar (dict): baryonic parameters for the baryon emulator. If
+                None, no baryonic boost is applied.
         """
-        cospar = self._get_bacco_pars_from_cosmo(cosmo)
-        h = cospar['hubble']
-        cospar_and_a = self._get_pars_and_a_for_bacco(cospar, self.a_s)
+        ctx = self._get_emu_context(cosmo)
 
-        # HEFT
-        k_for_bacco = self.ks/h
-        # TODO: Use lbias.emulator['nonlinear']['k'].max() instead of 0.75?
-        self.mask_ks_for_bacco = np.squeeze(np.where(k_for_bacco <= 0.75))
-        k_for_bacco = k_for_bacco[self.mask_ks_for_bacco]
-        if self.ignore_lbias:
-            self.pk_temp = None
+        # Shear - Shear (and baryons). The k range is fixed by the emulator
+        # that can be used, so that the matter power spectrum is shared by
+        # the calls with and without baryonic boost (see get_baryon_pk).
+        baryonic_boost = self.use_baryon_boost and (bcmpar is not None)
+        emu_type_for_setting_kmax = \
+            'baryon' if self.use_baryon_boost else 'nonlinear'
+
+        self.mask_ks_for_bacco = ctx['mask_ks']
+        self.mask_ks_sh_sh_for_bacco = \
+            ctx['masks_ks_sh_sh'][emu_type_for_setting_kmax]
+        self.pk_temp = self._get_pk_heft(ctx)
+        pk = self._get_pk_sh_sh(ctx, emu_type_for_setting_kmax)
+
+        if baryonic_boost:
+            Sk = self._get_Sk(ctx, bcmpar)
         else:
-            self.pk_temp = self.lbias.get_nonlinear_pnn(k=k_for_bacco,
-                                                        **cospar_and_a)[1]/h**3
+            Sk = np.ones_like(pk)
 
-        # Shear - Shear (and baryons)
-        baryonic_boost = self.use_baryon_boost and (bcmpar is not None)
+        self.pk_temp_sh_sh = pk * Sk
+        self.Sk_temp = Sk
 
-        k_sh_sh_for_bacco = self.ks_sh_sh/h
-        emu_type_for_setting_kmax = 'baryon' if baryonic_boost else 'nonlinear'
-        self.mask_ks_sh_sh_for_bacco = np.squeeze(np.where(k_sh_sh_for_bacco <= self.mpk.emulator[emu_type_for_setting_kmax]['k'].max()))
-        k_sh_sh_for_bacco = k_sh_sh_for_bacco[self.mask_ks_sh_sh_for_bacco]
+        # The bias expansion Pk2Ds only depend on the cosmology
+        if self._pk2d_ctx is ctx:
+            self.pk2d_computed.pop('Sk', None)
+            self.pk2d_computed.pop('mm_sh_sh', None)
+        else:
+            self.pk2d_computed = {}
+            self._pk2d_ctx = ctx
+
+    def _get_pk_heft(self, ctx):
+        """ Return the HEFT power spectra for the cosmology in `ctx`."""
+        if 'pk_temp' not in ctx:
+            if self.ignore_lbias:
+                ctx['pk_temp'] = None
+            else:
+                h = ctx['h']
+                k_for_bacco = self.ks[ctx['mask_ks']]/h
+                ctx['pk_temp'] = \
+                    self.lbias.get_nonlinear_pnn(k=k_for_bacco,
+                                                 **ctx['cospar_and_a'])[1]/h**3
+
+        return ctx['pk_temp']
+
+    def _get_pk_sh_sh(self, ctx, emu_kind):
+        """ Return the matter power spectrum used for shear for the
+        cosmology in `ctx`, sampled up to the kmax of the `emu_kind`
+        emulator (and extrapolated with halofit beyond it if requested).
+        """
+        pk_sh_sh = ctx.setdefault('pk_sh_sh', {})
+        if emu_kind in pk_sh_sh:
+            return pk_sh_sh[emu_kind]
 
-        within_bounds_mpk = self._check_within_bounds(cospar)['nonlinear']
+        cosmo = ctx['cosmo']
+        h = ctx['h']
+        mask = ctx['masks_ks_sh_sh'][emu_kind]
+        within_bounds_mpk = ctx['within_bounds']['nonlinear']
 
         if (not within_bounds_mpk) & self.allow_halofit_extrapolation_for_shear:
             cosmo.compute_nonlin_power()
             pknl = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
-            pk = np.array([pknl.eval(self.ks_sh_sh[self.mask_ks_sh_sh_for_bacco], a, cosmo) for a in self.a_s])
+            pk = np.array([pknl.eval(self.ks_sh_sh[mask], a, cosmo) for a in self.a_s])
         else:
             # TODO: This is going to be called even if no baryons are
             # requested. Shouldn't it have a flag?
             pk = self.mpk.get_nonlinear_pk(baryonic_boost=False, cold=False,
-                                           k=k_sh_sh_for_bacco,
-                                           **cospar_and_a)[1]/h**3
-
-        if baryonic_boost:
-            Sk = self.get_baryonic_boost(cosmo, bcmpar, k_sh_sh_for_bacco)
-        else:
-            Sk = np.ones_like(pk)
+                                           k=self.ks_sh_sh[mask]/h,
+                                           **ctx['cospar_and_a'])[1]/h**3
 
         if self.allow_halofit_extrapolation_for_shear_on_k:
             cosmo.compute_nonlin_power()
             pknl = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
-            kix = self.mask_ks_sh_sh_for_bacco[-1] + 1
+            kix = mask[-1] + 1
             pkhfit = [pknl(self.ks_sh_sh[kix:], a) for a in self.a_s]
             pk = np.concatenate([pk, pkhfit], axis=1)
+
+        pk_sh_sh[emu_kind] = pk
+
+        return pk
+
+    def _get_Sk(self, ctx, bcmpar):
+        """ Return the baryonic boost for the cosmology in `ctx` and the
+        baryonic parameters `bcmpar`, sampled as the output of
+        `_get_pk_sh_sh`. The last result is cached.
+        """
+        bcm_key = tuple(sorted(bcmpar.items()))
+        if ctx.get('Sk_key') == bcm_key:
+            return ctx['Sk']
+
+        mask = ctx['masks_ks_sh_sh']['baryon']
+        Sk = self.get_baryonic_boost(ctx['cosmo'], bcmpar,
+                                     self.ks_sh_sh[mask]/ctx['h'])
+
+        if self.allow_halofit_extrapolation_for_shear_on_k:
             # Extrapolating as in CCL. We could come up with different
             # extrapolation schemes (e.g. Sk = constant?)
-            Sk2d = ccl.Pk2D(a_arr=self.a_s, lk_arr=np.log(self.ks_sh_sh[self.mask_ks_sh_sh_for_bacco]),
+            Sk2d = ccl.Pk2D(a_arr=self.a_s, lk_arr=np.log(self.ks_sh_sh[mask]),
                             pk_arr=np.log(Sk), is_logp=True)
             Sk = np.array([Sk2d(self.ks_sh_sh, ai) for ai in self.a_s])
 
-        self.pk_temp_sh_sh = pk * Sk
-        self.Sk_temp = Sk
-        self.pk2d_computed = {}
+        ctx['Sk_key'] = bcm_key
+        ctx['Sk'] = Sk
+
+        return Sk
 
     def _get_pars_and_a_for_bacco(self, pars, a):
         combined_pars = {}
@@ -237,14 +403,51 @@ class BaccoCalculator(object):
         return cospar
 
     def get_baryonic_boost(self, cosmo, bcmpar, k_arr):
-        cospar = self._get_bacco_pars_from_cosmo(cosmo)
-        cospar_for_bcm, these_a_s = self._check_baccoemu_baryon_pars_for_extrapolation(cospar)
+        ctx = self._get_emu_context(cosmo)
+        cospar_for_bcm, these_a_s = self._get_bcm_pars_from_context(ctx)
+        cospar_for_bcm = cospar_for_bcm.copy()
         cospar_for_bcm.update(bcmpar)
         cospar_for_bcm = self._get_pars_and_a_for_bacco(cospar_for_bcm,
                                                         these_a_s)
         Sk = self.mpk.get_baryonic_boost(k=k_arr, **cospar_for_bcm)[1]
         return Sk
 
+    def _get_pk2d_sh_sh(self, pk, mask):
+        """ Return the Pk2D of an array sampled as the output of
+        `_get_pk_sh_sh` with the k mask `mask`.
+        """
+        if self.allow_halofit_extrapolation_for_shear_on_k:
+            k = self.ks_sh_sh
+        else:
+            k = self.ks_sh_sh[mask]
+        return ccl.Pk2D(a_arr=self.a_s, lk_arr=np.log(k), pk_arr=np.log(pk),
+                        is_logp=True)
+
+    def get_baryon_pk(self, cosmo, bcmpar):
+        """ Return the shear-shear power spectrum with the baryonic boost
+        applied and the boost itself.
+
+        The emulator outputs that only depend on the cosmology are shared
+        with `update_pk`, but, unlike it, the power spectra returned by
+        `get_pk` are not modified.
+
+        Args:
+            cosmo (:obj:`ccl.Cosmology`): cosmology.
+            bcmpar (dict): baryonic parameters for the baryon emulator.
+
+        Returns:
+            dict: Pk2Ds for 'pk_ww' and 'Sk'.
+        """
+        if not self.use_baryon_boost:
+            raise ValueError("The calculator was initialized without "
+                             "baryonic boost.")
+        ctx = self._get_emu_context(cosmo)
+        mask = ctx['masks_ks_sh_sh']['baryon']
+        pk = self._get_pk_sh_sh(ctx, 'baryon')
+        Sk = self._get_Sk(ctx, bcmpar)
+        return {'pk_ww': self._get_pk2d_sh_sh(pk * Sk, mask),
+                'Sk': self._get_pk2d_sh_sh(Sk, mask)}
+
     def get_pk(self, kind, pnl=None, cosmo=None, sub_lowk=False, alt=None):
         # Clarification:
         # We are expanding the galaxy overdensity as:
@@ -306,22 +509,12 @@ class BaccoCalculator(object):
                 'k2k2': 1.0}
 
         if kind == 'Sk':
-            pk = np.log(self.Sk_temp)
-            if self.allow_halofit_extrapolation_for_shear_on_k:
-                k = self.ks_sh_sh
-            else:
-                k = self.ks_sh_sh[self.mask_ks_sh_sh_for_bacco]
-            pk2d = ccl.Pk2D(a_arr=self.a_s, lk_arr=np.log(k), pk_arr=pk,
-                            is_logp=True)
+            pk2d = self._get_pk2d_sh_sh(self.Sk_temp,
+                                        self.mask_ks_sh_sh_for_bacco)
             self.pk2d_computed[kind] = pk2d
         elif kind == 'mm_sh_sh':
-            if self.allow_halofit_extrapolation_for_shear_on_k:
-                k = self.ks_sh_sh
-            else:
-                k = self.ks_sh_sh[self.mask_ks_sh_sh_for_bacco]
-            pk = np.log(self.pk_temp_sh_sh)
-            pk2d = ccl.Pk2D(a_arr=self.a_s, lk_arr=np.log(k), pk_arr=pk,
-                            is_logp=True)
+            pk2d = self._get_pk2d_sh_sh(self.pk_temp_sh_sh,
+                                        self.mask_ks_sh_sh_for_bacco)
             self.pk2d_computed[kind] = pk2d
         else:
             if not self.ignore_lbias:
@@ -1,61 +1,115 @@
 import numpy as np
 import pyccl as ccl
-import pyccl.nl_pt as pt
-import copy
 from cobaya.likelihood import Likelihood
 from cobaya.log import LoggedError
-from scipy.optimize import minimize
+
+
+# eBOSS DR16 BAO data (D_M/r_d and D_H/r_d), used when no data file is given.
+# All data in:
+#  https://svn.sdss.org/public/data/eboss/DR16cosmo/tags/v1_0_1/likelihoods/BAO-only/
+_EBOSS_DR16_Z = np.array([0.38, 0.51, 0.698, 1.48])
+_EBOSS_DR16_DM = np.array([10.23406, 13.36595, 17.85824, 30.68760])
+_EBOSS_DR16_DH = np.array([24.98058, 22.31656, 19.32575, 13.26090])
+# Ordered as (D_M, D_H) for each redshift
+_EBOSS_DR16_COV = np.array(
+    [[2.860520e-02, -4.939281e-02, 1.489688e-02, -1.387079e-02,
+      0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000],
+     [-4.939281e-02, 5.307187e-01, -2.423513e-02, 1.767087e-01,
+      0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000],
+     [1.489688e-02, -2.423513e-02, 4.147534e-02, -4.873962e-02,
+      0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000],
+     [-1.387079e-02, 1.767087e-01, -4.873962e-02, 3.268589e-01,
+      0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000],
+     [0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000,
+      0.1076634008, -0.0583182034, 0.0000000000, 0.0000000000],
+     [0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000,
+      -0.0583182034, 0.28381763863, 0.0000000000, 0.0000000000],
+     [0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000,
+      0.0000000000, 0.0000000000, 0.6373160400, 0.1706891000],
+     [0.0000000000, 0.0000000000, 0.0000000000, 0.0000000000,
+      0.0000000000, 0.0000000000, 0.1706891000, 0.3046841500]])
+
+# Supported BAO observables
+BAO_QUANTITIES = ['DM_over_rs', 'DH_over_rs', 'DV_over_rs', 'DA_over_rs',
+                  'rs_over_DV']
+
+
+def load_bao_data(data_file, cov_file):
+    """ Read a BAO compilation.
+
+    Args:
+        data_file (str): text file with one data point per line, with
+            columns `z value quantity`, where quantity is one of
+            BAO_QUANTITIES. Lines starting with '#' are ignored.
+        cov_file (str): text file with the covariance of the data points,
+            in the same order.
+
+    Returns:
+        tuple: redshifts, values, quantities and covariance.
+    """
+    zs = []
+    values = []
+    quantities = []
+    with open(data_file) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            zs.append(float(line[0]))
+            values.append(float(line[1]))
+            quantities.append(line[2])
+    cov = np.atleast_2d(np.loadtxt(cov_file))
+    return np.array(zs), np.array(values), quantities, cov
 
 
 class BAOLike(Likelihood):
-    # Bins to use
-    bins: list = [0, 1, 2, 3]
+    # BAO data file and covariance (see load_bao_data). If empty, the eBOSS
+    # DR16 D_M and D_H measurements are used.
+    data_file: str = ""
+    cov_file: str = ""
+    # Redshift bins to use (indices of the distinct redshifts, in the order
+    # of the data). None for all of them.
+    bins: list = None
 
-    # All data in:
-    #  https://svn.sdss.org/public/data/eboss/DR16cosmo/tags/v1_0_1/likelihoods/BAO-only/
     def initialize(self):
-        bincov = np.array([[2*b, 2*b+1] for b in self.bins]).flatten()
         self.r_d_fid = 147.78
-        self.a_s = 1/(1+self.zs_all[self.bins])
-        dMs = self.dMs_all[self.bins]
-        dHs = self.dHs_all[self.bins]
-        self.cov = self.cov_all[bincov][:, bincov]
-        self.mean = np.concatenate((dMs, dHs)).T.flatten()
+        if self.data_file:
+            zs, values, quantities, cov = load_bao_data(self.data_file,
+                                                        self.cov_file)
+        else:
+            zs = np.repeat(_EBOSS_DR16_Z, 2)
+            values = np.array([_EBOSS_DR16_DM, _EBOSS_DR16_DH]).T.flatten()
+            quantities = ['DM_over_rs', 'DH_over_rs'] * len(_EBOSS_DR16_Z)
+            cov = _EBOSS_DR16_COV
+        if cov.shape != (len(zs), len(zs)):
+            raise LoggedError(self.log, "The BAO covariance does not match "
+                              "the number of data points.")
+        for q in quantities:
+            if q not in BAO_QUANTITIES:
+                raise LoggedError(self.log, f"Unknown BAO quantity {q}. "
+                                  f"Available: {BAO_QUANTITIES}")
+
+        # Select bins
+        z_bins = list(dict.fromkeys(zs))
+        bins = range(len(z_bins)) if self.bins is None else self.bins
+        use = np.isin(zs, [z_bins[b] for b in bins])
+        self.zs = zs[use]
+        self.mean = values[use]
+        self.cov = cov[use][:, use]
         self.icov = np.linalg.inv(self.cov)
+        quantities = np.array(quantities)[use]
+
+        # All the distances are computed at the distinct scale factors, and
+        # each point picks its quantity from them
+        z_unique, self._z_index = np.unique(self.zs, return_inverse=True)
+        self.a_s = 1/(1+z_unique)
+        self._q_index = np.array([BAO_QUANTITIES.index(q)
+                                  for q in quantities])
+        self._method_name = f'{self.get_name()}_theory'
 
     def get_requirements(self):
-        return {"CCL": None}
-
-    @property
-    def dMs_all(self):
-        return np.array([10.23406, 13.36595, 17.85824, 30.68760])
-
-    @property
-    def dHs_all(self):
-        return np.array([24.98058, 22.31656, 19.32575, 13.26090])
-
-    @property
-    def zs_all(self):
-        return np.array([0.38, 0.51, 0.698, 1.48])
-
-    @property
-    def cov_all(self):
-        return np.array([[ 2.860520e-02, -4.939281e-02,  1.489688e-02, -1.387079e-02,
-                          0.0000000000,  0.0000000000,  0.0000000000, 0.0000000000],
-                         [-4.939281e-02,  5.307187e-01, -2.423513e-02,  1.767087e-01,
-                          0.0000000000,  0.0000000000,  0.0000000000, 0.0000000000],
-                         [ 1.489688e-02, -2.423513e-02,  4.147534e-02, -4.873962e-02,
-                          0.0000000000,  0.0000000000,  0.0000000000, 0.0000000000],
-                         [-1.387079e-02,  1.767087e-01, -4.873962e-02,  3.268589e-01,
-                          0.0000000000,  0.0000000000,  0.0000000000, 0.0000000000],
-                         [ 0.0000000000,  0.0000000000,  0.0000000000,  0.0000000000,
-                          0.1076634008, -0.0583182034,  0.0000000000, 0.0000000000],
-                         [ 0.0000000000,  0.0000000000,  0.0000000000,  0.0000000000,
-                          -0.0583182034, 0.28381763863,  0.0000000000, 0.0000000000],
-                         [ 0.0000000000,  0.0000000000,  0.0000000000,  0.0000000000,
-                          0.0000000000,  0.0000000000,  0.6373160400, 0.1706891000],
-                         [ 0.0000000000,  0.0000000000,  0.0000000000,  0.0000000000,
-                          0.0000000000,  0.0000000000,  0.1706891000, 0.3046841500]])
+        # The theory vector is cached by the CCL theory for each cosmology
+        return {"CCL": {"methods": {self._method_name: self.get_theory}}}
 
     def get_rd(self, cosmo):
         om = cosmo['Omega_m']*cosmo['h']**2
@@ -66,12 +120,16 @@ class BAOLike(Likelihood):
     def get_theory(self, cosmo):
         r_d = self.get_rd(cosmo)
         H0 = cosmo['h']/ccl.physical_constants.CLIGHT_HMPC
-        dM = ccl.comoving_radial_distance(cosmo, self.a_s)/r_d
-        dH = 1/(H0*ccl.h_over_h0(cosmo, self.a_s)*r_d)
-        return np.concatenate((dM, dH)).T.flatten()
+        # Single background evaluation at all the redshifts
+        dM = ccl.comoving_angular_distance(cosmo, self.a_s)[self._z_index]
+        dH = 1/(H0*ccl.h_over_h0(cosmo, self.a_s))[self._z_index]
+        dV = (self.zs*dM**2*dH)**(1/3)
+        # Same order as BAO_QUANTITIES
+        theory = np.array([dM/r_d, dH/r_d, dV/r_d, dM/(1+self.zs)/r_d,
+                           r_d/dV])
+        return theory[self._q_index, np.arange(len(self.zs))]
 
     def logp(self, **params_values):
-        cosmo = self.provider.get_CCL()["cosmo"]
-        theory = self.get_theory(cosmo)
+        theory = self.provider.get_CCL()[self._method_name]
         res = theory-self.mean
         return -0.5 * np.dot(res, np.dot(self.icov, res))
@@ -0,0 +1,196 @@
+"""
+Theory class that applies the baryonic effects to the power spectra computed
+by the Pk theory class. Keeping the baryonic parameters in a separate stage
+means that changing them does not trigger the recomputation of the
+(perturbation theory or emulated) power spectra, which only depend on
+cosmology.
+"""
+from cobaya.theory import Theory
+import pyccl as ccl
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+from .timing import StageTimer
+
+
+# Parameters sampled by each baryon model. The CCL_BCM parameters are part of
+# the CCL cosmology, so they are owned by the CCL theory class.
+BARYON_PARAMS = {'Bacco': ["M_c", "eta", "beta", "M1_z0_cen", "theta_out",
+                           "theta_inn", "M_inn"],
+                 'CCL_BCM': [],
+                 'Amon-Efstathiou': ["A_AE"]}
+
+
+class BaryonBoostCalculator(object):
+    """ Computes the baryonic suppression S(k) and the corrected shear-shear
+    power spectrum for the models that are not tied to a particular power
+    spectrum calculator (i.e. 'CCL_BCM' and 'Amon-Efstathiou').
+
+    The boosts are evaluated on the whole (a, k) grid at once and the
+    cosmology dependent arrays are cached, so that only the baryonic
+    parameters need to be applied when the cosmology does not change.
+
+    The input dictionary of power spectra is never modified. The methods
+    return a dictionary with the entries that need to be updated.
+    """
+    def __init__(self):
+        # Single entry caches keyed on the identity of the cosmology and of
+        # the pk_ww Pk2D object. Keeping the references prevents the ids from
+        # being reused.
+        self._bcm_cache = None
+        self._ae_cache = None
+
+    def _is_cached(self, cache, cosmo, pk_ww):
+        return (cache is not None) and (cache['cosmo'] is cosmo) and \
+            (cache['pk_ww'] is pk_ww)
+
+    def get_bcm_fka(self, cosmo, k, a):
+        """ Vectorized version of ccl.bcm.bcm_model_fka. Returns the BCM
+        suppression evaluated on the grid defined by the 1D arrays a and k,
+        with shape (len(a), len(k)).
+        """
+        z = 1/np.atleast_1d(a)[:, None] - 1
+        kh = np.atleast_1d(k)[None, :] / cosmo['h']
+        b0 = 0.105*cosmo['bcm_log10Mc'] - 1.27
+        bfunc = b0 / (1 + (z/2.3)**2.5)
+        kg = 0.7 * (1 - bfunc)**4 * cosmo['bcm_etab']**(-1.6)
+        gf = bfunc / (1 + (kh/kg)**3) + 1 - bfunc
+        scomp = 1 + (kh / cosmo['bcm_ks'])**2
+        return gf * scomp
+
+    def get_bcm_pk_data(self, cosmo, pkd, is_PT_bias):
+        """ Returns S(k) for the CCL BCM model. If is_PT_bias, pk_ww (and all
+        the entries pointing to the same object) are also corrected. If the
+        bias is Linear, pk_ww already has the baryon boost applied.
+        """
+        pk_ww = pkd['pk_ww']
+        if not self._is_cached(self._bcm_cache, cosmo, pk_ww):
+            a_arr, lnk, pkww = pk_ww.get_spline_arrays()
+            Sk = self.get_bcm_fka(cosmo, np.exp(lnk), a_arr)
+            out = {'Sk': ccl.Pk2D(a_arr=a_arr, lk_arr=lnk,
+                                  pk_arr=np.log(Sk), is_logp=True)}
+            if is_PT_bias:
+                out['pk_ww'] = ccl.Pk2D(a_arr=a_arr, lk_arr=lnk,
+                                        pk_arr=np.log(pkww*Sk), is_logp=True)
+            self._bcm_cache = {'cosmo': cosmo, 'pk_ww': pk_ww, 'out': out}
+
+        out = self._bcm_cache['out'].copy()
+        if 'pk_ww' in out:
+            out.update({key: out['pk_ww'] for key, pk in pkd.items()
+                        if pk is pk_ww})
+        return out
+
+    def _get_ae_arrays(self, cosmo, pk_ww):
+        """ Returns the scale factors, log(k) and the linear and nonlinear
+        power spectra on the grid of the linear power spectrum (restricted to
+        the range of pk_ww).
+        """
+        if self._is_cached(self._ae_cache, cosmo, pk_ww):
+            return self._ae_cache['arrays']
+
+        a, lnk, pklin = cosmo.get_linear_power().get_spline_arrays()
+        a_nl, lnk_nl, pknonlin = pk_ww.get_spline_arrays()
+        if not (np.array_equal(a, a_nl) and np.array_equal(lnk, lnk_nl)):
+            # Different grids (e.g. BaccoPT). Interpolate pk_ww on the
+            # linear grid, keeping only the points within the pk_ww grid,
+            # since the spline would not extrapolate it. CCL extrapolates
+            # the resulting Pk2D outside them, as it would do for pk_ww.
+            ma = (a >= a_nl[0]) & (a <= a_nl[-1])
+            mk = (lnk >= lnk_nl[0]) & (lnk <= lnk_nl[-1])
+            a, lnk, pklin = a[ma], lnk[mk], pklin[np.ix_(ma, mk)]
+            lpk_nl = RectBivariateSpline(a_nl, lnk_nl, np.log(pknonlin))
+            pknonlin = np.exp(lpk_nl(a, lnk))
+
+        arrays = (a, lnk, pklin, pknonlin)
+        self._ae_cache = {'cosmo': cosmo, 'pk_ww': pk_ww, 'arrays': arrays}
+        return arrays
+
+    def get_ae_pk_data(self, cosmo, pkd, A_AE):
+        """ Returns S(k) and the corrected pk_ww for the Amon & Efstathiou
+        model: P(k) = P_lin(k) + A_AE * (P_nl(k) - P_lin(k)).
+        """
+        a, lnk, pklin, pknonlin = self._get_ae_arrays(cosmo, pkd['pk_ww'])
+        pkb = pklin + A_AE*(pknonlin - pklin)
+        Sk = pkb / pknonlin
+        return {'pk_ww': ccl.Pk2D(a_arr=a, lk_arr=lnk, pk_arr=np.log(pkb),
+                                  is_logp=True),
+                'Sk': ccl.Pk2D(a_arr=a, lk_arr=lnk, pk_arr=np.log(Sk),
+                               is_logp=True)}
+
+
+class BaryonBoost(Theory):
+    """Applies the baryonic boost to the power spectra computed by Pk"""
+    # Baryon model name: 'Bacco', 'CCL_BCM' or 'Amon-Efstathiou'
+    baryon_model: str = 'Bacco'
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
+
+    def initialize(self):
+        self.timer = StageTimer(self.get_name(), enabled=self.timing,
+                                profile=self.profile)
+        if self.baryon_model not in BARYON_PARAMS:
+            raise ValueError("baryon_model must be one of 'Bacco', "
+                             "'CCL_BCM' or 'Amon-Efstathiou'")
+        self.baryon_calc = BaryonBoostCalculator()
+        self.is_PT_bias = None
+        self.bias_model = None
+        self.provider = None
+
+    def initialize_with_provider(self, provider):
+        self.provider = provider
+        self.is_PT_bias = self.provider.get_is_PT_bias()
+        self.bias_model = self.provider.get_bias_model()
+        if (self.baryon_model == 'Bacco') and (self.bias_model != 'BaccoPT'):
+            raise ValueError("baryon_model 'Bacco' can only be used with "
+                             "bias_model 'BaccoPT' at the moment.")
+
+    def get_requirements(self):
+        return {'bias_model': None, 'is_PT_bias': None}
+
+    def must_provide(self, **requirements):
+        if "Pk_baryons" not in requirements:
+            return {}
+
+        # Tell Pk that the baryonic effects are applied here
+        return {"CCL": None, "Pk": {"baryon_stage": self.baryon_model}}
+
+    def get_can_support_params(self):
+        return BARYON_PARAMS[self.baryon_model]
+
+    def get_can_provide_params(self):
+        return self.timer.get_param_names()
+
+    def calculate(self, state, want_derived=True, **params_values_dict):
+        self.timer.start_step()
+        try:
+            cosmo = self.provider.get_CCL()["cosmo"]
+            pk = self.provider.get_Pk()
+            # Shallow copy: the Pk state must not be modified
+            pkd = pk['pk_data'].copy()
+            bcmpar = {p: params_values_dict[p]
+                      for p in BARYON_PARAMS[self.baryon_model]}
+
+            if self.baryon_model == 'Bacco':
+                # The cosmology dependent emulator outputs are cached in the
+                # calculator, so only the baryonic boost is recomputed here.
+                # The power spectra computed by Pk are left untouched.
+                pkd.update(pk['bacco_calc'].get_baryon_pk(cosmo, bcmpar))
+            elif self.baryon_model == 'CCL_BCM':
+                pkd.update(self.baryon_calc.get_bcm_pk_data(cosmo, pkd,
+                                                            self.is_PT_bias))
+            else:
+                pkd.update(self.baryon_calc.get_ae_pk_data(cosmo, pkd,
+                                                           bcmpar['A_AE']))
+
+            state['Pk_baryons'] = {'pk_data': pkd}
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
+
+    def get_Pk_baryons(self):
+        return self._current_state['Pk_baryons']
@@ -0,0 +1,165 @@
+"""
+On-disk cache of the Boltzmann code outputs (background and linear and
+nonlinear matter power spectra) used by the CCL theory class. Each cosmology
+is stored as a set of .npy files (loaded memory-mapped) in its own directory,
+named after a hash of the cosmological parameters and CCL settings. An index
+file keeps track of the entries. Reading an entry updates the modification
+time of its directory, which is used to remove the least recently used ones.
+The index is only rewritten when entries are added or removed, holding a lock
+shared by all the processes using the cache.
+"""
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pyccl as ccl
+
+
+class BoltzmannCache(object):
+    """ Persistent cache of CCL cosmologies.
+
+    Args:
+        path (str): directory where the cache is stored.
+        max_entries (int): maximum number of cosmologies kept. The least
+            recently used ones are removed first.
+    """
+    # Background sampling
+    z_bg = np.concatenate((np.linspace(0, 10, 100),
+                           np.geomspace(10, 1500, 50)[1:]))
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.index_file = os.path.join(path, 'index.json')
+        self.lock_file = os.path.join(path, 'index.lock')
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def _lock_index(self):
+        # Exclusive lock for the read-modify-write of the index
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        if not os.path.isfile(self.index_file):
+            return {}
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except ValueError:
+            # Corrupted index (e.g. interrupted write). Start again.
+            return {}
+
+    def _write_index(self, index):
+        # Write and rename, so that the index is never partially written
+        tmp = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    def _touch(self, index, key):
+        index[key] = max(index.values(), default=0) + 1
+
+    def _get_last_use(self, index, key):
+        # Entries are ordered by the last time they were read (see load) and
+        # then by insertion
+        try:
+            mtime = os.stat(os.path.join(self.path, key)).st_mtime_ns
+        except OSError:
+            mtime = -1
+        return (mtime, index[key])
+
+    def get_key(self, params, **config):
+        """ Return the hash identifying the cosmological parameters and the
+        CCL settings (e.g. transfer function and nonlinear model).
+        """
+        d = {'params': params, 'config': config,
+             'ccl_version': ccl.__version__}
+        s = json.dumps(d, sort_keys=True, default=repr)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def load(self, key):
+        """ Return the dictionary of cached arrays for key, or None if it is
+        not in the cache.
+        """
+        index = self._read_index()
+        dirname = os.path.join(self.path, key)
+        if (key not in index) or not os.path.isdir(dirname):
+            return None
+
+        try:
+            arrays = {fname[:-4]: np.load(os.path.join(dirname, fname),
+                                          mmap_mode='r')
+                      for fname in os.listdir(dirname)}
+        except (OSError, ValueError):
+            return None
+
+        # Mark as recently used without rewriting the index
+        try:
+            os.utime(dirname)
+        except OSError:
+            pass
+        return arrays
+
+    def save(self, key, arrays):
+        """ Store the dictionary of arrays under key, removing the least
+        recently used entries if the cache is full.
+        """
+        dirname = os.path.join(self.path, key)
+        tmpdir = f'{dirname}.{os.getpid()}.tmp'
+        os.makedirs(tmpdir, exist_ok=True)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmpdir, f'{name}.npy'), arr)
+        try:
+            os.replace(tmpdir, dirname)
+        except OSError:
+            # Saved by another process in the meantime (renaming onto a
+            # non-empty directory fails)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        with self._lock_index():
+            index = self._read_index()
+            self._touch(index, key)
+            while len(index) > self.max_entries:
+                oldest = min(index,
+                             key=lambda k: self._get_last_use(index, k))
+                del index[oldest]
+                shutil.rmtree(os.path.join(self.path, oldest),
+                              ignore_errors=True)
+            self._write_index(index)
+
+    def get_arrays(self, cosmo):
+        """ Return the background and power spectrum arrays of cosmo. """
+        a_bg = 1./(1+self.z_bg[::-1])
+        cosmo.compute_linear_power()
+        cosmo.compute_nonlin_power()
+        a_pk, lnk, pk_lin = cosmo.get_linear_power().get_spline_arrays()
+        a_nl, lnk_nl, pk_nl = cosmo.get_nonlin_power().get_spline_arrays()
+        return {'a_bg': a_bg,
+                'chi': ccl.comoving_radial_distance(cosmo, a_bg),
+                'h_over_h0': ccl.h_over_h0(cosmo, a_bg),
+                'a_pk': a_pk, 'k_pk': np.exp(lnk), 'pk_lin': pk_lin,
+                'a_nl': a_nl, 'k_nl': np.exp(lnk_nl), 'pk_nl': pk_nl}
+
+    def get_cosmology(self, params, arrays):
+        """ Return the ccl.CosmologyCalculator for params built from the
+        cached arrays.
+        """
+        # The calculator needs arrays in memory
+        arrays = {k: np.array(v) for k, v in arrays.items()}
+        name = 'delta_matter:delta_matter'
+        return ccl.CosmologyCalculator(
+            **params,
+            background={'a': arrays['a_bg'], 'chi': arrays['chi'],
+                        'h_over_h0': arrays['h_over_h0']},
+            pk_linear={'a': arrays['a_pk'], 'k': arrays['k_pk'],
+                       name: arrays['pk_lin']},
+            pk_nonlin={'a': arrays['a_nl'], 'k': arrays['k_nl'],
+                       name: arrays['pk_nl']})
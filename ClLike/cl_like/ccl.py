@@ -37,8 +37,11 @@ in CCL, so this is far from general.
 import numpy as np
 import pyccl as ccl
 import numpy as np
+from collections import OrderedDict
 from packaging import version
+from scipy.interpolate import RegularGridInterpolator
 from cobaya.theory import Theory
+from cobaya.log import LoggedError
 
 try:
     import baccoemu
@@ -48,6 +51,39 @@ except ImportError as e:
     BACCO_exception = e
     HAVE_BACCO = False
 
+if HAVE_BACCO:
+    from .pk_emulator import BaccoLinearEmulator
+
+from .boltzmann_cache import BoltzmannCache
+from .timing import StageTimer
+
+
+# CAMB HMCode parameters, passed through ccl_arguments['extra_parameters']
+HMCODE_CAMB_PARAMS = ["HMCode_logT_AGN", "HMCode_A_baryon",
+                      "HMCode_eta_baryon"]
+
+
+class LazyCCLResults(dict):
+    """ Dictionary of CCL results. `results['cosmo']` is the CCL cosmology
+    object, and the methods passed in the requirements are evaluated on it
+    the first time their results are accessed.
+    """
+    def __init__(self, cosmo, methods):
+        super().__init__(cosmo=cosmo)
+        self._methods = methods
+
+    def __missing__(self, key):
+        if key not in self._methods:
+            raise KeyError(key)
+        value = self[key] = self._methods[key](self['cosmo'])
+        return value
+
+    def __contains__(self, key):
+        return super().__contains__(key) or (key in self._methods)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
 
 class CCL(Theory):
     """
@@ -60,11 +96,72 @@ class CCL(Theory):
     matter_pk: str = 'halofit'
     baryons_pk: str = 'nobaryons'
     sigma8_to_As: str = ''
+    # Table of sigma8/sqrt(A_s) used to convert sigma8 to A_s when
+    # sigma8_to_As is set (see make_sigma8_to_As_table)
+    sigma8_to_As_table: str = ''
+    # Number of sigma8/sqrt(A_s) values kept in memory
+    sigma8_to_As_cache_size: int = 16
     ccl_arguments: dict = {}
+    # Linear matter power spectrum emulator used instead of the Boltzmann
+    # solver. Currently only 'baccoemu' ('' to use transfer_function)
+    pk_emulator: str = ''
+    # List of cosmologies (dicts of CCL parameters) at which the emulator is
+    # checked against CAMB when initializing
+    pk_emulator_validation: list = []
+    # Maximum relative difference allowed in the validation
+    pk_emulator_rtol: float = 0.01
+    # If True, when only A_s (or sigma8) and n_s change, the last linear
+    # power spectrum is rescaled instead of calling the Boltzmann code.
+    reuse_transfer: bool = False
+    # Pivot scale of the primordial power spectrum in 1/Mpc (as in CCL)
+    k_pivot: float = 0.05
+    # Directory of the on-disk cache of Boltzmann code outputs ('' to
+    # disable it) and maximum number of cosmologies stored
+    boltzmann_cache: str = ''
+    boltzmann_cache_size: int = 1000
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(),
+                                stages=['cosmology', 'derived'],
+                                counters=['boltzmann_cache_hits',
+                                          'transfer_reused',
+                                          'sigma8_As_cache_hits'],
+                                enabled=self.timing,
+                                profile=self.profile)
         self._required_results = {}
         self.baccompk = None
+        self.pk_emu = None
+        # sigma8/sqrt(A_s) for the last sets of non-amplitude parameters
+        self._sigma8_As_cache = OrderedDict()
+        self._sigma8_As_interp = None
+        if self.sigma8_to_As_table:
+            self._sigma8_As_interp = \
+                load_sigma8_to_As_table(self.sigma8_to_As_table)
+
+        if self.pk_emulator:
+            self._initialize_pk_emulator()
+
+        self.bcache = None
+        if self.boltzmann_cache:
+            if self.baryons_pk != 'nobaryons':
+                raise ValueError("boltzmann_cache cannot be used with "
+                                 "baryons_pk")
+            self.bcache = BoltzmannCache(self.boltzmann_cache,
+                                         self.boltzmann_cache_size)
+
+        # Linear power spectrum of the last cosmology computed with the
+        # Boltzmann code
+        self._transfer_cache = None
+        if self.reuse_transfer:
+            if (self.matter_pk not in ['halofit', 'linear']) or \
+                    (self.baryons_pk != 'nobaryons') or self.ccl_arguments:
+                raise ValueError("reuse_transfer can only be used with "
+                                 "matter_pk 'halofit' or 'linear', no "
+                                 "baryons_pk and no ccl_arguments")
 
         # When ccl_arguments is not provided, Cobaya saves it in the
         # updated.yaml as null. When resuming the chains, we need to change the
@@ -72,6 +169,36 @@ class CCL(Theory):
         if self.ccl_arguments is None:
             self.ccl_arguments = {}
 
+    def _initialize_pk_emulator(self):
+        if self.pk_emulator != 'baccoemu':
+            raise ValueError("pk_emulator must be '' or 'baccoemu'")
+        if not HAVE_BACCO:
+            raise BACCO_exception
+        if self.baryons_pk != 'nobaryons':
+            raise ValueError("The baryonic effects cannot be included in the "
+                             "CCL cosmology when pk_emulator is used.")
+        # The emulated cosmology is built from the emulated linear P(k)
+        # only, so none of the Boltzmann or nonlinear options would be used
+        if self.ccl_arguments:
+            raise LoggedError(self.log, "ccl_arguments cannot be used with "
+                              "pk_emulator.")
+        if self.matter_pk not in BaccoLinearEmulator.matter_pk_models:
+            raise LoggedError(self.log, f"matter_pk '{self.matter_pk}' "
+                              "cannot be used with pk_emulator. Supported: "
+                              f"{BaccoLinearEmulator.matter_pk_models}")
+
+        self.pk_emu = BaccoLinearEmulator()
+        if self.pk_emulator_validation:
+            rel_diff = self.pk_emu.validate(self.pk_emulator_validation)
+            for pars, rd in zip(self.pk_emulator_validation, rel_diff):
+                self.log.info(f"pk_emulator vs CAMB at {pars}: maximum "
+                              f"relative difference {rd:.2e}")
+            if np.any(rel_diff > self.pk_emulator_rtol):
+                raise ValueError("pk_emulator is not accurate enough at the "
+                                 "validation points: maximum relative "
+                                 f"difference {rel_diff.max():.2e} > "
+                                 f"{self.pk_emulator_rtol}")
+
     def initialize_with_params(self):
         if ('A_sE9' not in self.input_params) and \
             ('sigma8' not in self.input_params) and \
@@ -83,6 +210,11 @@ class CCL(Theory):
         elif ('Omega_m' in self.input_params) and \
                 ('Omega_c' in self.input_params):
             raise ValueError("Only one of Omega_c or Omega_m must be set")
+        if self.pk_emu is not None:
+            hmcode = [p for p in HMCODE_CAMB_PARAMS if p in self.input_params]
+            if hmcode:
+                raise LoggedError(self.log, f"The HMCode parameters {hmcode} "
+                                  "cannot be used with pk_emulator.")
 
     def get_allow_agnostic(self):
         # Pass all parameters without unknown prefix to this class
@@ -105,7 +237,8 @@ class CCL(Theory):
 
     def get_can_provide_params(self):
         # return any derived quantities that CCL can compute
-        return ['S8', 'sigma8', "Omega_m", "Omega_nu", "Omega_c"]
+        return ['S8', 'sigma8', "Omega_m", "Omega_nu", "Omega_c"] + \
+            self.timer.get_param_names()
 
     def _get_ccl_param_or_arg(self, param_name, default):
         if param_name in self.ccl_arguments:
@@ -152,6 +285,39 @@ class CCL(Theory):
     def _get_As_from_sigma8(self, pars):
         pars = pars.copy()
         sigma8 = pars.pop('sigma8')
+        # sigma8 is proportional to sqrt(A_s) at fixed non-amplitude
+        # parameters, so we only need their ratio.
+        ratio = self._get_sigma8_As_ratio(pars)
+        A_s = (sigma8 / ratio)**2
+
+        return A_s
+
+    def _get_sigma8_As_ratio(self, pars):
+        """ Return sigma8/sqrt(A_s) for the non-amplitude parameters `pars`.
+        It is read from the sigma8_to_As_table (if given and `pars` are
+        within it), or from the cache of the last computed values.
+        Otherwise, it is computed and cached.
+        """
+        if self._sigma8_As_interp is not None:
+            ratio = self._sigma8_As_interp(pars)
+            if ratio is not None:
+                return ratio
+
+        key = tuple(sorted((k, repr(v)) for k, v in pars.items()))
+        cache = self._sigma8_As_cache
+        if key in cache:
+            self.timer.count('sigma8_As_cache_hits')
+            cache.move_to_end(key)
+            return cache[key]
+
+        ratio = self._compute_sigma8_As_ratio(pars)
+        cache[key] = ratio
+        if len(cache) > self.sigma8_to_As_cache_size:
+            cache.popitem(last=False)
+
+        return ratio
+
+    def _compute_sigma8_As_ratio(self, pars):
         A_s_fid = 2.1e-9
 
         if HAVE_BACCO and (self.sigma8_to_As == 'baccoemu'):
@@ -173,65 +339,128 @@ class CCL(Theory):
             }
             sigma8_fid = mpk.get_sigma8(cold=False, A_s=A_s_fid, **params)
         else:
-            cosmo = ccl.Cosmology(**pars, A_s=A_s_fid)
-            sigma8_fid = ccl.sigma8(cosmo)
+            return get_sigma8_As_ratio_ccl(pars, A_s_fid)
 
-        A_s = (sigma8 / sigma8_fid)**2 * A_s_fid
-
-        return A_s
+        return sigma8_fid / np.sqrt(A_s_fid)
 
     def calculate(self, state, want_derived=True, **params_values_dict):
         # Generate the CCL cosmology object which can then be used downstream
-
-        # Copy input_params. We will be removing elements that we extract from
-        # it to pass to ccl.Cosmology all the remaining parameters.
-        input_params = list(self.input_params)
-        #
-        Ob = self.provider.get_param('Omega_b')
-        input_params.remove('Omega_b')
-
-        Onu = self._get_Onu()
-        if 'Omega_c' in self.input_params:
-            Oc = self.provider.get_param('Omega_c')
-            input_params.remove('Omega_c')
-            Om = Ob + Oc + Onu
-        else:
-            Om = self.provider.get_param('Omega_m')
-            input_params.remove('Omega_m')
-            Oc = Om - Ob - Onu
-
-        # Parameters accepted by CCL
-        params = {'Omega_c': Oc,
-                  'Omega_b': Ob}
-
-        if 'A_sE9' in self.input_params:
-            params.update({'A_s': self.provider.get_param('A_sE9')*1E-9})
-            input_params.remove('A_sE9')
-        elif 'S8' in self.input_params:
-            sigma8 = self.provider.get_param('S8') * np.sqrt(0.3 / Om)
-            input_params.remove('S8')
-            params.update({'sigma8': sigma8})
+        self.timer.start_step()
+        try:
+            # Copy input_params. We will be removing elements that we
+            # extract from it to pass to ccl.Cosmology all the remaining
+            # parameters.
+            input_params = list(self.input_params)
+            #
+            Ob = self.provider.get_param('Omega_b')
+            input_params.remove('Omega_b')
+
+            Onu = self._get_Onu()
+            if 'Omega_c' in self.input_params:
+                Oc = self.provider.get_param('Omega_c')
+                input_params.remove('Omega_c')
+                Om = Ob + Oc + Onu
+            else:
+                Om = self.provider.get_param('Omega_m')
+                input_params.remove('Omega_m')
+                Oc = Om - Ob - Onu
+
+            # Parameters accepted by CCL
+            params = {'Omega_c': Oc,
+                      'Omega_b': Ob}
+
+            if 'A_sE9' in self.input_params:
+                params.update({'A_s': self.provider.get_param('A_sE9')*1E-9})
+                input_params.remove('A_sE9')
+            elif 'S8' in self.input_params:
+                sigma8 = self.provider.get_param('S8') * np.sqrt(0.3 / Om)
+                input_params.remove('S8')
+                params.update({'sigma8': sigma8})
+            else:
+                params.update({'sigma8': self.provider.get_param('sigma8')})
+                input_params.remove('sigma8')
+
+            for p in input_params:
+                params[p] = self.provider.get_param(p)
+
+            # Read HMCode CAMB params
+            ccl_arguments = self.ccl_arguments.copy()
+            for p in HMCODE_CAMB_PARAMS:
+                if p in params:
+                    val = params.pop(p)
+                    ccl_arguments['extra_parameters']['camb'][p] = val
+
+            if self.sigma8_to_As and ('sigma8' in params):
+                # E.g. needed to use HMCode with CAMB
+                params['A_s'] = self._get_As_from_sigma8(params)
+                del params['sigma8']
+
+            with self.timer.stage('cosmology'):
+                if self.pk_emu is not None:
+                    cosmo = self.pk_emu.get_cosmology(params,
+                                                      matter_pk=self.matter_pk)
+                elif self.reuse_transfer:
+                    cosmo = self._get_cosmology_reusing_transfer(params)
+                else:
+                    cosmo = self._get_cosmology(params, ccl_arguments)
+
+            # The methods passed in the requirements are only evaluated when
+            # their results are accessed
+            state['CCL'] = LazyCCLResults(cosmo, self._required_results)
+
+            # Compute derived parameters, only if required
+            if want_derived:
+                with self.timer.stage('derived'):
+                    state['derived'] = self._get_derived(cosmo, params, Om, Oc,
+                                                         Onu)
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
+
+    def _get_derived(self, cosmo, params, Om, Oc, Onu):
+        derived = {}
+        requested = self.output_params
+        # Compute sigma8 if it is not an input parameter
+        if 'sigma8' not in self.input_params:
+            if ('sigma8' in requested) or ('S8' in requested):
+                sigma8 = ccl.sigma8(cosmo)
+                if 'sigma8' in requested:
+                    derived['sigma8'] = sigma8
         else:
-            params.update({'sigma8': self.provider.get_param('sigma8')})
-            input_params.remove('sigma8')
+            sigma8 = cosmo['sigma8']
 
-        for p in input_params:
-            params[p] = self.provider.get_param(p)
+        if ('S8' not in self.input_params) and ('S8' in requested):
+            derived['S8'] = sigma8*np.sqrt(Om/0.3)
 
-        # Read HMCode CAMB params
-        ccl_arguments = self.ccl_arguments.copy()
-        hmcode_camb = ["HMCode_logT_AGN", "HMCode_A_baryon",
-                       "HMCode_eta_baryon"]
+        if ('A_s' not in self.input_params) and ('A_s' in params) and \
+                ('A_s' in requested):
+            derived['A_s'] = params['A_s']
 
-        for p in hmcode_camb:
-            if p in params:
-                val = params.pop(p)
-                ccl_arguments['extra_parameters']['camb'][p] = val
+        for p, val in [('Omega_m', Om), ('Omega_nu', Onu)]:
+            if p in requested:
+                derived[p] = val
+        if ('Omega_c' not in self.input_params) and ('Omega_c' in requested):
+            derived['Omega_c'] = Oc
 
-        if self.sigma8_to_As and ('sigma8' in params):
-            # E.g. needed to use HMCode with CAMB
-            params['A_s'] = self._get_As_from_sigma8(params)
-            del params['sigma8']
+        return derived
+
+    def _get_cosmology(self, params, ccl_arguments):
+        """ Return the CCL cosmology for `params`, reading it from the
+        Boltzmann cache if possible.
+        """
+        if self.bcache is not None:
+            key = self.bcache.get_key(params,
+                                      transfer_function=self.transfer_function,
+                                      matter_pk=self.matter_pk,
+                                      ccl_arguments=ccl_arguments)
+            arrays = self.bcache.load(key)
+            if arrays is not None:
+                self.timer.count('boltzmann_cache_hits')
+                return self.bcache.get_cosmology(params, arrays)
 
         cosmo = ccl.Cosmology(**params,
                               transfer_function=self.transfer_function,
@@ -239,32 +468,53 @@ class CCL(Theory):
                               baryons_power_spectrum=self.baryons_pk,
                               **ccl_arguments)
 
-        state['CCL'] = {'cosmo': cosmo}
-
-        # Compute derived parameters
-        # (we should actually only do this if required -- TODO)
-        # Compute sigma8 if it is not an input parameter
-        state['derived'] = {}
-        if 'sigma8' not in self.input_params:
-            sigma8 = ccl.sigma8(cosmo)
-            state['derived']['sigma8'] = sigma8
-        else:
-            sigma8 = cosmo['sigma8']
+        if self.bcache is not None:
+            self.bcache.save(key, self.bcache.get_arrays(cosmo))
 
-        if 'S8' not in self.input_params:
-            state['derived']['S8'] = sigma8*np.sqrt(Om/0.3)
+        return cosmo
 
-        if ('A_s' not in self.input_params) and ('A_s' in params):
-            state['derived']['A_s'] = params['A_s']
+    def _get_cosmology_reusing_transfer(self, params):
+        """ Return the cosmology for `params`. If only the primordial
+        parameters (A_s or sigma8, and n_s) changed since the last call to
+        the Boltzmann code, its linear power spectrum is rescaled and the
+        nonlinear one recomputed with ccl.CosmologyCalculator.
+        """
+        amp = 'A_s' if 'A_s' in params else 'sigma8'
+        key = tuple(sorted((k, repr(v)) for k, v in params.items()
+                           if k not in [amp, 'n_s']))
+        ref = self._transfer_cache
+        if (ref is None) or (ref['key'] != key):
+            cosmo = self._get_cosmology(params, {})
+            cosmo.compute_linear_power()
+            a, lnk, pk = cosmo.get_linear_power().get_spline_arrays()
+            self._transfer_cache = {'key': key, 'a': a, 'k': np.exp(lnk),
+                                    'pk': pk, 'n_s': params['n_s'],
+                                    'amp': params[amp]}
+            return cosmo
+
+        self.timer.count('transfer_reused')
+        pk = ref['pk'].copy()
+        if params['n_s'] != ref['n_s']:
+            pk *= (ref['k'] / self.k_pivot)**(params['n_s'] - ref['n_s'])
+        pk_linear = {'a': ref['a'], 'k': ref['k'],
+                     'delta_matter:delta_matter': pk}
+
+        if amp == 'A_s':
+            pk *= params['A_s'] / ref['amp']
+        elif params['n_s'] != ref['n_s']:
+            # The tilt changes sigma8, so normalize numerically
+            cosmo = ccl.CosmologyCalculator(**params, pk_linear=pk_linear)
+            pk *= (params['sigma8'] / ccl.sigma8(cosmo))**2
+        else:
+            pk *= (params['sigma8'] / ref['amp'])**2
 
-        state['derived'].update({'Omega_m': Om,
-                                 'Omega_nu': Onu,
-                                 })
-        if 'Omega_c' not in self.input_params:
-            state['derived']['Omega_c'] = Oc
+        if self.matter_pk == 'halofit':
+            kwargs = {'nonlinear_model': 'halofit'}
+        else:
+            kwargs = {'pk_nonlin': pk_linear}
 
-        for req_res, method in self._required_results.items():
-            state['CCL'][req_res] = method(cosmo)
+        return ccl.CosmologyCalculator(**params, pk_linear=pk_linear,
+                                       **kwargs)
 
     def get_CCL(self):
         """
@@ -275,3 +525,75 @@ class CCL(Theory):
         :return: dict of results
         """
         return self._current_state['CCL']
+
+
+def get_sigma8_As_ratio_ccl(pars, A_s_fid=2.1e-9):
+    """ Return sigma8/sqrt(A_s) computed with CCL for the non-amplitude
+    parameters `pars`. Only the linear power spectrum is needed.
+    """
+    cosmo = ccl.Cosmology(**pars, A_s=A_s_fid, matter_power_spectrum='linear')
+    return ccl.sigma8(cosmo) / np.sqrt(A_s_fid)
+
+
+def make_sigma8_to_As_table(fname, grids, **fixed_pars):
+    """ Compute sigma8/sqrt(A_s) on a grid of parameters and save it in the
+    npz file fname, to be used with the sigma8_to_As_table option of CCL.
+
+    Args:
+        fname (str): output file name.
+        grids (dict): 1D array of values for each gridded parameter (e.g.
+            Omega_c, Omega_b, h, n_s, m_nu).
+        fixed_pars: any other CCL parameter. They are saved with the table,
+            which is only used for parameters with the same values.
+    """
+    names = list(grids.keys())
+    values = [np.sort(grids[n]) for n in names]
+    ratio = np.zeros([v.size for v in values])
+    for ix in np.ndindex(ratio.shape):
+        pars = fixed_pars.copy()
+        pars.update({n: v[i] for n, v, i in zip(names, values, ix)})
+        ratio[ix] = get_sigma8_As_ratio_ccl(pars)
+
+    np.savez(fname, names=names, ratio=ratio,
+             fixed_names=list(fixed_pars.keys()),
+             ccl_version=ccl.__version__,
+             **{f'grid_{n}': v for n, v in zip(names, values)},
+             **{f'fixed_{n}': v for n, v in fixed_pars.items()})
+
+
+def load_sigma8_to_As_table(fname):
+    """ Load a table produced by make_sigma8_to_As_table and return a
+    function that, given a dictionary of parameters, returns the
+    interpolated sigma8/sqrt(A_s), or None if the parameters are not in the
+    table range or if any other parameter is not one of the fixed ones of
+    the table (or has a different value).
+    """
+    d = np.load(fname)
+    if ('ccl_version' not in d) or ('fixed_names' not in d):
+        raise ValueError(f"{fname} was made with an older version of "
+                         "make_sigma8_to_As_table. Please regenerate it.")
+    if str(d['ccl_version']) != ccl.__version__:
+        raise ValueError(f"{fname} was made with CCL {d['ccl_version']}, "
+                         f"but the CCL version is {ccl.__version__}. Please "
+                         "regenerate it.")
+    names = list(d['names'])
+    values = [d[f'grid_{n}'] for n in names]
+    fixed = {n: d[f'fixed_{n}'] for n in d['fixed_names']}
+    method = 'cubic' if all(v.size >= 4 for v in values) else 'linear'
+    interp = RegularGridInterpolator(values, d['ratio'], method=method)
+
+    def get_ratio(pars):
+        for n, v in pars.items():
+            if n in names:
+                continue
+            if (n not in fixed) or not np.array_equal(fixed[n], v):
+                # Not tabulated: compute it exactly
+                return None
+        point = []
+        for n, v in zip(names, values):
+            if (n not in pars) or not (v[0] <= pars[n] <= v[-1]):
+                return None
+            point.append(pars[n])
+        return float(interp(point)[0])
+
+    return get_ratio
@@ -9,7 +9,9 @@ import pyccl as ccl
 import numpy as np
 from cobaya.theory import Theory
 from classy import Class, CosmoSevereError, CosmoComputationError
-from scipy.interpolate import interp1d
+from scipy.interpolate import interp1d, CubicSpline
+from .classy_pool import ClassyWorkerPool
+from .timing import StageTimer
 
 
 class CCL_BLCDM(Theory):
@@ -20,8 +22,22 @@ class CCL_BLCDM(Theory):
     # hi_class options
     nonlinear_model: str = 'muSigma'
     classy_arguments: dict = {}
+    # Number of worker processes running hi_class. If 0, hi_class runs in
+    # this process.
+    n_workers: int = 0
+    # Maximum time (in seconds) for a hi_class run in a worker. If exceeded,
+    # the worker is restarted and the point rejected. 0 for no limit.
+    worker_timeout: float = 0
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(), stages=['classy', 'ccl'],
+                                counters=['primordial_rescaled'],
+                                enabled=self.timing,
+                                profile=self.profile)
         self._required_results = {}
 
         # cosmo = ccl.CosmologyVanillaLCDM(transfer_function="boltzmann_class")
@@ -48,9 +64,21 @@ class CCL_BLCDM(Theory):
             # Use extrap_hmcode in nonlinear.c
             self.cosmo_class.set({"extrapolation_method": 4})
 
+        # Parameters and products of the last hi_class run. Used to skip
+        # hi_class when only the primordial parameters change.
+        self._last_pars = None
+        self._last_products = None
+
+        # Worker pool, started in the first calculate call (i.e. once the
+        # requirements have set all the classy arguments)
+        self._pool = None
+        # Results of precompute, keyed on the classy parameters
+        self._precomputed = {}
+
     def get_can_provide_params(self):
         # return any derived quantities that CCL can compute
-        return ['S8', 'sigma8', "Omega_m", "A_s"]
+        return ['S8', 'sigma8', "Omega_m", "A_s"] + \
+            self.timer.get_param_names()
 
     def must_provide(self, **requirements):
         pars = self.cosmo_class.pars
@@ -124,52 +152,221 @@ class CCL_BLCDM(Theory):
 
         return params
 
+    def _get_primordial_change(self, pars):
+        """
+        Return the ratio of the new and last A_s and the change in n_s if
+        only these parameters changed since the last hi_class run and the
+        last products can be rescaled (i.e. linear power spectra and no
+        CMB). Otherwise, return None.
+        """
+        last = self._last_pars
+        if (last is None) or (self._last_products is None) or \
+                (self.nonlinear_model != "Linear") or \
+                (set(pars) != set(last)):
+            return None
+
+        changed = set(p for p in pars if pars[p] != last[p])
+        if not changed.issubset({'A_s', 'ln10^{10}A_s', 'n_s'}):
+            return None
+
+        def get_A_s(p):
+            if 'A_s' in p:
+                return p['A_s']
+            return np.exp(p['ln10^{10}A_s']) * 1e-10
+
+        A_s_ratio = 1
+        if changed - {'n_s'}:
+            A_s_ratio = get_A_s(pars) / get_A_s(last)
+        dn_s = pars['n_s'] - last['n_s'] if 'n_s' in changed else 0
+
+        return A_s_ratio, dn_s
+
     def calculate(self, state, want_derived=True, **params_values_dict):
-        hc = self.cosmo_class
-        hc.set(self._get_params_for_classy(params_values_dict))
+        self.timer.start_step()
         try:
-            hc.compute()
-        # Based on the official classy theory class:
-        # https://github.com/CobayaSampler/cobaya/blob/master/cobaya/theories/classy/classy.py
-        except CosmoComputationError as e:
-            self.log.debug("Computation of cosmological products failed. "
-                           "Assigning 0 likelihood and going on. "
-                           "The output of the CLASS error was %s" % e)
-            return False
-        except CosmoSevereError:
-            self.log.error("Serious error setting parameters or computing results. "
-                           "The parameters passed were %r. To see the original "
-                           "CLASS' error traceback, make 'debug: True'.",
-                           state["params"])
-            raise
-
-        output = hc.pars['output']
-        cosmo = self._get_cosmo_ccl(hc) if self.return_CCL else None
-        cl = self._get_Cl(hc) if 'Cl' in output else None
-        hc.struct_cleanup()
-
-        state['CCL'] = {'cosmo': cosmo}
-        state['Cl'] = cl
-
-        # Derived
-        params = {}
-        Omega_m = hc.Omega_m()
-        params['Omega_m'] =  Omega_m
-        if 'mPk' in hc.pars['output']:
-            sigma8 = hc.sigma8()
-            params['S8'] = sigma8*np.sqrt(Omega_m/0.3)
-        if ('A_s' in self.input_params) and ('mPk' in hc.pars['output']):
-            params.update({'sigma8': sigma8})
-        else:
-            params.update({'A_s':
-                           hc.get_current_derived_parameters(['A_s'])['A_s']})
-        state['derived'] = params
+            hc = self.cosmo_class
+            pars = self._get_params_for_classy(params_values_dict.copy())
+            output = hc.pars['output']
+
+            primordial_change = None
+            if 'Cl' not in output:
+                primordial_change = self._get_primordial_change(pars)
+
+            if primordial_change is not None:
+                # Only A_s and/or n_s changed: rescale the last linear power
+                # spectra instead of rerunning hi_class.
+                self.timer.count('primordial_rescaled')
+                products = self._rescale_products(self._last_products,
+                                                  *primordial_change)
+                cl = None
+            else:
+                try:
+                    with self.timer.stage('classy'):
+                        hc = self._compute_classy(pars)
+                # Based on the official classy theory class:
+                # https://github.com/CobayaSampler/cobaya/blob/master/cobaya/theories/classy/classy.py
+                except CosmoComputationError as e:
+                    self.log.debug("Computation of cosmological products "
+                                   "failed. Assigning 0 likelihood and going "
+                                   "on. The output of the CLASS error was "
+                                   "%s" % e)
+                    self._last_pars = None
+                    return False
+                except CosmoSevereError:
+                    self.log.error("Serious error setting parameters or computing results. "
+                                   "The parameters passed were %r. To see the original "
+                                   "CLASS' error traceback, make 'debug: True'.",
+                                   state["params"])
+                    self._last_pars = None
+                    raise
+
+                products = None
+                if self.return_CCL:
+                    products = {'ccl_kwargs': self._get_ccl_kwargs(hc)}
+                cl = self._get_Cl(hc) if 'Cl' in output else None
+
+                # Derived
+                params = {}
+                Omega_m = hc.Omega_m()
+                params['Omega_m'] = Omega_m
+                if 'mPk' in hc.pars['output']:
+                    sigma8 = hc.sigma8()
+                    params['S8'] = sigma8*np.sqrt(Omega_m/0.3)
+                if ('A_s' in self.input_params) and \
+                        ('mPk' in hc.pars['output']):
+                    params.update({'sigma8': sigma8})
+                else:
+                    params.update({'A_s':
+                                   hc.get_current_derived_parameters(['A_s'])['A_s']})
+                if products is not None:
+                    products['derived'] = params
+
+                self._last_pars = pars
+                self._last_products = products
+                # All the products have been extracted
+                hc.struct_cleanup()
+
+            cosmo = None
+            if products is not None:
+                with self.timer.stage('ccl'):
+                    cosmo = ccl.CosmologyCalculator(**products['ccl_kwargs'])
+                params = products['derived']
+
+            state['CCL'] = {'cosmo': cosmo}
+            state['Cl'] = cl
+            state['derived'] = params
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
 
         # Extra methods
         for req_res, method in self._required_results.items():
             state['CCL'][req_res] = method(cosmo)
 
-    def _get_cosmo_ccl(self, hc, derived=True):
+    def close(self):
+        self.timer.close(self.log)
+        self.cosmo_class.struct_cleanup()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            timeout = self.worker_timeout if self.worker_timeout > 0 else None
+            self._pool = ClassyWorkerPool(dict(self.cosmo_class.pars),
+                                          n_workers=self.n_workers,
+                                          timeout=timeout)
+        return self._pool
+
+    def _get_pars_key(self, pars):
+        return tuple(sorted((k, repr(v)) for k, v in pars.items()))
+
+    def precompute(self, params_values_list):
+        """
+        Run hi_class for several points in parallel in the worker pool (for
+        samplers that can propose several points at once). The next calls
+        to calculate with these parameters will use the stored results.
+
+        Args:
+            params_values_list (list): list of dictionaries with the input
+                parameters of this class.
+        """
+        if not self.n_workers:
+            raise ValueError("precompute needs n_workers > 0")
+        pars_list = [self._get_params_for_classy(dict(p))
+                     for p in params_values_list]
+        results = self._get_pool().compute_batch(pars_list)
+        self._precomputed = {self._get_pars_key(p): r
+                             for p, r in zip(pars_list, results)}
+
+    def _compute_classy(self, pars):
+        """
+        Run hi_class for pars. Return the Class instance or, if n_workers >
+        0, a ClassyResults snapshot of the run in the worker pool.
+        """
+        if not self.n_workers:
+            hc = self.cosmo_class
+            hc.set(pars)
+            hc.compute()
+            return hc
+
+        key = self._get_pars_key(pars)
+        if key in self._precomputed:
+            status, result = self._precomputed.pop(key)
+        else:
+            status, result = self._get_pool().compute(pars)
+
+        if status == 'ok':
+            return result
+        elif status == 'computation':
+            raise CosmoComputationError(result)
+        elif status == 'severe':
+            raise CosmoSevereError(result)
+        # Hanging or crashed worker: reject the point and carry on
+        self.log.warning(f"{result}. Assigning 0 likelihood and going on.")
+        raise CosmoComputationError(result)
+
+    def _rescale_products(self, products, A_s_ratio, dn_s):
+        """
+        Return the products of the last hi_class run rescaled to a new
+        primordial amplitude (A_s_ratio times the last one) and tilt
+        (n_s + dn_s). Only valid for linear power spectra.
+        """
+        kwargs = products['ccl_kwargs'].copy()
+        k_pivot = self.cosmo_class.pars.get('k_pivot', 0.05)
+        pk_linear = {'a': kwargs['pk_linear']['a'],
+                     'k': kwargs['pk_linear']['k']}
+        factor = A_s_ratio * (pk_linear['k'] / k_pivot)**dn_s
+        for key, pk in kwargs['pk_linear'].items():
+            if key not in ['a', 'k']:
+                pk_linear[key] = pk * factor
+        kwargs['pk_linear'] = pk_linear
+        kwargs['pk_nonlin'] = pk_linear
+        kwargs['n_s'] = kwargs['n_s'] + dn_s
+
+        derived = products['derived'].copy()
+        sigma8 = kwargs['sigma8'] * np.sqrt(A_s_ratio)
+        if dn_s != 0:
+            # The tilt changes sigma8. ccl.sigma8 integrates the rescaled
+            # linear power spectrum.
+            kwargs['sigma8'] = sigma8
+            sigma8 = ccl.sigma8(ccl.CosmologyCalculator(**kwargs))
+        kwargs['sigma8'] = sigma8
+        if 'sigma8' in derived:
+            derived['sigma8'] = sigma8
+        if 'S8' in derived:
+            derived['S8'] = sigma8*np.sqrt(derived['Omega_m']/0.3)
+        if 'A_s' in derived:
+            derived['A_s'] = derived['A_s'] * A_s_ratio
+
+        return {'ccl_kwargs': kwargs, 'derived': derived}
+
+    def _get_ccl_kwargs(self, hc):
+        """
+        Return the arguments for ccl.CosmologyCalculator computed from the
+        hi_class structures.
+        """
         bhc = hc.get_background()
         # Background
         H = bhc['H [1/Mpc]']
@@ -180,15 +377,10 @@ class CCL_BLCDM(Theory):
         growth, pk_linear, pk_nonlin = self._get_growth_and_pks_muSigma(hc, bhc)
 
         sigma8 = hc.sigma8()
-        Omega_m = hc.Omega_m()
-        cosmo = ccl.CosmologyCalculator(Omega_c=hc.Omega0_cdm(),
-                                        Omega_b=hc.Omega_b(), h=hc.h(),
-                                        sigma8=sigma8, n_s=hc.n_s(),
-                                        background=background, growth=growth,
-                                        pk_linear=pk_linear,
-                                        pk_nonlin=pk_nonlin,
-                                        nonlinear_model=None)
-        return cosmo
+        return dict(Omega_c=hc.Omega0_cdm(), Omega_b=hc.Omega_b(), h=hc.h(),
+                    sigma8=sigma8, n_s=hc.n_s(), background=background,
+                    growth=growth, pk_linear=pk_linear, pk_nonlin=pk_nonlin,
+                    nonlinear_model=None)
 
     def _get_Cl(self, hc):
         cl = hc.lensed_cl()
@@ -224,11 +416,8 @@ class CCL_BLCDM(Theory):
         # The growth factor and rate columns in the background tables are only
         # valid for dust-only cosmologies
         # They solve: delta'' + 2H delta' + delta = 0
-        growth_factor = np.zeros(z_pk.size)
-        growth_rate = np.zeros(z_pk.size)
-        for i, zi in enumerate(z_pk):
-            growth_factor[i] = hc.scale_dependent_growth_factor_at_k_and_z(0.01, zi)
-            growth_rate[i] = hc.scale_dependent_growth_factor_f_at_k_and_z(0.01, zi)
+        growth_factor, growth_rate = self._get_growth_from_pk(pkln_mm, k,
+                                                              z_pk)
 
         growth = {'a': a_pk, 'growth_factor': growth_factor,
                   "growth_rate": growth_rate}
@@ -257,10 +446,11 @@ class CCL_BLCDM(Theory):
                           "the linear pk in case of failure")
                     raise e
                 self.log.debug(str(e))
-                pk_mm = np.zeros_like(pkln_mm[:-1])
                 k = k[:-1]  # To avoid going out of boundaries
-                for i, zi in enumerate(z_pk):
-                    pk_mm[:, i] = [hc.pk(ki, zi) for ki in k]
+                # Single call to classy instead of one per (k, z). The
+                # output is ordered as pk[iz*nk + ik].
+                pk_mm = hc.get_pk_array(k, z_pk, k.size, z_pk.size, True)
+                pk_mm = pk_mm.reshape((z_pk.size, k.size)).T
 
             pk_mw = Sigma * pk_mm
             pk_ww = Sigma**2 * pk_mm
@@ -275,6 +465,27 @@ class CCL_BLCDM(Theory):
 
         return growth, pk_linear, pk_nonlin
 
+    def _get_growth_from_pk(self, pkln_mm, k, z_pk, k_growth=0.01):
+        """
+        Return the growth factor and growth rate at k_growth (in 1/Mpc)
+        computed from the linear matter power spectrum table returned by
+        get_pk_and_k_and_z: D(z) = sqrt(P(k, z) / P(k, 0)) and
+        f = dlnD/dlna.
+
+        This is what scale_dependent_growth_factor(_f)_at_k_and_z compute,
+        but for all redshifts at once.
+        """
+        # Interpolate log(P) at k_growth for all z
+        lnpk = interp1d(np.log(k), np.log(pkln_mm), axis=0)(np.log(k_growth))
+        lnD = 0.5 * (lnpk - lnpk[np.argmin(z_pk)])
+
+        lna = -np.log(1 + z_pk)
+        ix = np.argsort(lna)
+        growth_rate = np.zeros_like(lnD)
+        growth_rate[ix] = CubicSpline(lna[ix], lnD[ix]).derivative()(lna[ix])
+
+        return np.exp(lnD), growth_rate
+
     # Commented out. Old way but could be useful for models that are not
     # mu/Sigma
     #
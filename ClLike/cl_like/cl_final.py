@@ -4,6 +4,7 @@ Theory class that computes the full angular power spectrum
 from cobaya.theory import Theory
 from cobaya.log import LoggedError
 import numpy as np
+from .timing import StageTimer
 
 
 class ClFinal(Theory):
@@ -11,6 +12,14 @@ class ClFinal(Theory):
     # identified as belonging to this stage.
     input_params_prefix: str = ""
     shape_model: str = "ShapeNone"
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
+
+    def initialize(self):
+        self.timer = StageTimer(self.get_name(), enabled=self.timing,
+                                profile=self.profile)
 
     def initialize_with_provider(self, provider):
         self.provider = provider
@@ -41,26 +50,38 @@ class ClFinal(Theory):
                            "bin_properties": self.bin_properties}
                 }
 
+    def get_can_provide_params(self):
+        return self.timer.get_param_names()
+
     def calculate(self, state, want_derived=True, **pars):
-        # First, gather all the necessary ingredients for the Cls without bias parameters
-        res = self.provider.get_Limber()
-        cld = res['cl_data']
-
-        # Construct bias vector
-        bias = np.zeros(len(self.bias_names))
-        for i, k in enumerate(self.bias_names):
-            if k[-2:] == "_s":
-                # Magnification i.e. (2 - 5s)
-                bias[i] = 2 - 5*pars[k]
-            else:
-                bias[i] = pars[k]
-
-        # Construct global bias vector
-        global_bias = self._get_global_bias(**pars)
-
-        # Theory model
-        state["cl_theory"] = self._model(cld, bias, global_bias)
-        # state["cl_theory_deriv"] = self._model_deriv(cld, bias, **pars)
+        self.timer.start_step()
+        try:
+            # First, gather all the necessary ingredients for the Cls without bias parameters
+            res = self.provider.get_Limber()
+            cld = res['cl_data']
+
+            # Construct bias vector
+            bias = np.zeros(len(self.bias_names))
+            for i, k in enumerate(self.bias_names):
+                if k[-2:] == "_s":
+                    # Magnification i.e. (2 - 5s)
+                    bias[i] = 2 - 5*pars[k]
+                else:
+                    bias[i] = pars[k]
+
+            # Construct global bias vector
+            global_bias = self._get_global_bias(**pars)
+
+            # Theory model
+            state["cl_theory"] = self._model(cld, bias, global_bias)
+            # state["cl_theory_deriv"] = self._model_deriv(cld, bias, **pars)
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
 
     def get_cl_theory(self):
         return self._current_state["cl_theory"]
@@ -156,10 +177,13 @@ class ClFinal(Theory):
             bd = bias_info[name] = {}
             bd['bias_ind'] = None # No biases by default
             if quantity == 'galaxy_density':
-                # Linear bias
-                inds = [ind_bias]
-                bias_names.append(self.input_params_prefix + '_'+ name +'_b1')
-                ind_bias += 1
+                inds = []
+                # Linear bias (given by the HOD in the halo model)
+                if bias_model != 'HaloModel':
+                    inds.append(ind_bias)
+                    bias_names.append(self.input_params_prefix + '_' + name +
+                                      '_b1')
+                    ind_bias += 1
                 # Higher-order biases
                 if is_PT_bias:
                     for bn in ['b2', 'bs', 'bk2']:
@@ -173,10 +197,12 @@ class ClFinal(Theory):
                     bias_names.append(pn)
                     inds.append(ind_bias)
                     ind_bias += 1
-                bd['bias_ind'] = inds
+                bd['bias_ind'] = inds if inds else None
 
-                # In the lagrangian picture there's an unbiased term.
-                bd['eps'] = (bias_model in ['LagrangianPT', 'BaccoPT'])
+                # In the lagrangian picture there's an unbiased term. In the
+                # halo model, the galaxy tracer is the unbiased one.
+                bd['eps'] = (bias_model in ['LagrangianPT', 'BaccoPT',
+                                            'HaloModel'])
                 # No magnification bias yet
 
             elif quantity == 'galaxy_shear':
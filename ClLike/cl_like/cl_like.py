@@ -6,6 +6,9 @@ from cobaya.likelihood import Likelihood
 from cobaya.log import LoggedError
 from scipy.optimize import minimize
 import sacc
+from .node_shared import get_node_comm, share_on_node
+from .data_cache import DataCache
+from .timing import StageTimer
 
 
 class ClLike(Likelihood):
@@ -23,12 +26,62 @@ class ClLike(Likelihood):
     jeffrey_bias: bool = False
     # Null negative covariance eigenvalues when computing inverse cov?
     null_negative_cov_eigvals_in_icov: bool = False
+    # Read the data once per node and share it between the MPI processes?
+    node_shared_data: bool = False
+    # Directory where the cut data products are cached ("" for no cache)
+    data_cache: str = ""
+    # Data type of the bandpower windows ('float32' halves their memory)
+    bpw_dtype: str = "float64"
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
+
+    # Data products built by _read_data
+    _data_products = ['defaults', 'bin_properties', 'cl_meta', 'tracer_qs',
+                      'data_vec', 'cov', 'inv_cov', 'ndata', 'indices']
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(), stages=['jeffrey'],
+                                enabled=self.timing,
+                                profile=self.profile)
         # Deep copy defaults to avoid modifying the input yaml
         self.defaults = copy.deepcopy(self.defaults)
         # Read SACC file
+        self.sacc_file = None
+        self._node_shared_win = None
+        if self.node_shared_data:
+            products, self._node_shared_win = \
+                share_on_node(self._get_data_products, get_node_comm())
+        else:
+            products = self._get_data_products()
+        for name, value in products.items():
+            setattr(self, name, value)
+
+    def _get_data_products(self):
+        if not self.data_cache:
+            self._read_data()
+            return {name: getattr(self, name) for name in self._data_products}
+
+        cache = DataCache(self.data_cache)
+        # The settings must be those in the input yaml, before _read_data
+        # fills in the defaults
+        key = cache.get_key(self.input_file,
+                            bins=self.bins, twopoints=self.twopoints,
+                            defaults=self.defaults,
+                            null_negative_cov_eigvals_in_icov=(
+                                self.null_negative_cov_eigvals_in_icov),
+                            bpw_dtype=self.bpw_dtype,
+                            ccl_version=ccl.__version__)
+        products = cache.load(key)
+        if products is not None:
+            self.log.info(f"Data products read from cache ({key})")
+            return products
+
         self._read_data()
+        products = {name: getattr(self, name) for name in self._data_products}
+        cache.save(key, products)
+        return products
 
     def _read_data(self):
         """
@@ -121,9 +174,7 @@ class ClLike(Likelihood):
             tn1, tn2 = cl['bins']
             cltyp = get_cl_type(s.tracers[tn1], s.tracers[tn2])
             # Get data
-            l, c_ell, cov, ind = s.get_ell_cl(cltyp, tn1, tn2,
-                                              return_cov=True,
-                                              return_ind=True)
+            l, c_ell, ind = s.get_ell_cl(cltyp, tn1, tn2, return_ind=True)
             # Check it is not empty
             if c_ell.size == 0:
                 continue
@@ -142,7 +193,6 @@ class ClLike(Likelihood):
             sel = (l > lmin) * (l < lmax)
             l = l[sel]
             c_ell = c_ell[sel]
-            cov = cov[sel][:, sel]
             ind = ind[sel]
 
             if tn1 not in self.tracer_qs:
@@ -158,7 +208,6 @@ class ClLike(Likelihood):
                                  'bin_2': tn2,
                                  'l_eff': l,
                                  'cl': c_ell,
-                                 'cov': cov,
                                  'inds': (id_sofar +
                                           np.arange(c_ell.size,
                                                     dtype=int)),
@@ -171,6 +220,7 @@ class ClLike(Likelihood):
         indices = np.array(indices)
         # Reorder data vector and covariance
         self.data_vec = s.mean[indices]
+        self._compact_cl_meta()
         self.cov = s.covariance.dense[indices][:, indices]
         # Invert covariance
         self.inv_cov = self.get_inv_cov(self.cov)
@@ -178,6 +228,48 @@ class ClLike(Likelihood):
         # Keep indices in case we want so slice the original sacc file
         self.indices = indices
 
+    def _compact_cl_meta(self):
+        """ Reduce the memory used by cl_meta: the C_ells are views of the
+        data vector, the repeated bandpower ells and windows are stored only
+        once and all the windows are packed in a single contiguous array.
+        """
+        def get_unique(arrays):
+            unique = {}
+            out = []
+            for arr in arrays:
+                key = (arr.shape, arr.dtype.str, hash(arr.tobytes()))
+                same = [u for u in unique.get(key, [])
+                        if np.array_equal(u, arr)]
+                if same:
+                    out.append(same[0])
+                else:
+                    unique.setdefault(key, []).append(arr)
+                    out.append(arr)
+            return out
+
+        for clm in self.cl_meta:
+            i0 = clm['inds'][0]
+            clm['cl'] = self.data_vec[i0:i0+clm['inds'].size]
+
+        l_bpws = get_unique([clm['l_bpw'] for clm in self.cl_meta])
+        w_bpws = get_unique([np.asarray(clm['w_bpw'], dtype=self.bpw_dtype)
+                             for clm in self.cl_meta])
+        # Single buffer for the different windows
+        windows = {}
+        for w in w_bpws:
+            windows[id(w)] = w
+        buf = np.zeros(sum(w.size for w in windows.values()),
+                       dtype=self.bpw_dtype)
+        offset = 0
+        for k, w in windows.items():
+            windows[k] = buf[offset:offset+w.size].reshape(w.shape)
+            windows[k][:] = w
+            offset += w.size
+
+        for clm, l_bpw, w_bpw in zip(self.cl_meta, l_bpws, w_bpws):
+            clm['l_bpw'] = l_bpw
+            clm['w_bpw'] = windows[id(w_bpw)]
+
     def get_inv_cov(self, cov):
         if self.null_negative_cov_eigvals_in_icov:
             evals, evecs = np.linalg.eigh(cov)
@@ -211,17 +303,26 @@ class ClLike(Likelihood):
         # Jeffreys prior for bias?
         dchi2_jeffrey = 0
         if self.jeffrey_bias:
-            dchi2_jeffrey = self._get_jeffrey_bias_dchi2()
+            with self.timer.stage('jeffrey'):
+                dchi2_jeffrey = self._get_jeffrey_bias_dchi2()
         return chi2, dchi2_jeffrey
 
     def get_can_provide_params(self):
-        return ['dchi2_jeffrey']
+        return ['dchi2_jeffrey'] + self.timer.get_param_names()
 
     def calculate(self, state, want_derived=True, **pars):
-        # Calculate chi2
-        chi2, dchi2_jeffrey = self._get_chi2(**pars)
-        state['logp'] = -0.5*(chi2+dchi2_jeffrey)
-        state['derived'] = {'dchi2_jeffrey': dchi2_jeffrey}
+        self.timer.start_step()
+        try:
+            # Calculate chi2
+            chi2, dchi2_jeffrey = self._get_chi2(**pars)
+            state['logp'] = -0.5*(chi2+dchi2_jeffrey)
+            state['derived'] = {'dchi2_jeffrey': dchi2_jeffrey}
+        finally:
+            self.timer.end_step()
+        state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
 
     def get_cl_theory_sacc(self):
         # Create empty file
@@ -256,6 +357,9 @@ class ClLike(Likelihood):
         return s
 
     def get_cl_data_sacc(self):
+        if self.sacc_file is None:
+            # Only the node leader reads the file when sharing the data
+            self.sacc_file = sacc.Sacc.load_fits(self.input_file)
         s = self.sacc_file.copy()
         s.keep_indices(self.indices)
 
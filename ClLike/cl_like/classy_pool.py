@@ -0,0 +1,298 @@
+"""
+Pool of persistent worker processes running hi_class for the CCL_BLCDM
+theory class. Running classy out of process contains its crashes and hangs:
+a worker that dies or exceeds the timeout is restarted and the point is
+rejected, instead of taking the whole chain down. The arrays computed by the
+workers are passed back through shared memory.
+"""
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
+import time
+import numpy as np
+
+
+# Shared memory blocks are named after the worker that creates them, so that
+# the blocks of a worker that is killed can be found and freed.
+_SHM_PREFIX = 'cl_like_classy_'
+_SHM_DIR = '/dev/shm'
+_shm_counter = itertools.count()
+
+
+def _get_shm_prefix(pid):
+    return f'{_SHM_PREFIX}{pid}_'
+
+
+def _free_worker_blocks(pid):
+    """ Unlink the shared memory blocks left by the worker with process id
+    pid (e.g. a half-packed or unreceived result of a killed worker). Where
+    the blocks cannot be listed, they are freed by the resource tracker when
+    the main process exits.
+    """
+    if not os.path.isdir(_SHM_DIR):
+        return
+    prefix = _get_shm_prefix(pid)
+    for name in os.listdir(_SHM_DIR):
+        if not name.startswith(prefix):
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+
+
+class ClassyResults(object):
+    """ Snapshot of the outputs of a classy run. It implements the subset of
+    the classy.Class methods used by CCL_BLCDM, so that it can be used in
+    place of a Class instance.
+
+    Note that get_pk_array only returns the nonlinear power spectrum for the
+    k and z arrays used by CCL_BLCDM when the nonlinear power spectrum fails
+    (see _run_classy).
+    """
+    def __init__(self, data):
+        self._data = data
+        self.pars = data['pars']
+
+    def get_background(self):
+        return self._data['background']
+
+    def get_pk_and_k_and_z(self, nonlinear=False):
+        if not nonlinear:
+            return self._data['pk_lin']
+        if self._data['pk_nl_error'] is not None:
+            from classy import CosmoSevereError
+            raise CosmoSevereError(self._data['pk_nl_error'])
+        return self._data['pk_nl']
+
+    def get_pk_array(self, k, z, k_size, z_size, nonlinear):
+        return self._data['pk_nl_fallback']
+
+    def lensed_cl(self):
+        return {k: v.copy() for k, v in self._data['cl'].items()}
+
+    def get_current_derived_parameters(self, names):
+        return {n: self._data['scalars'][n] for n in names}
+
+    def Omega_m(self):
+        return self._data['scalars']['Omega_m']
+
+    def Omega0_cdm(self):
+        return self._data['scalars']['Omega0_cdm']
+
+    def Omega_b(self):
+        return self._data['scalars']['Omega_b']
+
+    def h(self):
+        return self._data['scalars']['h']
+
+    def n_s(self):
+        return self._data['scalars']['n_s']
+
+    def T_cmb(self):
+        return self._data['scalars']['T_cmb']
+
+    def sigma8(self):
+        return self._data['scalars']['sigma8']
+
+    def struct_cleanup(self):
+        pass
+
+
+def _run_classy(hc, pars):
+    """ Run classy and return a dictionary with all the outputs needed to
+    build a ClassyResults object.
+    """
+    from classy import CosmoSevereError
+
+    hc.set(pars)
+    hc.compute()
+    output = hc.pars.get('output', '')
+
+    data = {'pars': dict(hc.pars), 'background': hc.get_background()}
+    scalars = {'Omega_m': hc.Omega_m(), 'Omega0_cdm': hc.Omega0_cdm(),
+               'Omega_b': hc.Omega_b(), 'h': hc.h(), 'n_s': hc.n_s(),
+               'T_cmb': hc.T_cmb(),
+               'A_s': hc.get_current_derived_parameters(['A_s'])['A_s']}
+
+    if 'mPk' in output:
+        scalars['sigma8'] = hc.sigma8()
+        data['pk_lin'] = hc.get_pk_and_k_and_z(nonlinear=False)
+        data['pk_nl_error'] = None
+        try:
+            data['pk_nl'] = hc.get_pk_and_k_and_z(nonlinear=True)
+        except CosmoSevereError as e:
+            data['pk_nl_error'] = str(e)
+            if "hmcode_min_k_max" in str(e):
+                # Fallback used by CCL_BLCDM
+                _, k, z = data['pk_lin']
+                k = k[:-1]
+                data['pk_nl_fallback'] = hc.get_pk_array(k, z, k.size,
+                                                         z.size, True)
+
+    if 'Cl' in output:
+        data['cl'] = hc.lensed_cl()
+
+    data['scalars'] = scalars
+    return data
+
+
+def _pack(obj):
+    """ Replace the arrays in obj by references to shared memory blocks. """
+    if isinstance(obj, np.ndarray) and obj.nbytes > 0:
+        # The block is unlinked (and unregistered from the resource tracker
+        # shared with the main process) by _unpack, or by _free_worker_blocks
+        # if the result is never received.
+        name = f'{_get_shm_prefix(os.getpid())}{next(_shm_counter)}'
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        ref = ('__shm__', shm.name, obj.shape, obj.dtype.str)
+        shm.close()
+        return ref
+    elif isinstance(obj, dict):
+        return {k: _pack(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_pack(v) for v in obj)
+    return obj
+
+
+def _unpack(obj):
+    """ Inverse of _pack. The shared memory blocks are copied and freed. """
+    if isinstance(obj, tuple) and (len(obj) == 4) and (obj[0] == '__shm__'):
+        _, name, shape, dtype = obj
+        shm = shared_memory.SharedMemory(name=name)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+        shm.close()
+        shm.unlink()
+        return arr
+    elif isinstance(obj, dict):
+        return {k: _unpack(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_unpack(v) for v in obj)
+    return obj
+
+
+def _worker_main(conn, classy_arguments):
+    from classy import Class, CosmoSevereError, CosmoComputationError
+
+    hc = Class()
+    hc.set(classy_arguments)
+    while True:
+        pars = conn.recv()
+        if pars is None:
+            break
+        try:
+            conn.send(('ok', _pack(_run_classy(hc, pars))))
+        except CosmoComputationError as e:
+            conn.send(('computation', str(e)))
+        except CosmoSevereError as e:
+            conn.send(('severe', str(e)))
+        except Exception as e:
+            conn.send(('severe', repr(e)))
+    hc.struct_cleanup()
+    conn.close()
+
+
+class ClassyWorkerPool(object):
+    """ Pool of persistent processes running classy.
+
+    Args:
+        classy_arguments (dict): arguments passed to all the classy runs.
+        n_workers (int): number of worker processes.
+        timeout (float): maximum time in seconds for a classy run. If it is
+            exceeded, the worker is restarted. None for no limit.
+    """
+    def __init__(self, classy_arguments, n_workers=1, timeout=None):
+        self.classy_arguments = classy_arguments
+        self.timeout = timeout
+        self.ctx = mp.get_context('spawn')
+        self.workers = [self._start_worker() for i in range(n_workers)]
+
+    def _start_worker(self):
+        conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=_worker_main,
+                                   args=(child_conn, self.classy_arguments),
+                                   daemon=True)
+        process.start()
+        child_conn.close()
+        return {'process': process, 'conn': conn}
+
+    def _restart_worker(self, i):
+        worker = self.workers[i]
+        worker['process'].terminate()
+        worker['process'].join()
+        worker['conn'].close()
+        _free_worker_blocks(worker['process'].pid)
+        self.workers[i] = self._start_worker()
+
+    def _submit(self, i, pars):
+        try:
+            self.workers[i]['conn'].send(pars)
+        except (BrokenPipeError, OSError):
+            self._restart_worker(i)
+            self.workers[i]['conn'].send(pars)
+
+    def _collect(self, i, deadline):
+        """ Return the (status, result) of the run submitted to worker i.
+        status is 'ok', 'computation' or 'severe' (classy errors), 'timeout'
+        or 'crash'.
+        """
+        conn = self.workers[i]['conn']
+        timeout = None if deadline is None else max(deadline - time.time(), 0)
+        try:
+            if not conn.poll(timeout):
+                self._restart_worker(i)
+                return 'timeout', f'classy run exceeded {self.timeout}s'
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._restart_worker(i)
+            return 'crash', 'classy worker died'
+
+        if status == 'ok':
+            result = ClassyResults(_unpack(result))
+        return status, result
+
+    def compute(self, pars):
+        """ Run classy for pars. Returns a (status, result) tuple (see
+        compute_batch).
+        """
+        return self.compute_batch([pars])[0]
+
+    def compute_batch(self, pars_list):
+        """ Run classy for each element of pars_list, in parallel.
+
+        Returns:
+            list: (status, result) tuples. If status is 'ok', result is a
+            ClassyResults object. Otherwise, it is the error message.
+        """
+        results = []
+        nw = len(self.workers)
+        for start in range(0, len(pars_list), nw):
+            chunk = pars_list[start:start+nw]
+            deadline = None
+            if self.timeout is not None:
+                deadline = time.time() + self.timeout
+            for i, pars in enumerate(chunk):
+                self._submit(i, pars)
+            results.extend(self._collect(i, deadline)
+                           for i in range(len(chunk)))
+        return results
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker['conn'].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+                worker['process'].join()
+            worker['conn'].close()
+            _free_worker_blocks(worker['process'].pid)
+        self.workers = []
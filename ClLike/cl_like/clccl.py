@@ -14,6 +14,8 @@ import numpy as np
 import pyccl as ccl
 from typing import Sequence, Union
 from cobaya.theory import Theory
+from .ccl import LazyCCLResults
+from .timing import StageTimer
 
 
 class CLCCL(Theory):
@@ -34,6 +36,10 @@ class CLCCL(Theory):
     baryons_pk: str = 'nobaryons'
     # If True, CCL will take P(k)s from an upstream camb/CLASS object.
     external_nonlin_pk: bool = True
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
 
     # Default redshift samplings
     _default_z_pk_sampling = np.linspace(0, 5, 100)
@@ -47,6 +53,8 @@ class CLCCL(Theory):
         return self.namedir[v1]+':'+self.namedir[v2]
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(), enabled=self.timing,
+                                profile=self.profile)
         # Pairs of quantities for which we want P(k)
         self._var_pairs = set()
         self._required_results = {}
@@ -103,79 +111,96 @@ class CLCCL(Theory):
 
     def get_can_provide_params(self):
         # return any derived quantities that CCL can compute
-        return ['sigma8']
+        return ['sigma8'] + self.timer.get_param_names()
 
     def get_can_support_params(self):
         # return any nuisance parameters that CCL can support
         return []
 
-    def calculate(self, state, want_derived=True, **params_values_dict):
+    def initialize_with_provider(self, provider):
+        super().initialize_with_provider(provider)
+        # The samplings are fixed once the requirements are known. CCL needs
+        # increasing scale factors, i.e. the reverse of the redshift order.
+        self._a_bg = 1. / (1+self.z_bg[::-1])
+        self._z_pk_grid = None
+        self._a_pk = None
+
+    def _get_a_pk(self, z):
+        # Scale factors of the P(k) grid, only computed if it changes
+        if (self._z_pk_grid is None) or \
+                not np.array_equal(z, self._z_pk_grid):
+            self._z_pk_grid = z
+            self._a_pk = 1. / (1+z[::-1])
+        return self._a_pk
+
+    def _get_pk_grids(self, pair):
+        """ Linear and (if external) nonlinear P(k) grids of a pair of
+        quantities, in the order needed by CCL (increasing scale factor).
+        The arrays are views of the upstream ones.
+        """
         prov = self.provider
-        # Get background from upstream
-        distance = prov.get_comoving_radial_distance(self.z_bg)
-        hubble_z = prov.get_Hubble(self.z_bg)
-        H0 = hubble_z[0]
-        E_of_z = hubble_z / H0
-        distance = np.flip(distance)
-        E_of_z = np.flip(E_of_z)
-
-        # Translate into CCL parameters
-        h = H0 * 0.01
-        Omega_c = prov.get_param('omch2') / h**2
-        Omega_b = prov.get_param('ombh2') / h**2
-
-        # Generate cosmology and populate background
-        a_bg = 1. / (1+self.z_bg[::-1])
+        k, z, pk_lin = prov.get_Pk_grid(var_pair=pair, nonlinear=False)
+        a = self._get_a_pk(z)
+        pk_lin = pk_lin[::-1]
+        pk_nl = None
+        if self.external_nonlin_pk:
+            _, _, pk_nl = prov.get_Pk_grid(var_pair=pair, nonlinear=True)
+            pk_nl = pk_nl[::-1]
+        return a, k, pk_lin, pk_nl
 
-        if self.kmax:
-            pkln = {}
-            if self.external_nonlin_pk:
-                pknl = {}
-            for pair in self._var_pairs:
-                name = self._translate_camb(pair)
-                k, z, Pk_lin = prov.get_Pk_grid(var_pair=pair,
-                                                nonlinear=False)
-                Pk_lin = np.flip(Pk_lin, axis=0)
-                a = 1./(1+np.flip(z))
-                pkln[name] = Pk_lin
-                pkln['a'] = a
-                pkln['k'] = k
-
-                if self.external_nonlin_pk:
-                    k, z, Pk_nl = prov.get_Pk_grid(var_pair=pair,
-                                                   nonlinear=True)
-                    Pk_nl = np.flip(Pk_nl, axis=0)
-                    a = 1./(1+np.flip(z))
-                    pknl[name] = Pk_nl
-                    pknl['a'] = a
-                    pknl['k'] = k
-            cosmo = ccl.CosmologyCalculator(Omega_c=Omega_c,
-                                            Omega_b=Omega_b, h=h,
-                                            n_s=prov.get_param('ns'),
-                                            A_s=prov.get_param('As'),
-                                            T_CMB=2.7255,
-                                            m_nu=prov.get_param('mnu'),
-                                            background={'a': a_bg,
-                                                        'chi': distance,
-                                                        'h_over_h0': E_of_z},
-                                            pk_linear=pkln,
-                                            pk_nonlin=pknl)
-        else:
-            cosmo = ccl.CosmologyCalculator(Omega_c=Omega_c,
-                                            Omega_b=Omega_b, h=h,
-                                            n_s=prov.get_param('ns'),
-                                            A_s=prov.get_param('As'),
-                                            T_CMB=2.7255,
-                                            m_nu=prov.get_param('mnu'),
-                                            background={'a': a_bg,
-                                                        'chi': distance,
-                                                        'h_over_h0': E_of_z})
-
-        state['CCL'] = {'cosmo': cosmo}
-        # Compute sigma8 (we should actually only do this if required -- TODO)
-        state['sigma8'] = ccl.sigma8(cosmo)
-        for req_res, method in self._required_results.items():
-            state['CCL'][req_res] = method(cosmo)
+    def calculate(self, state, want_derived=True, **params_values_dict):
+        self.timer.start_step()
+        try:
+            prov = self.provider
+            # Get background from upstream
+            distance = prov.get_comoving_radial_distance(self.z_bg)
+            hubble_z = prov.get_Hubble(self.z_bg)
+            H0 = hubble_z[0]
+            E_of_z = hubble_z[::-1] / H0
+
+            # Translate into CCL parameters
+            h = H0 * 0.01
+            kwargs = {'Omega_c': prov.get_param('omch2') / h**2,
+                      'Omega_b': prov.get_param('ombh2') / h**2,
+                      'h': h,
+                      'n_s': prov.get_param('ns'),
+                      'A_s': prov.get_param('As'),
+                      'T_CMB': 2.7255,
+                      'm_nu': prov.get_param('mnu'),
+                      'background': {'a': self._a_bg,
+                                     'chi': distance[::-1],
+                                     'h_over_h0': E_of_z}}
+
+            if self.kmax:
+                pkln = {}
+                pknl = {} if self.external_nonlin_pk else None
+                for pair in self._var_pairs:
+                    name = self._translate_camb(pair)
+                    a, k, pk_lin, pk_nl = self._get_pk_grids(pair)
+                    pkln.update({'a': a, 'k': k, name: pk_lin})
+                    if pknl is not None:
+                        pknl.update({'a': a, 'k': k, name: pk_nl})
+                kwargs['pk_linear'] = pkln
+                if pknl is not None:
+                    kwargs['pk_nonlin'] = pknl
+                else:
+                    # Computed by CCL from the linear one
+                    kwargs['nonlinear_model'] = self.matter_pk
+            cosmo = ccl.CosmologyCalculator(**kwargs)
+
+            # The methods passed in the requirements are only evaluated when
+            # their results are accessed
+            state['CCL'] = LazyCCLResults(cosmo, self._required_results)
+            # Compute sigma8 only if required
+            if want_derived and ('sigma8' in self.output_params):
+                state['derived'] = {'sigma8': ccl.sigma8(cosmo)}
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
 
     def get_CCL(self):
         """
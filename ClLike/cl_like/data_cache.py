@@ -0,0 +1,91 @@
+"""
+On-disk cache of the data products built by ClLike (data vector, covariance
+and its inverse, bandpower windows and tracer metadata). Reading a large sacc
+file, applying the scale cuts and inverting the covariance is done once; the
+products are then stored as a flat binary file, which is memory-mapped at
+initialization, together with a small pickled file describing its contents.
+
+The entries are identified by a hash of the input file contents, of the
+settings used to cut the data and of the cache format version.
+"""
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+from .node_shared import _pack, _write, _unpack
+
+
+# Increase when the format or the content of the data products changes
+DATA_CACHE_VERSION = 2
+
+
+def get_file_hash(fname, chunk_size=2**20):
+    """ Return the sha1 hash of the contents of fname. """
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DataCache(object):
+    """ Persistent cache of ClLike data products.
+
+    Args:
+        path (str): directory where the cache is stored.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get_key(self, input_file, **settings):
+        """ Return the hash identifying the input file and the settings used
+        to build the data products (bins, twopoints, scale cuts...).
+        """
+        d = {'file': get_file_hash(input_file), 'settings': settings,
+             'version': DATA_CACHE_VERSION}
+        s = json.dumps(d, sort_keys=True, default=repr)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def _get_fnames(self, key):
+        root = os.path.join(self.path, key)
+        return f'{root}.pkl', f'{root}.bin'
+
+    def load(self, key):
+        """ Return the data products stored under key, or None if they are
+        not in the cache. The arrays are read-only memory-mapped views of the
+        cache file.
+        """
+        fname_meta, fname_data = self._get_fnames(key)
+        try:
+            with open(fname_meta, 'rb') as f:
+                meta = pickle.load(f)
+            if meta['version'] != DATA_CACHE_VERSION:
+                return None
+            if meta['nbytes'] == 0:
+                buf = np.zeros(0, dtype=np.uint8)
+            else:
+                buf = np.memmap(fname_data, dtype=np.uint8, mode='r',
+                                shape=(meta['nbytes'],))
+        except (OSError, ValueError, EOFError, KeyError,
+                pickle.UnpicklingError):
+            return None
+        return _unpack(meta['packed'], buf)
+
+    def save(self, key, products):
+        """ Store the data products under key. """
+        fname_meta, fname_data = self._get_fnames(key)
+        packed, nbytes = _pack(products)
+        buf = np.zeros(nbytes, dtype=np.uint8)
+        _write(products, packed, buf)
+
+        # Write and rename, so that the files are never partially written.
+        # The data go first, since the metadata file marks a valid entry.
+        suffix = f'.{os.getpid()}.tmp'
+        buf.tofile(fname_data + suffix)
+        os.replace(fname_data + suffix, fname_data)
+        with open(fname_meta + suffix, 'wb') as f:
+            pickle.dump({'version': DATA_CACHE_VERSION, 'nbytes': nbytes,
+                         'packed': packed}, f)
+        os.replace(fname_meta + suffix, fname_meta)
@@ -0,0 +1,181 @@
+import numpy as np
+import pyccl as ccl
+from scipy.special import erf
+from .hm_extra import HalomodCorrection, ConcentrationDuffy08M500c
+
+
+# HOD parameters (see HaloModelCalculator.get_hod_moments), in the
+# notation of ccl.halos.HaloProfileHOD
+HOD_PARAMS = ['hod_lMmin_0', 'hod_siglM_0', 'hod_lM0_0', 'hod_lM1_0',
+              'hod_alpha_0', 'hod_fc_0']
+
+
+class HaloModelCalculator(object):
+    """ This class implements a set of methods that can be
+    used to compute the galaxy-galaxy and galaxy-matter power
+    spectra in the halo model, with galaxies described by a
+    halo occupation distribution (HOD).
+
+    The mass function, halo bias and Fourier-space NFW profiles
+    only depend on the cosmology. They are tabulated on a grid of
+    (M, k, a) once per cosmology, so that changes of the HOD
+    parameters only redo the HOD-weighted mass integrals.
+
+    Args:
+        log10k_min (float): decimal logarithm of the minimum
+            Fourier scale (in Mpc^-1).
+        log10k_max (float): decimal logarithm of the maximum
+            Fourier scale (in Mpc^-1).
+        nk_per_decade (int): number of k values per decade.
+        a_arr (array_like): array of scale factors at which
+            the power spectra will be evaluated.
+        log10M_min (float): decimal logarithm of the minimum halo
+            mass (in M_sun) of the mass integrals.
+        log10M_max (float): decimal logarithm of the maximum halo
+            mass (in M_sun) of the mass integrals.
+        nM (int): number of mass samples.
+        mass_function (str): mass function name (see
+            `ccl.halos.mass_function_from_name`).
+        halo_bias (str): halo bias name (see
+            `ccl.halos.halo_bias_from_name`).
+        hm_correction (bool): if True, the power spectra are
+            multiplied by the correction to the 1h - 2h transition
+            regime (see `hm_extra.HalomodCorrection`).
+        hm_correction_file (str): file where the halo model
+            correction table is stored (None to always compute it).
+    """
+    def __init__(self, log10k_min=-4, log10k_max=2, nk_per_decade=20,
+                 a_arr=None, log10M_min=8., log10M_max=16., nM=128,
+                 mass_function='Tinker08', halo_bias='Tinker10',
+                 hm_correction=True, hm_correction_file=None):
+        nk_total = int((log10k_max - log10k_min) * nk_per_decade)
+        self.ks = np.logspace(log10k_min, log10k_max, nk_total)
+        if a_arr is None:
+            a_arr = 1./(1+np.linspace(0., 4., 30)[::-1])
+        self.a_s = a_arr
+        self.lMs = np.linspace(log10M_min, log10M_max, nM)
+        self.Ms = 10.**self.lMs
+        # Trapezoidal weights in log10(M)
+        self.wM = np.full(nM, self.lMs[1] - self.lMs[0])
+        self.wM[[0, -1]] *= 0.5
+
+        # The concentration fixes the mass definition
+        self.cm = ConcentrationDuffy08M500c()
+        self.massdef = self.cm.mdef
+        self.mfc = ccl.halos.mass_function_from_name(mass_function)
+        self.hbc = ccl.halos.halo_bias_from_name(halo_bias)
+        self.prof = ccl.halos.HaloProfileNFW(self.cm)
+
+        if hm_correction:
+            hmcorr = HalomodCorrection(fname=hm_correction_file)
+            self.rk = 1 + hmcorr.rk_interp(self.ks, self.a_s)
+        else:
+            self.rk = np.ones([len(self.a_s), len(self.ks)])
+
+        self.cosmo = None
+        self.pk2d_computed = {}
+
+    def update_cosmo(self, cosmo):
+        """ Tabulates the cosmology-dependent halo quantities. Does
+        nothing if the cosmology has not changed.
+
+        Args:
+            cosmo (:class:`~pyccl.core.Cosmology`): cosmology.
+        """
+        if cosmo is self.cosmo:
+            return
+        mf = self.mfc(cosmo, mass_def=self.massdef)
+        hb = self.hbc(cosmo, mass_def=self.massdef)
+        # Shapes (na, nM) and (na, nM, nk)
+        self.nM = np.array([mf.get_mass_function(cosmo, self.Ms, a)
+                            for a in self.a_s]) * self.wM[None, :]
+        self.bM = np.array([hb.get_halo_bias(cosmo, self.Ms, a)
+                            for a in self.a_s])
+        self.uM = np.array([self.prof.fourier(cosmo, self.ks, self.Ms, a,
+                                              mass_def=self.massdef)
+                            for a in self.a_s]) / self.Ms[None, :, None]
+        self.pk_lin = np.array([ccl.linear_matter_power(cosmo, self.ks, a)
+                                for a in self.a_s])
+        # Matter mass weights and 2-halo integral. The mass missing from
+        # the integral is assumed to be in unbiased small halos.
+        rho_m = ccl.rho_x(cosmo, 1., 'matter', is_comoving=True)
+        self.mM = self.Ms / rho_m
+        self.i_m = np.einsum('am,amk->ak', self.nM * self.bM * self.mM,
+                             self.uM)
+        self.i_m += 1 - np.sum(self.nM * self.bM * self.mM, axis=1)[:, None]
+        self.cosmo = cosmo
+        self.pk2d_computed = {}
+
+    def get_hod_moments(self, hod_params):
+        """ Returns the mean number of central and satellite galaxies
+        in the halos of the mass grid.
+
+        Args:
+            hod_params (dict): HOD parameters (see `HOD_PARAMS`).
+        """
+        lMmin = hod_params['hod_lMmin_0']
+        siglM = hod_params['hod_siglM_0']
+        M0 = 10.**hod_params['hod_lM0_0']
+        M1 = 10.**hod_params['hod_lM1_0']
+        alpha = hod_params['hod_alpha_0']
+        Nc = 0.5 * (1 + erf((self.lMs - lMmin) / siglM))
+        Ns = np.zeros_like(self.Ms)
+        sat = self.Ms > M0
+        Ns[sat] = ((self.Ms[sat] - M0) / M1)**alpha
+        return Nc, Ns
+
+    def update_pk(self, cosmo, hod_params):
+        """ Computes the galaxy power spectra.
+
+        Args:
+            cosmo (:class:`~pyccl.core.Cosmology`): cosmology.
+            hod_params (dict): HOD parameters (see `HOD_PARAMS`).
+
+        Returns:
+            bool: False if there are no galaxies in the mass range at
+            some scale factor, in which case nothing is computed.
+        """
+        self.update_cosmo(cosmo)
+        self.pk2d_computed = {}
+        Nc, Ns = self.get_hod_moments(hod_params)
+        fc = hod_params['hod_fc_0']
+        # Galaxy number density, shape (na,)
+        ng = np.dot(self.nM, Nc * (fc + Ns))
+        if np.any(ng <= 0):
+            return False
+        # Galaxy profile (na, nM, nk) and its second moment
+        ug = Nc[None, :, None] * (fc + Ns[None, :, None] * self.uM)
+        ug2 = Nc[None, :, None] * (2 * fc * Ns[None, :, None] * self.uM +
+                                   (Ns[None, :, None] * self.uM)**2)
+        ug /= ng[:, None, None]
+        ug2 /= ng[:, None, None]**2
+
+        i_g = np.einsum('am,amk->ak', self.nM * self.bM, ug)
+        pgg = (i_g**2 * self.pk_lin +
+               np.einsum('am,amk->ak', self.nM, ug2))
+        pgm = (i_g * self.i_m * self.pk_lin +
+               np.einsum('am,amk->ak', self.nM * self.mM, ug * self.uM))
+        for kind, pk in [('d1d1', pgg), ('md1', pgm)]:
+            self.pk2d_computed[kind] = ccl.Pk2D(a_arr=self.a_s,
+                                                lk_arr=np.log(self.ks),
+                                                pk_arr=pk*self.rk,
+                                                is_logp=False)
+        return True
+
+    def get_pk(self, kind, pnl=None, cosmo=None):
+        """ Returns a :class:`~pyccl.pk2d.Pk2D` object containing
+        the power spectrum for a given pair of quantities.
+
+        Args:
+            kind (str): 'mm' (the input nonlinear matter power
+                spectrum), 'md1' (galaxy-matter) or 'd1d1'
+                (galaxy-galaxy).
+            pnl (Pk2D): nonlinear matter power spectrum.
+            cosmo (:class:`~pyccl.core.Cosmology`): cosmology
+                (unused).
+        """
+        if kind == 'mm':
+            return pnl
+        if kind == 'd1m':
+            kind = 'md1'
+        return self.pk2d_computed[kind]
@@ -1,49 +1,141 @@
+import os
+import zipfile
 import pyccl as ccl
 import numpy as np
+from scipy.interpolate import RectBivariateSpline
 
 
 class HalomodCorrection(object):
     """Provides methods to estimate the correction to the halo
     model in the 1h - 2h transition regime.
 
+    The correction is the ratio between the HALOFIT power spectrum and
+    the halo model one (Tinker 2010 mass function and halo bias, Duffy
+    2008 concentration and NFW profiles, with a 200-matter mass
+    definition) for a vanilla LCDM cosmology. It is computed on a grid
+    of (k, a) and interpolated with a bicubic spline.
+
     Args:
-        cosmo (:obj:`ccl.Cosmology`): cosmology.
         k_range (list): range of k to use (in Mpc^-1).
         nlk (int): number of samples in log(k) to use.
         z_range (list): range of redshifts to use.
         nz (int): number of samples in redshift to use.
+        fname (str): if not None, the correction table is read from
+            this file (see `save`) if it exists and was computed with
+            the same settings. Otherwise it is computed and saved to it.
     """
     def __init__(self,
                  k_range=[1E-1, 5], nlk=20,
-                 z_range=[0., 1.], nz=16):
-        from scipy.interpolate import interp2d
+                 z_range=[0., 1.], nz=16, fname=None):
+        self.settings = {'k_range': np.array(k_range, dtype=float),
+                         'nlk': nlk,
+                         'z_range': np.array(z_range, dtype=float),
+                         'nz': nz}
+        if (fname is not None) and self._load(fname):
+            return
 
-        cosmo = ccl.CosmologyVanillaLCDM()
         lkarr = np.linspace(np.log10(k_range[0]),
                             np.log10(k_range[1]),
                             nlk)
-        karr = 10.**lkarr
-        zarr = np.linspace(z_range[0], z_range[1], nz)
+        # Increasing scale factor
+        aarr = (1. / (1 + np.linspace(z_range[0], z_range[1], nz)))[::-1]
+        self._setup(lkarr, aarr, self._get_ratio(lkarr, aarr))
+        if fname is not None:
+            self.save(fname)
+
+    def _get_ratio(self, lkarr, aarr):
+        cosmo = ccl.CosmologyVanillaLCDM()
+        lnk = np.log(10.) * lkarr
+
+        # Halo model, evaluated on the whole grid at once
+        mdef = ccl.halos.MassDef200m()
+        cm = ccl.halos.ConcentrationDuffy08(mdef=mdef)
+        mf = ccl.halos.MassFuncTinker10(cosmo, mass_def=mdef)
+        hb = ccl.halos.HaloBiasTinker10(cosmo, mass_def=mdef)
+        hmc = ccl.halos.HMCalculator(cosmo, mf, hb, mdef)
+        prof = ccl.halos.HaloProfileNFW(cm)
+        pk_hm = ccl.halos.halomod_Pk2D(cosmo, hmc, prof, normprof1=True,
+                                       lk_arr=lnk, a_arr=aarr)
+        _, _, pk_hm = pk_hm.get_spline_arrays()
+
+        # HALOFIT, interpolated from the CCL tables
+        cosmo.compute_nonlin_power()
+        a_nl, lnk_nl, pk_nl = cosmo.get_nonlin_power().get_spline_arrays()
+        lpk_nl = RectBivariateSpline(a_nl, lnk_nl, np.log(pk_nl))
+        pk_hf = np.exp(lpk_nl(aarr, lnk))
+
+        # Shape (nlk, na)
+        return (pk_hf / pk_hm).T
 
-        pk_hm = np.array([ccl.halomodel_matter_power(cosmo, karr, a)
-                          for a in 1. / (1 + zarr)])
-        pk_hf = np.array([ccl.nonlin_matter_power(cosmo, karr, a)
-                          for a in 1. / (1 + zarr)])
-        ratio = pk_hf / pk_hm
+    def _load(self, fname):
+        # Returns False if the file does not exist, cannot be read (e.g.
+        # being written by another process) or has different settings.
+        if not os.path.isfile(fname):
+            return False
+        try:
+            with np.load(fname) as d:
+                if not self._is_same_settings(d):
+                    return False
+                self._setup(d['lkarr'], d['aarr'], d['ratio'])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return False
+        return True
 
-        self.rk_func = interp2d(lkarr, 1/(1+zarr), ratio,
-                                bounds_error=False, fill_value=1)
+    def _is_same_settings(self, d):
+        # Tables saved without the settings are recomputed
+        return all((key in d) and np.array_equal(d[key], value)
+                   for key, value in self.settings.items())
+
+    def _setup(self, lkarr, aarr, ratio):
+        self.lkarr = lkarr
+        self.aarr = aarr
+        self.ratio = ratio
+        kx = min(3, len(lkarr) - 1)
+        ky = min(3, len(aarr) - 1)
+        self.rk_func = RectBivariateSpline(lkarr, aarr, ratio, kx=kx, ky=ky)
+
+    def save(self, fname):
+        """
+        Saves the correction table and the settings it was computed
+        with to a file, which can be read by passing its name to the
+        constructor.
+
+        Args:
+            fname (str): output file name. It is used as given (no
+                `.npz` extension is added).
+        """
+        # Write and rename, so that other processes never read a partially
+        # written file
+        tmp = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, lkarr=self.lkarr, aarr=self.aarr, ratio=self.ratio,
+                     **self.settings)
+        os.replace(tmp, fname)
 
     def rk_interp(self, k, a):
         """
         Returns the halo model correction for an array of k
-        values at a given redshift.
+        values at a given scale factor or array of scale factors.
+        The correction is zero outside the range of the table.
 
         Args:
             k (float or array): wavenumbers in units of Mpc^-1.
-            a (float): value of the scale factor.
+            a (float or array): value of the scale factor.
+
+        Returns:
+            array: correction with shape `(len(a), len(k))` if a is an
+            array, or `(len(k),)` otherwise.
         """
-        return self.rk_func(np.log10(k), a)-1
+        lk = np.log10(np.atleast_1d(k))[None, :]
+        a_use = np.atleast_1d(a)[:, None]
+        lk, a_use = np.broadcast_arrays(lk, a_use)
+        rk = self.rk_func.ev(lk, a_use)
+        out = ((lk < self.lkarr[0]) | (lk > self.lkarr[-1]) |
+               (a_use < self.aarr[0]) | (a_use > self.aarr[-1]))
+        rk[out] = 1.
+        if np.ndim(a) == 0:
+            rk = rk[0]
+        return rk - 1
 
 
 class ConcentrationDuffy08M500c(ccl.halos.Concentration):
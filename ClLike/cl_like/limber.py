@@ -6,7 +6,8 @@ galaxy bias parameters).
 from cobaya.theory import Theory
 from cobaya.log import LoggedError
 from scipy.interpolate import interp1d
-from .pixwin import beam_hpix
+from .pixwin import PixelWindow
+from .timing import StageTimer
 import pyccl as ccl
 import numpy as np
 
@@ -24,12 +25,31 @@ class Limber(Theory):
 
     # Sample type
     sample_type: str = "convolve"
+    # If True, use the power spectra with the baryonic effects applied by the
+    # BaryonBoost theory class
+    baryon_boost: bool = False
+    # Data type of the computed C_ells ('float32' halves their memory)
+    cl_dtype: str = "float64"
+    # File name pattern of the exact HEALPix pixel window tables, formatted
+    # with the nside (e.g. "pixel_window_n{nside:04d}.fits"). If empty, the
+    # Gaussian approximation is used (see pixwin.py).
+    pixwin_table: str = ""
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
     # Magnification bias selected per tracer in defaults
     # with_magnification_bias: bool = False
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(),
+                                stages=['tracers', 'angular_cl', 'bpw'],
+                                counters=['angular_cl'],
+                                enabled=self.timing,
+                                profile=self.profile)
         self.cl_meta = None
         self.l_sample = None
+        self.bpw_ops = None
         self.tracer_qs = None
         self.bin_properties = None
         self.is_PT_bias = None
@@ -42,9 +62,17 @@ class Limber(Theory):
     def initialize_with_provider(self, provider):
         self.provider = provider
         self.l_sample = self._get_ell_sampling()
-        self._add_pixbeam_to_cl_meta()
+        self.bpw_ops = self._get_bpw_operators()
         self.is_PT_bias = self.provider.get_is_PT_bias()
         self.bias_model = self.provider.get_bias_model()
+        if self.bias_model == 'HaloModel':
+            # The HOD parameters (and the galaxy power spectra) are shared
+            # by all the galaxy_density tracers
+            ngal = list(self.tracer_qs.values()).count('galaxy_density')
+            if ngal > 1:
+                raise LoggedError(self.log, "bias_model 'HaloModel' can "
+                                  "only be used with one galaxy_density "
+                                  f"tracer. Found {ngal}.")
 
     def get_requirements(self):
         return {'bias_model': None, 'is_PT_bias': None}
@@ -58,12 +86,26 @@ class Limber(Theory):
         self.tracer_qs = options.get("tracer_qs")
         self.bin_properties = options.get("bin_properties")
 
+        if self.baryon_boost:
+            return {"CCL": None, "Pk": None, "Pk_baryons": None}
         return {"CCL": None, "Pk": None}
 
+    def get_can_provide_params(self):
+        return self.timer.get_param_names()
+
     def calculate(self, state, want_derived=True, **params_values_dict):
-        cosmo = self.provider.get_CCL()["cosmo"]
-        state["Limber"] = {"cl_data": self._get_cl_data(cosmo,
-                                                        **params_values_dict)}
+        self.timer.start_step()
+        try:
+            cosmo = self.provider.get_CCL()["cosmo"]
+            cld = self._get_cl_data(cosmo, **params_values_dict)
+            state["Limber"] = {"cl_data": cld}
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
 
     def get_Limber(self):
         """Get dictionary of Limber computed quantities.
@@ -75,13 +117,21 @@ class Limber(Theory):
         """
         return self._current_state['Limber']
 
-    def _eval_interp_cl(self, cl_in, l_bpw, w_bpw):
-        """ Interpolates C_ell, evaluates it at bandpower window
-        ell values and convolves with window."""
-        f = interp1d(np.log(1E-3+self.l_sample), cl_in)
-        cl_unbinned = f(np.log(1E-3+l_bpw))
-        cl_binned = np.dot(w_bpw, cl_unbinned)
-        return cl_binned
+    def _bin_cl(self, cl, op):
+        """ Applies the bandpower operator of a pair of tracers
+        (see _get_bpw_operators) to its sampled C_ell."""
+        if op is None:
+            return cl
+        with self.timer.stage('bpw'):
+            if op.ndim == 1:
+                return cl * op
+            return np.dot(op, cl)
+
+    def _angular_cl(self, cosmo, tr1, tr2, ls, pk):
+        """ ccl.angular_cl, timed and counted. """
+        self.timer.count('angular_cl')
+        with self.timer.stage('angular_cl'):
+            return ccl.angular_cl(cosmo, tr1, tr2, ls, p_of_k_a=pk)
 
     def _get_tracers(self, cosmo, **pars):
         """ Obtains CCL tracers (and perturbation theory tracers,
@@ -108,6 +158,12 @@ class Limber(Theory):
                 # Tracers for the biased components
                 t1 = [tr]
                 t1n = ['d1']
+                if self.bias_model == 'HaloModel':
+                    # The galaxy bias is given by the HOD
+                    t0 = tr
+                    t0n = ['d1']
+                    t1 = []
+                    t1n = []
                 if self.is_PT_bias:
                     for bn, dn in zip(['b2', 'bs', 'bk2'], ['d2', 's2', 'k2']):
                         t1.append(tr)
@@ -121,6 +177,9 @@ class Limber(Theory):
                                                 mag_bias=(z, oz/5.))
                     t1.append(tr)
                     t1n.append("w")
+                if not t1:
+                    t1 = None
+                    t1n = [None]
             elif q == 'galaxy_shear':
                 dndz = self._get_nz(cosmo, name, **pars)
                 t0 = ccl.WeakLensingTracer(cosmo, dndz=dndz)
@@ -150,17 +209,52 @@ class Limber(Theory):
     def _get_cl_data(self, cosmo, **pars):
         """ Compute all C_ells."""
         # Get P(k)s
-        pkd = self.provider.get_Pk()["pk_data"]
+        if self.baryon_boost:
+            pkd = self.provider.get_Pk_baryons()["pk_data"]
+        else:
+            pkd = self.provider.get_Pk()["pk_data"]
 
         # Gather all tracers
-        trs0, trs1, trs0_dnames, trs1_dnames = self._get_tracers(cosmo, **pars)
+        with self.timer.stage('tracers'):
+            trs0, trs1, trs0_dnames, trs1_dnames = \
+                self._get_tracers(cosmo, **pars)
 
-        # Correlate all needed pairs of tracers
-        cls_00 = []
-        cls_01 = []
-        cls_10 = []
-        cls_11 = []
+        # Layout of the binned C_ells in a single buffer
+        shapes = []
         for clm in self.cl_meta:
+            n1 = clm['bin_1']
+            n2 = clm['bin_2']
+            nl = len(clm['l_eff'])
+            nb1 = None if trs1[n1] is None else len(trs1[n1])
+            nb2 = None if trs1[n2] is None else len(trs1[n2])
+            has_b1 = nb1 is not None
+            has_b2 = nb2 is not None
+            shape = {'00': (nl,) if (trs0[n1] and trs0[n2]) else None,
+                     '01': (nb2, nl) if (trs0[n1] and has_b2) else None,
+                     '10': (nb1, nl) if (trs0[n2] and has_b1) else None,
+                     '11': (nb1, nb2, nl) if (has_b1 and has_b2) else None}
+            if n1 == n2:
+                # Same as '01'
+                shape['10'] = None
+            shapes.append(shape)
+        # Not reused between steps: Cobaya may keep previous states
+        buf = np.zeros(sum([int(np.prod(sh)) for shape in shapes
+                            for sh in shape.values() if sh is not None]),
+                       dtype=self.cl_dtype)
+
+        # Correlate all needed pairs of tracers
+        offset = 0
+        cls = {'cl00': [], 'cl01': [], 'cl10': [], 'cl11': []}
+        for clm, op, shape in zip(self.cl_meta, self.bpw_ops, shapes):
+            views = {}
+            for k, sh in shape.items():
+                if sh is None:
+                    views[k] = None
+                else:
+                    size = int(np.prod(sh))
+                    views[k] = buf[offset:offset+size].reshape(sh)
+                    offset += size
+
             if self.sample_cen:
                 ls = clm['l_eff']
             elif self.sample_bpw:
@@ -181,46 +275,33 @@ class Limber(Theory):
             t1dn_1 = trs1_dnames[n1]
             t1dn_2 = trs1_dnames[n2]
             # 00: unbiased x unbiased
-            if t0_1 and t0_2:
+            cl00 = views['00']
+            if cl00 is not None:
                 pk = pkd[f'pk_{t0dn_1}{t0dn_2}']
-                cl00 = ccl.angular_cl(cosmo, t0_1, t0_2, ls, p_of_k_a=pk) * clm['pixbeam']
-                cls_00.append(cl00)
-            else:
-                cls_00.append(None)
+                cl = self._angular_cl(cosmo, t0_1, t0_2, ls, pk)
+                cl00[:] = self._bin_cl(cl, op)
             # 01: unbiased x biased
-            if t0_1 and (t1_2 is not None):
-                cl01 = []
-                for t12, dn in zip(t1_2, t1dn_2):
+            cl01 = views['01']
+            if cl01 is not None:
+                for i2, (t12, dn) in enumerate(zip(t1_2, t1dn_2)):
                     pk = pkd[f'pk_{t0dn_1}{dn}']
                     if pk is not None:
-                        cl = ccl.angular_cl(cosmo, t0_1, t12, ls, p_of_k_a=pk) * clm['pixbeam']
-                    else:
-                        cl = np.zeros_like(ls)
-                    cl01.append(cl)
-                cl01 = np.array(cl01)
-            else:
-                cl01 = None
-            cls_01.append(cl01)
+                        cl = self._angular_cl(cosmo, t0_1, t12, ls, pk)
+                        cl01[i2] = self._bin_cl(cl, op)
             # 10: biased x unbiased
             if n1 == n2:
-                cls_10.append(cl01)
+                cl10 = cl01
             else:
-                if t0_2 and (t1_1 is not None):
-                    cl10 = []
-                    for t11, dn in zip(t1_1, t1dn_1):
+                cl10 = views['10']
+                if cl10 is not None:
+                    for i1, (t11, dn) in enumerate(zip(t1_1, t1dn_1)):
                         pk = pkd[f'pk_{t0dn_2}{dn}']
                         if pk is not None:
-                            cl = ccl.angular_cl(cosmo, t11, t0_2, ls, p_of_k_a=pk) * clm['pixbeam']
-                        else:
-                            cl = np.zeros_like(ls)
-                        cl10.append(cl)
-                    cl10 = np.array(cl10)
-                else:
-                    cl10 = None
-                cls_10.append(cl10)
+                            cl = self._angular_cl(cosmo, t11, t0_2, ls, pk)
+                            cl10[i1] = self._bin_cl(cl, op)
             # 11: biased x biased
-            if (t1_1 is not None) and (t1_2 is not None):
-                cl11 = np.zeros([len(t1_1), len(t1_2), len(ls)])
+            cl11 = views['11']
+            if cl11 is not None:
                 autocorr = n1 == n2
                 for i1, (t11, dn1) in enumerate(zip(t1_1, t1dn_1)):
                     for i2, (t12, dn2) in enumerate(zip(t1_2, t1dn_2)):
@@ -229,73 +310,14 @@ class Limber(Theory):
                         else:
                             pk = pkd[f'pk_{dn1}{dn2}']
                             if pk is not None:
-                                cl = ccl.angular_cl(cosmo, t11, t12, ls, p_of_k_a=pk) * clm['pixbeam']
-                            else:
-                                cl = np.zeros_like(ls)
-                            cl11[i1, i2, :] = cl
-            else:
-                cl11 = None
-            cls_11.append(cl11)
-        # Bandpower window convolution
-        if self.sample_cen:
-            clbs_00 = cls_00
-            clbs_01 = cls_01
-            clbs_10 = cls_10
-            clbs_11 = cls_11
-        elif self.sample_bpw:
-            clbs_00 = []
-            clbs_01 = []
-            clbs_10 = []
-            clbs_11 = []
-            # 00: unbiased x unbiased
-            for clm, cl00 in zip(self.cl_meta, cls_00):
-                if (cl00 is not None):
-                    clb00 = self._eval_interp_cl(cl00, clm['l_bpw'], clm['w_bpw'])
-                else:
-                    clb00 = None
-                clbs_00.append(clb00)
-            for clm, cl01, cl10 in zip(self.cl_meta, cls_01, cls_10):
-                # 01: unbiased x biased
-                if (cl01 is not None):
-                    clb01 = []
-                    for cl in cl01:
-                        clb = self._eval_interp_cl(cl, clm['l_bpw'], clm['w_bpw'])
-                        clb01.append(clb)
-                    clb01 = np.array(clb01)
-                else:
-                    clb01 = None
-                clbs_01.append(clb01)
-                # 10: biased x unbiased
-                if clm['bin_1'] == clm['bin_2']:
-                    clbs_10.append(clb01)
-                else:
-                    if (cl10 is not None):
-                        clb10 = []
-                        for cl in cl10:
-                            clb = self._eval_interp_cl(cl, clm['l_bpw'], clm['w_bpw'])
-                            clb10.append(clb)
-                        clb10 = np.array(clb10)
-                    else:
-                        clb10 = None
-                    clbs_10.append(clb10)
-                # 11: biased x biased
-                for clm, cl11 in zip(self.cl_meta, cls_11):
-                    if (cl11 is not None):
-                        clb11 = np.zeros((cl11.shape[0], cl11.shape[1], len(clm['l_eff'])))
-                        autocorr = clm['bin_1'] == clm['bin_2']
-                        for i1 in range(np.shape(cl11)[0]):
-                            for i2 in range(np.shape(cl11)[1]):
-                                if autocorr and i2 < i1:
-                                    clb11[i1, i2] = clb11[i2, i1]
-                                else:
-                                    cl = cl11[i1,i2,:]
-                                    clb = self._eval_interp_cl(cl, clm['l_bpw'], clm['w_bpw'])
-                                    clb11[i1,i2,:] = clb
-                    else:
-                        clb11 = None
-                    clbs_11.append(clb11)
-
-        return {'cl00': clbs_00, 'cl01': clbs_01, 'cl10': clbs_10, 'cl11': clbs_11}
+                                cl = self._angular_cl(cosmo, t11, t12, ls, pk)
+                                cl11[i1, i2] = self._bin_cl(cl, op)
+            cls['cl00'].append(cl00)
+            cls['cl01'].append(cl01)
+            cls['cl10'].append(cl10)
+            cls['cl11'].append(cl11)
+
+        return cls
 
     def _get_nz(self, cosmo, name, **pars):
         """ Get redshift distribution for a given tracer.
@@ -356,18 +378,64 @@ class Limber(Theory):
             raise LoggedError(self.log, f"Unknown IA model {self.ia_model}")
         return (z, A_IA)
 
-    def _add_pixbeam_to_cl_meta(self):
-        # Pixel window function product for each power spectrum
+    def _get_interp_matrix(self, l_bpw):
+        """ Matrix of the linear interpolation in log(ell) from the sampled
+        multipoles to l_bpw."""
+        x = np.log(1E-3+self.l_sample)
+        xi = np.log(1E-3+l_bpw)
+        if (xi.min() < x[0]) or (xi.max() > x[-1]):
+            raise LoggedError(self.log, "The bandpower window multipoles "
+                              "are outside the sampled range.")
+        j = np.clip(np.searchsorted(x, xi, side='right')-1, 0, x.size-2)
+        t = (xi - x[j]) / (x[j+1] - x[j])
+        mat = np.zeros([xi.size, x.size])
+        rows = np.arange(xi.size)
+        mat[rows, j] = 1 - t
+        mat[rows, j+1] += t
+        return mat
+
+    def _get_bpw_operators(self):
+        """ Linear operators mapping the C_ell of each pair of tracers at the
+        sampled multipoles into the binned one. They include the pixel window
+        functions and, if sampling over the whole bandpower windows, the
+        interpolation to the window multipoles and the window convolution.
+        Pairs with the same windows and resolutions share their operator.
+        The windows are compared by content, since the same window can be
+        stored in different arrays (e.g. when read from the data cache).
+        """
+        def get_array_key(arr):
+            return (arr.shape, arr.dtype.str, hash(arr.tobytes()))
+
+        pixwin = PixelWindow(self.pixwin_table)
+        # Lists of (l_bpw, w_bpw, operator) for each key
+        ops = {}
+        bpw_ops = []
         for clm in self.cl_meta:
             if self.sample_cen:
-                ls = clm['l_eff']
-            elif self.sample_bpw:
-                ls = self.l_sample
-            beam = np.ones(ls.size)
-            for nside in [clm['nside_1'], clm['nside_2']]:
-                if nside is not None:
-                    beam *= beam_hpix(ls, nside)
-            clm['pixbeam'] = beam
+                # Only the pixel windows (None without pixelization)
+                bpw_ops.append(pixwin.get(clm['l_eff'], clm['nside_1'],
+                                          clm['nside_2']))
+                continue
+            nsides = tuple(sorted([ns for ns in [clm['nside_1'],
+                                                 clm['nside_2']]
+                                   if ns is not None]))
+            l_bpw = clm['l_bpw']
+            w_bpw = clm['w_bpw']
+            key = (get_array_key(l_bpw), get_array_key(w_bpw), nsides)
+            same = [op for (l, w, op) in ops.get(key, [])
+                    if np.array_equal(l, l_bpw) and np.array_equal(w, w_bpw)]
+            if same:
+                bpw_ops.append(same[0])
+                continue
+            interp = self._get_interp_matrix(l_bpw)
+            op = np.dot(w_bpw, interp)
+            beam = pixwin.get(self.l_sample, clm['nside_1'], clm['nside_2'])
+            if beam is not None:
+                op *= beam[None, :]
+            op.flags.writeable = False
+            ops.setdefault(key, []).append((l_bpw, w_bpw, op))
+            bpw_ops.append(op)
+        return bpw_ops
 
     def _get_ell_sampling(self, nl_per_decade=30):
         # Selects ell sampling.
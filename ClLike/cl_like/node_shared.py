@@ -0,0 +1,124 @@
+"""
+Node-level sharing of read-only data products between MPI processes. When
+several chains run on the same node, only one of them (the node leader)
+builds the products (e.g. the data vector, covariance and bandpower windows
+read by ClLike). The arrays are copied into an MPI shared memory window and
+every other process on the node maps them instead of building its own copy.
+"""
+import numpy as np
+
+
+def get_node_comm():
+    """ Return the communicator of the MPI processes running on this node, or
+    None if mpi4py is not available or there is only one process.
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    comm = MPI.COMM_WORLD
+    if comm.Get_size() == 1:
+        return None
+    return comm.Split_type(MPI.COMM_TYPE_SHARED)
+
+
+def _align(n, alignment=64):
+    return -(-n // alignment) * alignment
+
+
+def _pack(obj, offset=0, memo=None):
+    """ Replace the arrays in obj by references to their position in a flat
+    buffer. Returns the packed object and the buffer size. Arrays appearing
+    several times in obj are only stored once.
+    """
+    if memo is None:
+        memo = {}
+    if isinstance(obj, np.ndarray) and (obj.dtype != object):
+        if id(obj) in memo:
+            return memo[id(obj)], offset
+        ref = ('__node_shared__', offset, obj.shape, obj.dtype.str)
+        memo[id(obj)] = ref
+        return ref, _align(offset + obj.nbytes)
+    elif isinstance(obj, dict):
+        packed = {}
+        for k, v in obj.items():
+            packed[k], offset = _pack(v, offset, memo)
+        return packed, offset
+    elif isinstance(obj, (list, tuple)):
+        packed = []
+        for v in obj:
+            p, offset = _pack(v, offset, memo)
+            packed.append(p)
+        return type(obj)(packed), offset
+    return obj, offset
+
+
+def _is_ref(obj):
+    return isinstance(obj, tuple) and (len(obj) == 4) and \
+        (obj[0] == '__node_shared__')
+
+
+def _write(obj, packed, buf):
+    """ Copy the arrays in obj into their position in buf. """
+    if _is_ref(packed):
+        _, offset, shape, dtype = packed
+        np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)[...] = obj
+    elif isinstance(packed, dict):
+        for k, v in packed.items():
+            _write(obj[k], v, buf)
+    elif isinstance(packed, (list, tuple)):
+        for o, p in zip(obj, packed):
+            _write(o, p, buf)
+
+
+def _unpack(packed, buf):
+    """ Inverse of _pack. The arrays returned are read-only views of buf. """
+    if _is_ref(packed):
+        _, offset, shape, dtype = packed
+        arr = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        arr.flags.writeable = False
+        return arr
+    elif isinstance(packed, dict):
+        return {k: _unpack(v, buf) for k, v in packed.items()}
+    elif isinstance(packed, (list, tuple)):
+        return type(packed)(_unpack(v, buf) for v in packed)
+    return packed
+
+
+def share_on_node(build, comm=None):
+    """ Build a (possibly nested) collection of arrays once per node and
+    share it between all the processes on the node.
+
+    Args:
+        build (callable): function without arguments returning the products
+            (dictionaries, lists and tuples of arrays and picklable objects).
+            It is only called by the node leader.
+        comm: node communicator (see get_node_comm). If None, build is
+            simply called.
+
+    Returns:
+        tuple: the products (with the arrays replaced by read-only views of
+        the shared memory window) and the window, which must be kept alive
+        while the products are in use (None if comm is None).
+    """
+    if comm is None:
+        return build(), None
+
+    from mpi4py import MPI
+
+    is_leader = comm.Get_rank() == 0
+    products = packed = None
+    nbytes = 0
+    if is_leader:
+        products = build()
+        packed, nbytes = _pack(products)
+    packed, nbytes = comm.bcast((packed, nbytes), root=0)
+
+    # Only the leader allocates memory. The others map its segment.
+    win = MPI.Win.Allocate_shared(nbytes if is_leader else 0, 1, comm=comm)
+    mem, _ = win.Shared_query(0)
+    buf = np.ndarray(nbytes, dtype=np.uint8, buffer=mem)
+    if is_leader:
+        _write(products, packed, buf)
+    comm.Barrier()
+    return _unpack(packed, buf), win
@@ -26,3 +26,93 @@ def beam_hpix(ll, ns):
     """
     fwhm_hp_amin = 60 * 41.7 / ns
     return beam_gaussian(ll, fwhm_hp_amin)
+
+
+def read_pixwin_table(fname):
+    """
+    Reads a HEALPix pixel window function table.
+    Args:
+        fname (str): file name. It can be a FITS file as distributed
+            with HEALPix (e.g. `pixel_window_n0512.fits`, whose first
+            column is the temperature window; requires astropy), a
+            `.npy` file or a text file. The `.npy` and text files must
+            contain either the window for ell = 0, 1, ... or two columns
+            (ell, window).
+    Returns:
+        tuple: multipoles and window function.
+    """
+    if fname.endswith(('.fits', '.fits.gz')):
+        from astropy.io import fits
+        with fits.open(fname) as hdul:
+            w = np.array(hdul[1].data.field(0), dtype=float).flatten()
+        return np.arange(w.size, dtype=float), w
+    if fname.endswith('.npy'):
+        d = np.load(fname)
+    else:
+        d = np.loadtxt(fname)
+    if d.ndim == 1:
+        return np.arange(d.size, dtype=float), d
+    return d[:, 0], d[:, 1]
+
+
+class PixelWindow(object):
+    """
+    Pixel window functions of pairs of HEALPix maps, cached for
+    each combination of resolutions and multipoles.
+    Args:
+        table (str): file name pattern of the exact pixel window
+            tables (see `read_pixwin_table`), formatted with the
+            resolution parameter, e.g. `pixwin/pixel_window_n{nside:04d}.fits`.
+            If empty, the Gaussian approximation (`beam_hpix`) is used.
+    """
+    def __init__(self, table=""):
+        self.table = table
+        self._tables = {}
+        self._cache = {}
+
+    def _get_table(self, nside):
+        if nside not in self._tables:
+            fname = self.table.format(nside=nside)
+            self._tables[nside] = read_pixwin_table(fname)
+        return self._tables[nside]
+
+    def get_window(self, ll, nside):
+        """
+        Returns the pixel window function of a map.
+        Args:
+            ll (array): multipoles.
+            nside (int): HEALPix resolution parameter.
+        Returns:
+            array: window sampled at `ll`.
+        """
+        if not self.table:
+            return beam_hpix(ll, nside)
+        ls, w = self._get_table(nside)
+        if np.max(ll) > ls[-1]:
+            raise ValueError(f"The pixel window table for nside={nside} "
+                             f"only goes up to ell={ls[-1]}")
+        return np.interp(ll, ls, w)
+
+    def get(self, ll, nside_1, nside_2):
+        """
+        Returns the product of the pixel windows of two maps (None for
+        no pixelization). The result is cached and must not be modified.
+        Args:
+            ll (array): multipoles.
+            nside_1, nside_2 (int or None): resolution parameters.
+        Returns:
+            array or None: window sampled at `ll`, or None if neither
+            map is pixelized.
+        """
+        nsides = tuple(sorted([ns for ns in [nside_1, nside_2]
+                               if ns is not None]))
+        if not nsides:
+            return None
+        key = (nsides, ll.size, hash(ll.tobytes()))
+        if key not in self._cache:
+            beam = np.ones(ll.size)
+            for nside in nsides:
+                beam *= self.get_window(ll, nside)
+            beam.flags.writeable = False
+            self._cache[key] = beam
+        return self._cache[key]
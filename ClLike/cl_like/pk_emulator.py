@@ -0,0 +1,141 @@
+"""
+Emulated linear matter power spectrum for the CCL theory class. It replaces
+the Boltzmann solver with the baccoemu linear emulator and builds the CCL
+cosmology with ccl.CosmologyCalculator, which computes the background (and
+the nonlinear power spectrum, if requested) from the emulated linear one.
+"""
+import numpy as np
+import pyccl as ccl
+import baccoemu
+import warnings
+
+
+class BaccoLinearEmulator(object):
+    """ Computes the linear matter power spectrum with baccoemu and returns
+    the corresponding CCL cosmology.
+
+    Args:
+        a_arr (array_like): array of scale factors at which the power
+            spectrum is emulated. By default, 30 scale factors between 1 and
+            the smallest one allowed by the emulator. CCL extrapolates to
+            smaller scale factors with the linear growth factor.
+        nk_per_decade (int): number of k values per decade. The k range is
+            that of the emulator.
+    """
+    def __init__(self, a_arr=None, nk_per_decade=25):
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', category=UserWarning)
+            self.mpk = baccoemu.Matter_powerspectrum()
+
+        emulator = self.mpk.emulator['linear']
+        amin = emulator['bounds'][-1][0]
+        if a_arr is None:
+            a_arr = np.linspace(amin, 1, 30)
+        a_arr = np.sort(a_arr)
+        if np.any(a_arr < amin):
+            raise ValueError("baccoemu linear emulator only defined for scale "
+                             f"factors between 1 and {amin}")
+        self.a_s = a_arr
+
+        # k in h/Mpc
+        l10k_min = np.log10(emulator['k'].min())
+        l10k_max = np.log10(emulator['k'].max())
+        nk = int((l10k_max - l10k_min) * nk_per_decade)
+        self.ks_h = np.logspace(l10k_min, l10k_max, nk)
+
+    def _get_bacco_pars(self, pars):
+        """ Return the baccoemu parameters (and A_s) for the CCL parameters
+        `pars`, one entry per scale factor.
+        """
+        cospar = {'omega_cold': pars['Omega_c'] + pars['Omega_b'],
+                  'omega_baryon': pars['Omega_b'],
+                  'ns': pars['n_s'],
+                  'hubble': pars['h'],
+                  'neutrino_mass': np.sum(pars.get('m_nu', 0.)),
+                  'w0': pars.get('w0', -1.),
+                  'wa': pars.get('wa', 0.)}
+
+        if pars.get('A_s') is not None:
+            A_s = pars['A_s']
+        else:
+            # Emulated P(k) is linear in A_s
+            A_s_fid = 2.1e-9
+            sigma8_fid = self.mpk.get_sigma8(cold=False, A_s=A_s_fid,
+                                             expfactor=1, **cospar)
+            A_s = (pars['sigma8'] / sigma8_fid)**2 * A_s_fid
+        cospar['A_s'] = A_s
+
+        cospar_and_a = {k: np.full(self.a_s.size, v)
+                        for k, v in cospar.items()}
+        cospar_and_a['expfactor'] = self.a_s
+
+        return cospar_and_a, A_s
+
+    def get_pk_linear(self, pars):
+        """ Return the dictionary with the emulated linear matter power
+        spectrum, as needed by ccl.CosmologyCalculator (k in 1/Mpc and
+        P(k) in Mpc^3).
+
+        Args:
+            pars (dict): CCL cosmological parameters.
+        """
+        cospar_and_a, _ = self._get_bacco_pars(pars)
+        h = pars['h']
+        pk = self.mpk.get_linear_pk(k=self.ks_h, cold=False,
+                                    **cospar_and_a)[1]
+        return {'a': self.a_s, 'k': self.ks_h*h,
+                'delta_matter:delta_matter': pk/h**3}
+
+    # Nonlinear matter power spectrum models supported by get_cosmology
+    matter_pk_models = ['halofit', 'linear']
+
+    def get_cosmology(self, pars, matter_pk='halofit'):
+        """ Return the ccl.CosmologyCalculator for the CCL parameters
+        `pars`.
+
+        Args:
+            pars (dict): CCL cosmological parameters.
+            matter_pk (str): 'halofit' or 'linear'. Nonlinear matter power
+                spectrum model.
+        """
+        if matter_pk not in self.matter_pk_models:
+            raise ValueError("The emulated power spectrum can only be used "
+                             "with matter_pk 'halofit' or 'linear'")
+        pk_linear = self.get_pk_linear(pars)
+
+        kwargs = {'pk_linear': pk_linear}
+        if matter_pk == 'halofit':
+            kwargs['nonlinear_model'] = 'halofit'
+        else:
+            kwargs['pk_nonlin'] = pk_linear
+
+        return ccl.CosmologyCalculator(**pars, **kwargs)
+
+    def validate(self, pars_list, a_arr=None):
+        """ Compare the emulated linear matter power spectrum with CAMB.
+
+        Args:
+            pars_list (list): list of dictionaries with the CCL cosmological
+                parameters at which the emulator is validated.
+            a_arr (array_like): scale factors at which the power spectra are
+                compared. By default, the emulated ones.
+
+        Returns:
+            array: maximum relative difference for each validation point.
+        """
+        if a_arr is None:
+            a_arr = self.a_s
+
+        max_rel_diff = []
+        for pars in pars_list:
+            cosmo_emu = self.get_cosmology(pars, matter_pk='linear')
+            cosmo_camb = ccl.Cosmology(**pars,
+                                       transfer_function='boltzmann_camb',
+                                       matter_power_spectrum='linear')
+            k = self.ks_h * pars['h']
+            rel_diff = [ccl.linear_matter_power(cosmo_emu, k, a) /
+                        ccl.linear_matter_power(cosmo_camb, k, a) - 1
+                        for a in a_arr]
+            max_rel_diff.append(np.max(np.fabs(rel_diff)))
+
+        return np.array(max_rel_diff)
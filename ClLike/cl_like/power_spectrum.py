@@ -32,6 +32,10 @@ except ImportError as e:
     BACCO_exception = e
     HAVE_BACCO = False
 
+from .baryon_boost import BaryonBoostCalculator, BARYON_PARAMS
+from .halo_model import HaloModelCalculator, HOD_PARAMS
+from .timing import StageTimer
+
 
 class Pk(Theory):
     """Computes the power spectrum"""
@@ -52,58 +56,52 @@ class Pk(Theory):
     #for baccoemu
     nonlinear_emu_path = None
     nonlinear_emu_details = None
+    # Apply the baryonic boost here. The baryonic parameters of
+    # baryon_model (see baryon_boost.BARYON_PARAMS) are only accepted if
+    # this is True. Otherwise, they belong to the BaryonBoost theory.
     use_baryon_boost : bool = False
     baryon_model: str = ''
     ignore_lbias : bool = False
     allow_bcm_emu_extrapolation_for_shear : bool = True
     allow_halofit_extrapolation_for_shear : bool = False
     allow_halofit_extrapolation_for_shear_on_k: bool = False
+    # Halo model (bias_model: HaloModel). The mass definition is 500c, with
+    # the Duffy et al. 2008 concentration.
+    hm_mass_function: str = 'Tinker08'
+    hm_halo_bias: str = 'Tinker10'
+    # Multiply by the correction to the 1h - 2h transition regime
+    hm_correction: bool = True
+    # File where the correction table is stored ("" to always compute it)
+    hm_correction_file: str = ""
+    # Record per-stage timings and counters (see timing.py)
+    timing: bool = False
+    # Profile selected calculate calls (see profiling.py)
+    profile: dict = {}
 
     def initialize(self):
+        self.timer = StageTimer(self.get_name(),
+                                stages=['nonlin_power', 'pt_update',
+                                        'pt_get_pk', 'hm_update', 'baryons'],
+                                counters=['pk2d'],
+                                enabled=self.timing,
+                                profile=self.profile)
         # Bias model
         self.is_PT_bias = self.bias_model in ['LagrangianPT', 'EulerianPT', 'BaccoPT']
         # Pk sampling
         self.a_s_pks = 1./(1+np.linspace(0., self.zmax_pks, self.nz_pks)[::-1])
         self.nk_pks = int((self.l10k_max_pks - self.l10k_min_pks) *
                           self.nk_per_dex_pks)
-        # Initialize parameterless Halo model stuff
-        # if self.bias_model == 'HaloModel':
-        #     # Mass definition
-        #     if self.mass_def_str == 'fof':
-        #         self.massdef = ccl.halos.MassDef('fof', 'critical')
-        #     else:
-        #         rt = self.mass_def_str[-1]
-        #         if rt == 'c':
-        #             rhotyp = 'critical'
-        #         elif rt == 'm':
-        #             rhotyp = 'matter'
-        #         else:
-        #             raise ValueError(f"Unknown density type {rt}")
-        #         if self.mass_def_str[:-1] == 'Vir':
-        #             Delta = 'vir'
-        #         else:
-        #             Delta = float(self.mass_def_str[:-1])
-        #         self.massdef = ccl.halos.MassDef(Delta, rhotyp)
-        #     # Mass function
-        #     self.mfc = ccl.halos.mass_function_from_name(self.mf_name)
-        #     # Halo bias
-        #     self.hbc = ccl.halos.halo_bias_from_name(self.hb_name)
-        #     # Concentration
-        #     cmc = ccl.halos.concentration_from_name(self.cm_name)
-        #     self.cm = cmc(mdef=self.massdef)
-        #     # Default profiles for different quantities
-        #     self.profs = {'galaxy_density': None,
-        #                   'galaxy_shear': ccl.halos.HaloProfileNFW(self.cm),
-        #                   'cmb_convergence': ccl.halos.HaloProfileNFW(self.cm),
-        #                   'cmb_tSZ': ccl.halos.HaloProfilePressureGNFW()}
-        #     # Profile 2-point function for HOD
-        #     self.p2pt_HOD = ccl.halos.Profile2ptHOD()
-        #     # Halo model correction for the transition regime
-        #     if self.HM_correction == 'halofit':
-        #         from .hm_extra import HalomodCorrection
-        #         self.hmcorr = HalomodCorrection()
-        #     else:
-        #         self.hmcorr = None
+        # Cosmology-dependent halo model tables, computed when the
+        # cosmology changes
+        self.hm_calc = None
+        if self.bias_model == 'HaloModel':
+            self.hm_calc = HaloModelCalculator(
+                log10k_min=self.l10k_min_pks, log10k_max=self.l10k_max_pks,
+                nk_per_decade=self.nk_per_dex_pks, a_arr=self.a_s_pks,
+                mass_function=self.hm_mass_function,
+                halo_bias=self.hm_halo_bias,
+                hm_correction=self.hm_correction,
+                hm_correction_file=self.hm_correction_file or None)
         if self.bias_model == 'LagrangianPT' and not HAVE_LPT:
             raise LPT_exception
         elif self.bias_model == 'EulerianPT' and not HAVE_EPT:
@@ -118,9 +116,24 @@ class Pk(Theory):
         if self.bias_model == 'BaccoPT':
             if self.use_baryon_boost and self.baryon_model == '':
                     self.baryon_model = 'Bacco'
+        else:
+            if self.baryon_model == 'Bacco':
+                raise ValueError("baryon_model 'Bacco' can only be used with "
+                                 "bias_model 'BaccoPT' at the moment.")
 
-            use_baryon_boost = self.use_baryon_boost and \
-                               self.baryon_model == 'Bacco'
+        self.baryon_calc = BaryonBoostCalculator()
+        # Baryon model of the BaryonBoost theory class, if requested
+        self.baryon_stage = None
+        self.bacco_calc = None
+
+    def initialize_with_provider(self, provider):
+        self.provider = provider
+        if self.bias_model == 'BaccoPT':
+            # Built here so that we know if the baryonic boost is applied in
+            # the BaryonBoost theory class.
+            use_baryon_boost = (self.use_baryon_boost and
+                                self.baryon_model == 'Bacco') or \
+                               (self.baryon_stage == 'Bacco')
             self.bacco_calc = BaccoCalculator(a_arr=self.a_s_pks,
                                               nonlinear_emu_path=self.nonlinear_emu_path,
                                               nonlinear_emu_details=self.nonlinear_emu_details,
@@ -130,58 +143,94 @@ class Pk(Theory):
                                               allow_halofit_extrapolation_for_shear=self.allow_halofit_extrapolation_for_shear,
                                               allow_halofit_extrapolation_for_shear_on_k=self.allow_halofit_extrapolation_for_shear_on_k
                                              )
-        else:
-            if self.baryon_model == 'Bacco':
-                raise ValueError("baryon_model 'Bacco' can only be used with "
-                                 "bias_model 'BaccoPT' at the moment.")
 
     def must_provide(self, **requirements):
         if "Pk" not in requirements:
             return {}
 
+        options = requirements.get('Pk') or {}
+        if options.get('baryon_stage') is not None:
+            if self.use_baryon_boost:
+                raise ValueError("The baryonic boost cannot be applied both "
+                                 "in Pk (use_baryon_boost) and in "
+                                 "BaryonBoost.")
+            self.baryon_stage = options['baryon_stage']
+
         return {"CCL": None}
 
     def get_can_support_params(self):
-        # TODO: We should better use an input_params_prefix to avoid confusion
-        # with CCL params and maybe split the baryons stuff
-        return ["M_c", "eta", "beta", "M1_z0_cen", "theta_out", "theta_inn",
-                "M_inn", "A_AE"]
+        # The baryonic parameters are only used here if the baryonic boost
+        # is applied in this class. Otherwise, they belong to BaryonBoost.
+        params = []
+        if self.bias_model == 'HaloModel':
+            params += HOD_PARAMS
+        if self.use_baryon_boost:
+            params += BARYON_PARAMS.get(self.baryon_model, [])
+        return params
+
+    def get_can_provide_params(self):
+        return self.timer.get_param_names()
 
     def calculate(self, state, want_derived=True, **params_values_dict):
-        cosmo = self.provider.get_CCL()["cosmo"]
-        bcmpar = None
-        if self.use_baryon_boost:
-            if self.baryon_model == 'Bacco':
-                M_c = self.provider.get_param('M_c')
-                eta = self.provider.get_param('eta')
-                beta = self.provider.get_param('beta')
-                M1_z0_cen = self.provider.get_param('M1_z0_cen')
-                theta_out = self.provider.get_param('theta_out')
-                theta_inn = self.provider.get_param('theta_inn')
-                M_inn = self.provider.get_param('M_inn')
-                bcmpar = {
-                    'M_c'  : M_c,
-                    'eta' : eta,
-                    'beta' : beta,
-                    'M1_z0_cen' : M1_z0_cen,
-                    'theta_out' : theta_out,
-                    'theta_inn' : theta_inn,
-                    'M_inn' : M_inn
-                }
-            elif self.baryon_model == 'Amon-Efstathiou':
-                bcmpar = {'A_AE': self.provider.get_param('A_AE')}
+        self.timer.start_step()
+        try:
+            cosmo = self.provider.get_CCL()["cosmo"]
+            bcmpar = None
+            if self.use_baryon_boost:
+                if self.baryon_model == 'Bacco':
+                    M_c = self.provider.get_param('M_c')
+                    eta = self.provider.get_param('eta')
+                    beta = self.provider.get_param('beta')
+                    M1_z0_cen = self.provider.get_param('M1_z0_cen')
+                    theta_out = self.provider.get_param('theta_out')
+                    theta_inn = self.provider.get_param('theta_inn')
+                    M_inn = self.provider.get_param('M_inn')
+                    bcmpar = {
+                        'M_c'  : M_c,
+                        'eta' : eta,
+                        'beta' : beta,
+                        'M1_z0_cen' : M1_z0_cen,
+                        'theta_out' : theta_out,
+                        'theta_inn' : theta_inn,
+                        'M_inn' : M_inn
+                    }
+                elif self.baryon_model == 'Amon-Efstathiou':
+                    bcmpar = {'A_AE': self.provider.get_param('A_AE')}
+
+            hodpar = None
+            if self.bias_model == 'HaloModel':
+                hodpar = {p: self.provider.get_param(p) for p in HOD_PARAMS}
 
-        state['Pk'] = {'pk_data': self._get_pk_data(cosmo, bcmpar=bcmpar)}
+            pkd = self._get_pk_data(cosmo, bcmpar=bcmpar, hodpar=hodpar)
+            if pkd is None:
+                self.log.debug("The HOD gives no galaxies. Assigning 0 "
+                               "likelihood and going on.")
+                return False
+            state['Pk'] = {'pk_data': pkd}
+            if self.baryon_stage == 'Bacco':
+                # Needed by BaryonBoost to reuse the emulator outputs
+                state['Pk']['bacco_calc'] = self.bacco_calc
+        finally:
+            self.timer.end_step()
+        if want_derived:
+            state['derived'].update(self.timer.get_derived(self.output_params))
+
+    def close(self):
+        self.timer.close(self.log)
 
     def get_Pk(self):
         return self._current_state['Pk']
 
-    def _get_pk_data(self, cosmo, bcmpar=None):
+    def _get_pk_data(self, cosmo, bcmpar=None, hodpar=None):
+        # Returns None if the point has to be rejected (i.e. an HOD without
+        # galaxies)
         # cosmo.compute_nonlin_power()
         # pkmm = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
         pkmm = None
+        ptc = None
         if self.bias_model == 'Linear':
-            cosmo.compute_nonlin_power()
+            with self.timer.stage('nonlin_power'):
+                cosmo.compute_nonlin_power()
             pkmm = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
             if 'delta_matter:Weyl' in cosmo._pk_nl:
                 pkwm = pkmw = cosmo.get_nonlin_power(name='delta_matter:Weyl')
@@ -199,6 +248,25 @@ class Pk(Theory):
             pkd['pk_d1w'] = pkd['pk_wd1'] = pkwm
             pkd['pk_mw'] = pkd['pk_wm'] = pkwm
             pkd['pk_ww'] = pkww
+        elif self.bias_model == 'HaloModel':
+            if ('delta_matter:Weyl' in cosmo._pk_nl) or \
+                    ('Weyl:Weyl' in cosmo._pk_nl):
+                raise RuntimeError('Pk involving the Weyl potential not '
+                                   'implemented for HaloModel')
+            with self.timer.stage('nonlin_power'):
+                cosmo.compute_nonlin_power()
+            pkmm = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
+            # Only the HOD integrals are redone if the cosmology is the same
+            with self.timer.stage('hm_update'):
+                has_galaxies = self.hm_calc.update_pk(cosmo, hodpar)
+            if not has_galaxies:
+                return None
+            pkgm = self.hm_calc.get_pk('md1')
+            pkd = {}
+            pkd['pk_mm'] = pkd['pk_mw'] = pkd['pk_wm'] = pkd['pk_ww'] = pkmm
+            pkd['pk_md1'] = pkd['pk_d1m'] = pkgm
+            pkd['pk_d1w'] = pkd['pk_wd1'] = pkgm
+            pkd['pk_d1d1'] = self.hm_calc.get_pk('d1d1')
         elif self.is_PT_bias:
             if ('delta_matter:Weyl' in cosmo._pk_nl) or \
                     ('Weyl:Weyl' in cosmo._pk_nl):
@@ -210,7 +278,8 @@ class Pk(Theory):
                 k_filter = None
             if self.bias_model == 'EulerianPT':
                 from .ept import EPTCalculator
-                cosmo.compute_nonlin_power()
+                with self.timer.stage('nonlin_power'):
+                    cosmo.compute_nonlin_power()
                 pkmm = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
                 ptc = EPTCalculator(with_NC=True, with_IA=False,
                                     log10k_min=self.l10k_min_pks,
@@ -220,7 +289,8 @@ class Pk(Theory):
                                     k_filter=k_filter)
             elif self.bias_model == 'LagrangianPT':
                 from .lpt import LPTCalculator
-                cosmo.compute_nonlin_power()
+                with self.timer.stage('nonlin_power'):
+                    cosmo.compute_nonlin_power()
                 pkmm = cosmo.get_nonlin_power(name='delta_matter:delta_matter')
                 ptc = LPTCalculator(log10k_min=self.l10k_min_pks,
                                     log10k_max=self.l10k_max_pks,
@@ -231,7 +301,8 @@ class Pk(Theory):
                 ptc = self.bacco_calc
             else:
                 raise NotImplementedError("Not yet: " + self.bias_model)
-            ptc.update_pk(cosmo, bcmpar=bcmpar)
+            with self.timer.stage('pt_update'):
+                ptc.update_pk(cosmo, bcmpar=bcmpar)
             pkd = {}
             operators = ['m', 'w', 'd1', 'd2', 's2', 'k2']
             for i1, op1 in enumerate(operators):
@@ -241,8 +312,9 @@ class Pk(Theory):
                     # have already checked if Weyl is in cosmo._pk_nl, let's
                     # fill pkd weyl pk's with matter ones.
                     kind = comb_12.replace('w', 'm')
-                    pkd[f'pk_{comb_12}'] = ptc.get_pk(kind, pnl=pkmm,
-                                                      cosmo=cosmo)
+                    with self.timer.stage('pt_get_pk'):
+                        pkd[f'pk_{comb_12}'] = ptc.get_pk(kind, pnl=pkmm,
+                                                          cosmo=cosmo)
                     # Symmetric terms for convenience
                     if op1 != op2:
                         comb_21 = op2+op1
@@ -254,52 +326,45 @@ class Pk(Theory):
                 pkd['pk_ww'] = ptc.get_pk('mm_sh_sh', pnl=pkmm, cosmo=cosmo)
 
         # Add baryon correction
+        if self.baryon_stage is not None:
+            # Applied in BaryonBoost
+            self._count_pk2d(pkd)
+            return pkd
+
         baryons_in_cosmo = cosmo._config_init_kwargs['baryons_power_spectrum']
         if self.use_baryon_boost or (baryons_in_cosmo != 'nobaryons'):
-            if self.is_PT_bias and (self.bias_model == 'BaccoPT') and \
-                (self.baryon_model == 'Bacco'):
-                # TODO: This assumes LCDM, but as above. BACCOemu is
-                # trained only in LCDM, anyway. What to do with the cross
-                # pk's? At the moment they don't have the correction.
-                pkd['pk_ww'] = ptc.get_pk('mm_sh_sh', pnl=pkmm, cosmo=cosmo)
-                pkd['Sk'] = ptc.get_pk('Sk')
-            elif (self.baryon_model == 'CCL_BCM') or \
-                (baryons_in_cosmo == 'bcm'):
-                if self.is_PT_bias:
-                    # The correction happens in place
-                    # If bias is Linear, then the pk already has the baryon
-                    # boost applied.
-                    ccl.bcm.bcm_correct_pk2d(cosmo, pkd['pk_ww'])
-                a_arr, lnk, pkww = pkd['pk_ww'].get_spline_arrays()
-                k = np.exp(lnk)
-                Sk = np.zeros_like(pkww)
-                for i, ai in enumerate(a_arr):
-                    Sk[i] = ccl.bcm.bcm_model_fka(cosmo, k, ai)
-                pkd['Sk'] = ccl.Pk2D(a_arr=a_arr, lk_arr=lnk,
-                                     pk_arr=np.log(Sk), is_logp=True)
-            elif self.baryon_model == 'Amon-Efstathiou':
-                pklin = cosmo.get_linear_power()
-                a, lnk, pklin = pklin.get_spline_arrays()
-                k = np.exp(lnk)
-                boost = np.zeros_like(pklin)
-                pknonlin = np.zeros_like(pklin)
-                for i, ai in enumerate(a):
-                    pknonlin[i] = pkd['pk_ww'].eval(k, ai, cosmo)
-                    boost[i] = pknonlin[i] - pklin[i]
-
-                pkb = pklin + bcmpar['A_AE']*boost
-                pkd['pk_ww'] = ccl.Pk2D(a_arr=a, lk_arr=lnk,
-                                        pk_arr=np.log(pkb),
-                                        is_logp=True)
-                Sk = pkb / pknonlin
-                pkd['Sk'] = ccl.Pk2D(a_arr=a, lk_arr=lnk, pk_arr=np.log(Sk),
-                                     is_logp=True)
-            else:
-                # TODO: Bacco returns a pk2d of 1's, maybe homogenize this
-                pkd['Sk'] = None
+            with self.timer.stage('baryons'):
+                self._add_baryons(pkd, cosmo, ptc, pkmm, bcmpar,
+                                  baryons_in_cosmo)
 
+        self._count_pk2d(pkd)
         return pkd
 
+    def _add_baryons(self, pkd, cosmo, ptc, pkmm, bcmpar, baryons_in_cosmo):
+        if self.is_PT_bias and (self.bias_model == 'BaccoPT') and \
+            (self.baryon_model == 'Bacco'):
+            # TODO: This assumes LCDM, but as above. BACCOemu is
+            # trained only in LCDM, anyway. What to do with the cross
+            # pk's? At the moment they don't have the correction.
+            pkd['pk_ww'] = ptc.get_pk('mm_sh_sh', pnl=pkmm, cosmo=cosmo)
+            pkd['Sk'] = ptc.get_pk('Sk')
+        elif (self.baryon_model == 'CCL_BCM') or \
+            (baryons_in_cosmo == 'bcm'):
+            pkd.update(self.baryon_calc.get_bcm_pk_data(cosmo, pkd,
+                                                        self.is_PT_bias))
+        elif self.baryon_model == 'Amon-Efstathiou':
+            pkd.update(self.baryon_calc.get_ae_pk_data(cosmo, pkd,
+                                                       bcmpar['A_AE']))
+        else:
+            # TODO: Bacco returns a pk2d of 1's, maybe homogenize this
+            pkd['Sk'] = None
+
+    def _count_pk2d(self, pkd):
+        # Number of different Pk2D objects passed downstream
+        if self.timer.enabled:
+            self.timer.count('pk2d', len({id(pk) for pk in pkd.values()
+                                          if pk is not None}))
+
     def get_can_provide(self):
         return ["is_PT_bias", "bias_model"]
 
@@ -0,0 +1,135 @@
+"""
+Profiling of selected `calculate` calls of the cl_like classes, set through
+their `profile` option, e.g.:
+
+    profile:
+      every: 100          # profile every 100th call...
+      steps: [10, 12]     # ...and/or calls 10 to 12 (counting from 1)
+      format: collapsed   # 'pstats' (cProfile, default) or 'collapsed'
+      output: profiles    # output directory
+
+One file is written per profiled call and MPI process, named
+`<component>_rank<rank>_step<call>.<prof|collapsed>`. The 'pstats' files can
+be read with pstats or snakeviz, and the 'collapsed' ones (one line per call
+stack with its time in microseconds) with flamegraph.pl or speedscope.
+
+The calls that are not profiled only cost a counter increment.
+"""
+from collections import defaultdict
+import cProfile
+import os
+import sys
+import time
+
+
+class _StackProfiler(object):
+    """ Deterministic profiler recording the time spent in each call stack,
+    in the collapsed format used by flame graph tools.
+    """
+    def __init__(self):
+        self.stack = []
+        self.times = defaultdict(float)
+
+    def _label(self, frame, event, arg):
+        if event.startswith('c_'):
+            module = getattr(arg, '__module__', None) or 'builtins'
+            name = getattr(arg, '__qualname__', repr(arg))
+            return f'{module}.{name}'
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+    def _callback(self, frame, event, arg):
+        t = time.perf_counter()
+        if event in ('call', 'c_call'):
+            self.stack.append([self._label(frame, event, arg), t, 0.])
+        elif self.stack:
+            # Returns from the frames entered before enable are ignored
+            label, t0, t_children = self.stack.pop()
+            dt = t - t0
+            key = ';'.join([s[0] for s in self.stack] + [label])
+            self.times[key] += dt - t_children
+            if self.stack:
+                self.stack[-1][2] += dt
+
+    def enable(self):
+        sys.setprofile(self._callback)
+
+    def disable(self):
+        sys.setprofile(None)
+
+    def dump_stats(self, fname):
+        with open(fname, 'w') as f:
+            for key, t in sorted(self.times.items()):
+                us = int(round(t * 1E6))
+                if us > 0:
+                    f.write(f'{key} {us}\n')
+
+
+class StepProfiler(object):
+    """ Profiles the calls of a component selected by `every` and/or
+    `steps` (see module docstring).
+    """
+    _options = ['every', 'steps', 'format', 'output']
+
+    def __init__(self, name, every=0, steps=None, format='pstats',
+                 output='profiles'):
+        if format not in ['pstats', 'collapsed']:
+            raise ValueError("profile format must be 'pstats' or "
+                             "'collapsed'")
+        if (steps is not None) and (len(steps) != 2):
+            raise ValueError("profile steps must be [first, last]")
+        self.name = name
+        self.every = every
+        self.steps = steps
+        self.format = format
+        self.output = output
+        self.ncalls = 0
+        self._profiler = None
+
+        from cobaya.mpi import get_mpi_rank
+        self.rank = get_mpi_rank() or 0
+
+    def _is_profiled(self, n):
+        if self.every and (n % self.every == 0):
+            return True
+        if self.steps is not None:
+            return self.steps[0] <= n <= self.steps[1]
+        return False
+
+    def start_step(self):
+        # A call that did not finish (e.g. rejected point) is still saved
+        self.end_step()
+        self.ncalls += 1
+        if not self._is_profiled(self.ncalls):
+            return
+        if self.format == 'pstats':
+            self._profiler = cProfile.Profile()
+        else:
+            self._profiler = _StackProfiler()
+        self._profiler.enable()
+
+    def end_step(self):
+        if self._profiler is None:
+            return
+        profiler = self._profiler
+        self._profiler = None
+        profiler.disable()
+
+        os.makedirs(self.output, exist_ok=True)
+        ext = 'prof' if self.format == 'pstats' else 'collapsed'
+        fname = os.path.join(self.output, f'{self.name}_rank{self.rank}_'
+                             f'step{self.ncalls}.{ext}')
+        profiler.dump_stats(fname)
+
+
+def get_profiler(name, options):
+    """ Return the StepProfiler for the `profile` option of a component,
+    or None if it is empty.
+    """
+    if not options:
+        return None
+    unknown = set(options) - set(StepProfiler._options)
+    if unknown:
+        raise ValueError(f"Unknown profile options {sorted(unknown)}. "
+                         f"Allowed: {StepProfiler._options}")
+    return StepProfiler(name, **options)
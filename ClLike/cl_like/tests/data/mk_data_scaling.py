@@ -0,0 +1,281 @@
+"""
+Synthetic sacc files to stress-test ClLike at survey scale. Same model as
+mk_data_Linear.py (halofit, linear galaxy bias, multiplicative shear bias,
+Gaussian covariance), but with a configurable number of galaxy clustering,
+shear and CMB lensing tracers, ell range, bandpower width and covariance
+structure. `get_info` returns the Cobaya input that fits the generated data
+(chi2 ~ 0) with the Linear bias model.
+
+Usage:
+    python mk_data_scaling.py scaling.fits --n-gc 10 --n-sh 10 --n-kp 1 \
+        --lmax 3000 --dell 30 --ell-corr 0.2
+"""
+import pyccl as ccl
+import numpy as np
+import sacc
+from scipy.interpolate import interp1d
+import argparse
+
+
+cosmopars = {'Omega_c': 0.26,
+             'Omega_b': 0.05,
+             'h': 0.67,
+             'n_s': 0.96,
+             'A_sE9': 2.1265,
+             'm_nu': 0.15,
+             'T_CMB': 2.7255}
+
+
+def get_tracer_names(n_gc, n_sh, n_kp):
+    return [f'gc{i}' for i in range(n_gc)] + \
+        [f'sh{i}' for i in range(n_sh)] + \
+        [f'kp{i}' for i in range(n_kp)]
+
+
+def get_pairs(names, gc_cross=False):
+    """ Pairs of tracers in the data vector. As in mk_data_Linear.py, the
+    cross-correlations between different clustering bins are not included
+    unless gc_cross is True.
+    """
+    pairs = []
+    for i1, n1 in enumerate(names):
+        for n2 in names[i1:]:
+            if (n1 != n2) and n1.startswith('gc') and n2.startswith('gc') \
+                    and not gc_cross:
+                continue
+            pairs.append((n1, n2))
+    return pairs
+
+
+def get_bias(name):
+    """ Fiducial galaxy bias and multiplicative shear bias of each bin. """
+    i = int(name[2:])
+    if name.startswith('gc'):
+        return 1.2 + 0.1*i
+    elif name.startswith('sh'):
+        return 0.01*(i % 5)
+    return None
+
+
+def get_nz(name, n_gc, n_sh, zs):
+    """ Gaussian redshift distributions with means evenly spaced in
+    [0.2, 1.2] and width 0.05(1+z).
+    """
+    i = int(name[2:])
+    n = n_gc if name.startswith('gc') else n_sh
+    zm = 0.2 + i / max(n - 1, 1)
+    return np.exp(-0.5*((zs-zm)/(0.05*(1+zm)))**2)
+
+
+def make_sacc(fname, n_gc=2, n_sh=3, n_kp=1, lmax=2000, dell=10, fsky=0.4,
+              ell_corr=0., gc_cross=False):
+    """ Generate the synthetic data and save them in fname.
+
+    Args:
+        fname (str): output sacc (FITS) file.
+        n_gc, n_sh, n_kp (int): number of galaxy clustering, shear and CMB
+            lensing tracers.
+        lmax (int): maximum multipole of the bandpower windows.
+        dell (int): width of the top-hat bandpower windows.
+        fsky (float): sky fraction for the Gaussian covariance.
+        ell_corr (float): correlation coefficient between consecutive
+            bandpowers of the same power spectrum (the correlation decays
+            as ell_corr^|i-j|). 0 for the Gaussian (diagonal in ell)
+            covariance.
+        gc_cross (bool): include the clustering cross-correlations.
+
+    Returns:
+        int: number of data points.
+    """
+    cosmo = ccl.Cosmology(Omega_c=cosmopars['Omega_c'],
+                          Omega_b=cosmopars['Omega_b'],
+                          h=cosmopars['h'], n_s=cosmopars['n_s'],
+                          A_s=cosmopars['A_sE9']*1E-9,
+                          m_nu=cosmopars['m_nu'], T_CMB=cosmopars['T_CMB'],
+                          transfer_function='boltzmann_camb',
+                          matter_power_spectrum='halofit')
+
+    zs = np.linspace(0., 3., 1024)
+    names = get_tracer_names(n_gc, n_sh, n_kp)
+    tracers = {}
+    for n in names:
+        if n.startswith('gc'):
+            tracers[n] = ccl.NumberCountsTracer(
+                cosmo, dndz=(zs, get_nz(n, n_gc, n_sh, zs)), has_rsd=False,
+                bias=(zs, np.ones_like(zs)))
+        elif n.startswith('sh'):
+            tracers[n] = ccl.WeakLensingTracer(
+                cosmo, dndz=(zs, get_nz(n, n_gc, n_sh, zs)))
+        else:
+            tracers[n] = ccl.CMBLensingTracer(cosmo, z_source=1100.)
+
+    # Scale sampling, as in mk_data_Linear.py
+    nl = int(30 * np.log10(lmax + 2))
+    ls = np.unique(np.geomspace(2, lmax+2, nl).astype(int)).astype(float)
+    l_all = np.arange(lmax+2)
+    nbpw = lmax // dell
+    bpws = np.zeros([nbpw, l_all.size])
+    for i in range(nbpw):
+        l0 = 2 + i*dell
+        bpws[i, l0:l0+dell] = 1./dell
+    lbpw = np.dot(bpws, l_all)
+
+    def interp_bin(cl):
+        # Interpolating in log space as in the code
+        clf = interp1d(np.log(ls), cl, bounds_error=False,
+                       fill_value='extrapolate')
+        return np.dot(bpws, clf(np.log(np.maximum(l_all, 1))))
+
+    # Signal for all pairs (needed for the covariance)
+    def factor(n):
+        b = get_bias(n)
+        if n.startswith('gc'):
+            return b
+        elif n.startswith('sh'):
+            return 1 + b
+        return 1.
+
+    ntr = len(names)
+    sls = np.zeros([ntr, ntr, nbpw])
+    for i1, n1 in enumerate(names):
+        for i2 in range(i1, ntr):
+            n2 = names[i2]
+            cl = interp_bin(ccl.angular_cl(cosmo, tracers[n1], tracers[n2],
+                                           ls))
+            sls[i1, i2] = sls[i2, i1] = cl * factor(n1) * factor(n2)
+
+    # Noise: 4 gal per arcmin^2 per bin
+    nls = np.zeros([ntr, ntr, nbpw])
+    for i, n in enumerate(names):
+        if n.startswith('gc'):
+            nls[i, i] = 1/(4*(180*60/np.pi)**2)
+        elif n.startswith('sh'):
+            nls[i, i] = 0.28**2/(4*(180*60/np.pi)**2)
+        else:
+            nls[i, i] = 4e-8
+    cls = sls + nls
+
+    # Gaussian covariance
+    pairs = get_pairs(names, gc_cross)
+    ind = {n: i for i, n in enumerate(names)}
+    ip = np.array([[ind[n1], ind[n2]] for n1, n2 in pairs])
+    nx = len(pairs)
+    nmodes = (2*lbpw+1)*dell*fsky
+    c_ac = cls[ip[:, 0][:, None], ip[:, 0][None, :]]
+    c_bd = cls[ip[:, 1][:, None], ip[:, 1][None, :]]
+    c_ad = cls[ip[:, 0][:, None], ip[:, 1][None, :]]
+    c_bc = cls[ip[:, 1][:, None], ip[:, 0][None, :]]
+    diag = (c_ac*c_bd + c_ad*c_bc)/nmodes  # (nx, nx, nbpw)
+    cov = np.zeros([nx, nbpw, nx, nbpw])
+    ib = np.arange(nbpw)
+    cov[:, ib, :, ib] = np.transpose(diag, axes=(2, 0, 1))
+    cov = cov.reshape([nx*nbpw, nx*nbpw])
+    if ell_corr != 0:
+        # Correlate consecutive bandpowers. C -> M C M^T keeps C positive
+        # definite. For each power spectrum, M = S L S^-1, with S the
+        # standard deviations and L the Cholesky factor of the correlation,
+        # turns its (diagonal) block S^2 into S corr S.
+        corr = ell_corr**np.abs(ib[:, None] - ib[None, :])
+        chol = np.linalg.cholesky(corr)
+        sigma = np.sqrt(np.diag(cov)).reshape([nx, nbpw])
+        mix = np.zeros_like(cov)
+        for i in range(nx):
+            sl = slice(i*nbpw, (i+1)*nbpw)
+            mix[sl, sl] = sigma[i][:, None] * chol / sigma[i][None, :]
+        cov = mix @ cov @ mix.T
+
+    s = sacc.Sacc()
+    for n in names:
+        if n.startswith('gc'):
+            s.add_tracer('NZ', n, quantity='galaxy_density', spin=0, z=zs,
+                         nz=get_nz(n, n_gc, n_sh, zs))
+        elif n.startswith('sh'):
+            s.add_tracer('NZ', n, quantity='galaxy_shear', spin=2, z=zs,
+                         nz=get_nz(n, n_gc, n_sh, zs))
+        else:
+            s.add_tracer('Map', n, quantity='cmb_convergence', spin=0,
+                         ell=l_all, beam=np.ones_like(l_all))
+    wins = sacc.BandpowerWindow(l_all, bpws.T)
+    for n1, n2 in pairs:
+        p1 = 'e' if n1.startswith('sh') else '0'
+        p2 = 'e' if n2.startswith('sh') else '0'
+        typ = f'cl_{p1}{p2}'
+        if typ == 'cl_e0':
+            typ = 'cl_0e'
+        s.add_ell_cl(typ, n1, n2, lbpw, sls[ind[n1], ind[n2]], window=wins)
+    s.add_covariance(cov)
+    s.save_fits(fname, overwrite=True)
+
+    return nx*nbpw
+
+
+def get_info(fname, n_gc=2, n_sh=3, n_kp=1, lmax=2000, gc_cross=False):
+    """ Cobaya input for the data generated by make_sacc with the same
+    arguments.
+    """
+    import cl_like as cll
+    from cl_like.limber import Limber
+    from cl_like.power_spectrum import Pk
+    from cl_like.cl_final import ClFinal
+
+    names = get_tracer_names(n_gc, n_sh, n_kp)
+    params = cosmopars.copy()
+    for n in names:
+        if n.startswith('gc'):
+            params[f'bias_{n}_b1'] = get_bias(n)
+            params[f'limber_{n}_dz'] = 0.
+        elif n.startswith('sh'):
+            params[f'bias_{n}_m'] = get_bias(n)
+            params[f'limber_{n}_dz'] = 0.
+
+    info = {"params": params,
+            "theory": {"ccl": {"external": cll.CCL,
+                               "transfer_function": "boltzmann_camb",
+                               "matter_pk": "halofit"},
+                       "limber": {"external": Limber,
+                                  "nz_model": "NzShift",
+                                  "input_params_prefix": "limber"},
+                       "Pk": {"external": Pk,
+                              "bias_model": "Linear"},
+                       "clfinal": {"external": ClFinal,
+                                   "input_params_prefix": "bias",
+                                   "shape_model": "ShapeMultiplicative"}
+                       },
+            "likelihood": {"ClLike": {"external": cll.ClLike,
+                                      "input_file": fname,
+                                      "bins": [{"name": n} for n in names],
+                                      "twopoints": [
+                                          {"bins": list(p)}
+                                          for p in get_pairs(names,
+                                                             gc_cross)],
+                                      "defaults": {"lmin": 0,
+                                                   "lmax": lmax+2,
+                                                   "kmax": 100.}
+                                      }
+                           },
+            "debug": False}
+    return info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic '
+                                     'sacc files for scaling tests')
+    parser.add_argument('fname', type=str, help='Output file')
+    parser.add_argument('--n-gc', type=int, default=2)
+    parser.add_argument('--n-sh', type=int, default=3)
+    parser.add_argument('--n-kp', type=int, default=1)
+    parser.add_argument('--lmax', type=int, default=2000)
+    parser.add_argument('--dell', type=int, default=10,
+                        help='Bandpower width')
+    parser.add_argument('--fsky', type=float, default=0.4)
+    parser.add_argument('--ell-corr', type=float, default=0.,
+                        help='Correlation between consecutive bandpowers')
+    parser.add_argument('--gc-cross', action='store_true',
+                        help='Include clustering cross-correlations')
+    args = parser.parse_args()
+
+    ndata = make_sacc(args.fname, n_gc=args.n_gc, n_sh=args.n_sh,
+                      n_kp=args.n_kp, lmax=args.lmax, dell=args.dell,
+                      fsky=args.fsky, ell_corr=args.ell_corr,
+                      gc_cross=args.gc_cross)
+    print(f"{args.fname}: {ndata} data points")
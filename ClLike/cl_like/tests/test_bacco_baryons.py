@@ -3,6 +3,7 @@ from cl_like.limber import Limber
 from cl_like.power_spectrum import Pk
 from cl_like.cl_final import ClFinal
 from cl_like.bacco import BaccoCalculator
+from cl_like.baryon_boost import BaryonBoost
 import numpy as np
 from cobaya.model import get_model
 import pytest
@@ -10,6 +11,7 @@ import os
 import shutil
 import sacc
 import pyccl as ccl
+from scipy import optimize
 
 
 # Cleaning the tmp dir before running and after running the tests
@@ -200,6 +202,91 @@ def test_baryons_Sk(ptc):
         assert ptc.get_pk('Sk').eval(k, ai) == pytest.approx(Sk2[i], rel=1e-3)
 
 
+def test_emulator_cache(ptc):
+    info = get_info()
+    pars = info['params']
+
+    cosmo = ccl.Cosmology(Omega_c=pars['Omega_c'],
+                          Omega_b=pars['Omega_b'],
+                          h=pars['h'],
+                          n_s=pars['n_s'],
+                          A_s=pars['A_sE9']*1e-9,
+                          m_nu=pars['m_nu'])
+
+    bcmpar = {
+               "M_c" :  14,
+               "eta" : -0.3,
+               "beta" : -0.22,
+               "M1_z0_cen" : 10.5,
+               "theta_out" : 0.25,
+               "theta_inn" : -0.86,
+               "M_inn" : 13.4,
+    }
+    bcmpar2 = bcmpar.copy()
+    bcmpar2['M_c'] = 13
+
+    ptc.update_pk(cosmo, bcmpar=bcmpar2)
+    Sk2 = ptc.Sk_temp.copy()
+    pk = ptc._emu_ctx['pk_sh_sh']['baryon']
+
+    # Only the baryonic boost changes
+    ptc.update_pk(cosmo, bcmpar=bcmpar)
+    assert ptc._emu_ctx['pk_sh_sh']['baryon'] is pk
+    assert not np.all(ptc.Sk_temp == Sk2)
+    assert ptc.pk_temp_sh_sh == pytest.approx(pk * ptc.Sk_temp, rel=1e-10)
+
+    # Same result as without cache
+    Sk = ptc.get_baryonic_boost(cosmo, bcmpar,
+                                ptc.ks_sh_sh[ptc.mask_ks_sh_sh_for_bacco] /
+                                pars['h'])
+    assert ptc.Sk_temp == pytest.approx(Sk, rel=1e-10)
+
+    ptc.update_pk(cosmo, bcmpar=bcmpar2)
+    assert ptc.Sk_temp == pytest.approx(Sk2, rel=1e-10)
+
+
+def test_baryon_boost_stage():
+    info = get_info()
+    model = get_model(info)
+    loglikes, derived = model.loglikes()
+
+    # Same model, with the baryonic boost applied in BaryonBoost
+    info = get_info()
+    del info['theory']['Pk']['use_baryon_boost']
+    info['theory']['baryons'] = {'external': BaryonBoost,
+                                 'baryon_model': 'Bacco'}
+    info['theory']['limber']['baryon_boost'] = True
+    info['params']['M_c'] = {'prior': {'min': 9, 'max': 15}}
+    model = get_model(info)
+
+    # Count the calls to the matter power spectrum emulator
+    ptc = model.theory['Pk'].bacco_calc
+    get_nonlinear_pk = ptc.mpk.get_nonlinear_pk
+    ncalls = []
+
+    def counted_get_nonlinear_pk(*args, **kwargs):
+        ncalls.append(1)
+        return get_nonlinear_pk(*args, **kwargs)
+
+    ptc.mpk.get_nonlinear_pk = counted_get_nonlinear_pk
+
+    loglikes_stage, derived = model.loglikes({'M_c': 14})
+    assert loglikes_stage[0] == pytest.approx(loglikes[0], rel=1e-6)
+    assert len(ncalls) == 1
+
+    # Changing the baryonic parameters does not call it again and does not
+    # modify the Pk outputs
+    pk_ww = model.theory['Pk'].get_Pk()['pk_data']['pk_ww']
+    loglikes_stage2, derived = model.loglikes({'M_c': 13})
+    assert loglikes_stage2[0] != loglikes_stage[0]
+    assert len(ncalls) == 1
+    assert model.theory['Pk'].get_Pk()['pk_data']['pk_ww'] is pk_ww
+
+    # The baryonic parameters are not seen by Pk
+    assert 'M_c' not in model.theory['Pk'].input_params
+    assert 'M_c' in model.theory['baryons'].input_params
+
+
 def test_get_pars_and_a_for_bacco(ptc):
     bcmpar = {
                "M_c" :  14,
@@ -220,6 +307,83 @@ def test_get_pars_and_a_for_bacco(ptc):
     for pn, pv in bcmpar.items():
         assert np.all(combined_pars[pn] == np.array([pv] * len(a_arr)))
 
+def test_project_to_baryon_fraction(ptc, monkeypatch):
+    emulator = ptc.mpk.emulator['baryon']
+    assert emulator['keys'][0] == 'omega_cold'
+    assert emulator['keys'][2] == 'omega_baryon'
+    Oc_bounds = emulator['bounds'][0]
+    Ob_bounds = emulator['bounds'][2]
+
+    # Points already clipped to the box and target baryon fractions inside and
+    # outside the range reachable within it
+    Oc0 = [Oc_bounds[0], np.mean(Oc_bounds), Oc_bounds[1]]
+    Ob0 = [Ob_bounds[1], np.mean(Ob_bounds), Ob_bounds[0]]
+    f_min = Ob_bounds[0] / Oc_bounds[1]
+    f_max = Ob_bounds[1] / Oc_bounds[0]
+    fracs = [0.5*f_min, f_min, np.mean([f_min, f_max]), f_max, 2*f_max]
+    for Oc, Ob in zip(Oc0, Ob0):
+        for f in fracs:
+            Oc_p, Ob_p = ptc._project_to_baryon_fraction(Oc, Ob, f, Oc_bounds,
+                                                         Ob_bounds)
+            assert Oc_bounds[0] <= Oc_p <= Oc_bounds[1]
+            assert Ob_bounds[0] <= Ob_p <= Ob_bounds[1]
+            f_p = np.clip(f, f_min, f_max)
+            assert Ob_p / Oc_p == pytest.approx(f_p, rel=1e-10)
+
+            # Same baryon fraction as the numerical minimization
+            res = optimize.minimize(lambda o: np.abs(o[1] / o[0] - f),
+                                    np.array([Oc, Ob]),
+                                    bounds=(Oc_bounds, Ob_bounds))
+            assert Ob_p / Oc_p == pytest.approx(res.x[1] / res.x[0],
+                                                rel=1e-4)
+
+    # The projection is analytic: no numerical minimization is run when
+    # bringing a point back to the emulator box
+    def minimize(*args, **kwargs):
+        raise AssertionError("scipy.optimize.minimize was called")
+
+    monkeypatch.setattr(optimize, 'minimize', minimize)
+    cospar = {'omega_cold': 0.31,
+              'omega_baryon': 1.2 * Ob_bounds[1],
+              'ns': 0.96,
+              'hubble': 0.67,
+              'neutrino_mass': 0.15,
+              'w0': -1,
+              'wa': 0,
+              'sigma8_cold': 0.78}
+    within_bounds = ptc._check_within_bounds(cospar)
+    assert not within_bounds['baryon']
+    cospar_out, a_s = ptc._check_baccoemu_baryon_pars_for_extrapolation(
+        cospar, within_bounds=within_bounds)
+    assert ptc._check_within_bounds(cospar_out)['baryon']
+
+
+def test_baryon_pars_extrapolation(ptc):
+    emulator = ptc.mpk.emulator['baryon']
+    Ob_max = emulator['bounds'][2][1]
+    cospar = {'omega_cold': 0.31,
+              'omega_baryon': 1.2 * Ob_max,
+              'ns': 0.96,
+              'hubble': 0.67,
+              'neutrino_mass': 0.15,
+              'w0': -1,
+              'wa': 0,
+              'sigma8_cold': 0.78}
+    within_bounds = ptc._check_within_bounds(cospar)
+    assert not within_bounds['baryon']
+
+    cospar_out, a_s = ptc._check_baccoemu_baryon_pars_for_extrapolation(
+        cospar, within_bounds=within_bounds)
+    assert ptc._check_within_bounds(cospar_out)['baryon']
+    assert cospar_out['omega_baryon'] / cospar_out['omega_cold'] == \
+        pytest.approx(cospar['omega_baryon'] / cospar['omega_cold'],
+                      rel=1e-10)
+    assert np.all(a_s >= emulator['bounds'][-1][0])
+
+    # The input dictionary is not modified
+    assert cospar['omega_baryon'] == 1.2 * Ob_max
+
+
 def test_hfit_extrapolation(ptc):
     info = get_info()
     info['theory']['Pk']['allow_halofit_extrapolation_for_shear_on_k'] = True
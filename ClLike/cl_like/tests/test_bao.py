@@ -14,7 +14,7 @@ def run_clean_tmp():
         shutil.rmtree("dum")
 
 
-def get_info():
+def get_info(**lkl_kwargs):
     info = {"params": {"A_sE9": 2.1265,
                        "Omega_c": 0.26,
                        "Omega_b": 0.05,
@@ -30,7 +30,7 @@ def get_info():
                        },
             "likelihood": {"BAOLike": {"external": BAOLike,
                                        "bins": [0, 1, 2],
-                                      }
+                                       **lkl_kwargs}
                            },
             "debug": False}
 
@@ -44,3 +44,36 @@ def test_dum():
     assert np.isfinite(loglikes)
     chi2 = -2 * loglikes[0]
     assert (chi2 >= 0) and (chi2 < 50)
+
+
+def test_data_file():
+    from cl_like.bao_like import _EBOSS_DR16_Z, _EBOSS_DR16_DM, \
+        _EBOSS_DR16_DH, _EBOSS_DR16_COV
+    os.makedirs('dum')
+    with open('dum/bao_mean.txt', 'w') as f:
+        f.write("# z value quantity\n")
+        for z, dm, dh in zip(_EBOSS_DR16_Z, _EBOSS_DR16_DM, _EBOSS_DR16_DH):
+            f.write(f"{z} {dm} DM_over_rs\n")
+            f.write(f"{z} {dh} DH_over_rs\n")
+    np.savetxt('dum/bao_cov.txt', _EBOSS_DR16_COV)
+
+    model = get_model(get_info())
+    model_file = get_model(get_info(data_file='dum/bao_mean.txt',
+                                    cov_file='dum/bao_cov.txt'))
+    assert model_file.loglike({}, return_derived=False) == \
+        pytest.approx(model.loglike({}, return_derived=False), rel=1e-10)
+
+    # Isotropic points: D_V/r_d at the D_M, D_H redshifts
+    lkl = model.likelihood['BAOLike']
+    cosmo = model.provider.get_CCL()['cosmo']
+    dm, dh = lkl.get_theory(cosmo).reshape([-1, 2]).T
+    zs = _EBOSS_DR16_Z[:3]
+    dv = (zs*dm**2*dh)**(1/3)
+    with open('dum/bao_iso.txt', 'w') as f:
+        for z, v in zip(zs, dv):
+            f.write(f"{z} {1.01*v} DV_over_rs\n")
+    np.savetxt('dum/bao_iso_cov.txt', np.diag((0.01*dv)**2))
+    model_iso = get_model(get_info(data_file='dum/bao_iso.txt',
+                                   cov_file='dum/bao_iso_cov.txt'))
+    assert model_iso.loglike({}, return_derived=False) == \
+        pytest.approx(-1.5, rel=1e-3)
@@ -1,6 +1,7 @@
 import cl_like as cll
 from cl_like.limber import Limber
 from cl_like.power_spectrum import Pk
+from cl_like.baryon_boost import BaryonBoost, BaryonBoostCalculator
 from cl_like.cl_final import ClFinal
 import numpy as np
 from cobaya.model import get_model
@@ -8,6 +9,7 @@ import pytest
 import os
 import shutil
 import sacc
+import pyccl as ccl
 
 
 # Cleaning the tmp dir before running and after running the tests
@@ -166,3 +168,48 @@ def test_Sk(bias):
     lkl = model.likelihood['ClLike']
     Sk = lkl.provider.get_Pk()['pk_data']['Sk'].get_spline_arrays()[-1]
     assert Sk == pytest.approx(1, rel=1e-9)
+
+
+@pytest.mark.parametrize('bias', ['Linear', 'BaccoPT'])
+def test_baryon_boost_stage(bias):
+    info = get_info(bias, A_AE=0.5)
+    model = get_model(info)
+    loglikes, derived = model.loglikes()
+
+    # Same model, with the baryonic boost applied in BaryonBoost
+    info = get_info(bias, A_AE=0.5)
+    del info['theory']['Pk']['use_baryon_boost']
+    del info['theory']['Pk']['baryon_model']
+    info['theory']['baryons'] = {'external': BaryonBoost,
+                                 'baryon_model': 'Amon-Efstathiou'}
+    info['theory']['limber']['baryon_boost'] = True
+    model = get_model(info)
+    loglikes_stage, derived = model.loglikes()
+    assert loglikes_stage[0] == pytest.approx(loglikes[0], rel=1e-6)
+
+    # The baryonic parameters are not seen by Pk
+    assert 'A_AE' not in model.theory['Pk'].input_params
+    assert 'A_AE' in model.theory['baryons'].input_params
+
+
+def test_ae_arrays_different_grids():
+    # pk_ww on a grid different from that of the linear power spectrum (as
+    # with BaccoPT) is interpolated on the latter
+    cosmo = ccl.Cosmology(Omega_c=0.26, Omega_b=0.05, h=0.67, n_s=0.96,
+                          A_s=2.1265e-9)
+    a_nl = np.linspace(0.3, 1, 32)
+    lnk_nl = np.log(np.logspace(-3, 1, 256))
+    pk_nl = np.array([ccl.nonlin_matter_power(cosmo, np.exp(lnk_nl), ai)
+                      for ai in a_nl])
+    pk_ww = ccl.Pk2D(a_arr=a_nl, lk_arr=lnk_nl, pk_arr=np.log(pk_nl),
+                     is_logp=True)
+
+    bbc = BaryonBoostCalculator()
+    a, lnk, pklin, pknonlin = bbc._get_ae_arrays(cosmo, pk_ww)
+    assert pklin.shape == pknonlin.shape == (a.size, lnk.size)
+    assert (a[0] >= a_nl[0]) and (a[-1] <= a_nl[-1])
+    assert (lnk[0] >= lnk_nl[0]) and (lnk[-1] <= lnk_nl[-1])
+    k = np.exp(lnk)
+    for i in range(0, a.size, max(a.size // 4, 1)):
+        assert pknonlin[i] == pytest.approx(pk_ww.eval(k, a[i], cosmo),
+                                            rel=1e-3)
@@ -150,3 +150,45 @@ def test_S8_input(sigma8_to_As):
         # With baccoemu there is a small difference
         assert np.fabs(loglikes[0]) < 2
 
+
+
+def test_sigma8_to_As_cache_and_table(tmp_path):
+    from cl_like.ccl import make_sigma8_to_As_table, load_sigma8_to_As_table
+    from cl_like.ccl import get_sigma8_As_ratio_ccl
+
+    info = get_info(T_AGN=7.8, use_S8=True, sigma8_to_As='ccl')
+    model = get_model(info)
+    loglikes, derived = model.loglikes()
+    ccl_th = model.theory['ccl']
+
+    pars = {'Omega_c': 0.26, 'Omega_b': 0.05, 'h': 0.67, 'n_s': 0.96,
+            'm_nu': 0.15, 'sigma8': 0.8}
+    ncache = len(ccl_th._sigma8_As_cache)
+    A_s = ccl_th._get_As_from_sigma8(pars)
+    assert len(ccl_th._sigma8_As_cache) == ncache + 1
+    # Only the amplitude changes: the cached ratio is used
+    pars['sigma8'] = 0.9
+    A_s_2 = ccl_th._get_As_from_sigma8(pars)
+    assert len(ccl_th._sigma8_As_cache) == ncache + 1
+    assert A_s_2 == pytest.approx(A_s * (0.9/0.8)**2, rel=1e-12)
+
+    # Interpolation table
+    fname = str(tmp_path / 'sigma8_to_As.npz')
+    make_sigma8_to_As_table(fname, {'Omega_c': np.linspace(0.24, 0.28, 4),
+                                    'h': np.linspace(0.65, 0.69, 4)},
+                            Omega_b=0.05, n_s=0.96, m_nu=0.15)
+    get_ratio = load_sigma8_to_As_table(fname)
+    pars = {'Omega_c': 0.255, 'Omega_b': 0.05, 'h': 0.675, 'n_s': 0.96,
+            'm_nu': 0.15}
+    assert get_ratio(pars) == \
+        pytest.approx(get_sigma8_As_ratio_ccl(pars), rel=1e-3)
+    pars['h'] = 0.7
+    assert get_ratio(pars) is None
+
+    # Parameters that are not gridded must have the fixed values
+    pars['h'] = 0.675
+    pars['m_nu'] = 0.1
+    assert get_ratio(pars) is None
+    pars['m_nu'] = 0.15
+    pars['w0'] = -0.9
+    assert get_ratio(pars) is None
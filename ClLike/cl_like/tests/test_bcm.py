@@ -165,3 +165,18 @@ def test_Sk(bias):
     for i, ai in enumerate(a_arr):
         assert Sk[i] == pytest.approx(ccl.bcm.bcm_model_fka(cosmo, k, ai),
                                       rel=1e-3)
+
+
+def test_bcm_fka_vectorized():
+    from cl_like.baryon_boost import BaryonBoostCalculator
+    cosmo = ccl.Cosmology(Omega_c=0.26, Omega_b=0.05, h=0.67, n_s=0.96,
+                          A_s=2.1265e-9, bcm_log10Mc=14, bcm_etab=0.6,
+                          bcm_ks=50)
+    bbc = BaryonBoostCalculator()
+    a = np.linspace(0.2, 1, 16)
+    k = np.logspace(-4, 2, 128)
+    fka = bbc.get_bcm_fka(cosmo, k, a)
+    assert fka.shape == (a.size, k.size)
+    for i, ai in enumerate(a):
+        assert fka[i] == pytest.approx(ccl.bcm.bcm_model_fka(cosmo, k, ai),
+                                       rel=1e-10)
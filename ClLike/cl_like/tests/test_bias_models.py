@@ -4,6 +4,7 @@ from cl_like.power_spectrum import Pk
 from cl_like.cl_final import ClFinal
 import numpy as np
 from cobaya.model import get_model
+from cobaya.log import LoggedError
 import pytest
 import os
 import shutil
@@ -150,6 +151,39 @@ def test_dum(bias):
         assert np.fabs(loglikes[0]) < 0.2
 
 
+def test_halo_model():
+    info = get_info('HaloModel')
+    info['params'].update({'hod_lMmin_0': {'prior': {'min': 11, 'max': 13}},
+                           'hod_siglM_0': 0.4,
+                           'hod_lM0_0': 12.,
+                           'hod_lM1_0': 13.3,
+                           'hod_alpha_0': 1.,
+                           'hod_fc_0': 1.})
+    # The HOD is shared by all the galaxy_density tracers
+    with pytest.raises(LoggedError):
+        get_model(info)
+
+    lkl = info['likelihood']['ClLike']
+    lkl['bins'] = [b for b in lkl['bins'] if b['name'] != 'gc1']
+    lkl['twopoints'] = [tp for tp in lkl['twopoints']
+                        if 'gc1' not in tp['bins']]
+    model = get_model(info)
+    assert 'bias_gc0_b1' not in model.theory['clfinal'].bias_names
+    hm_calc = model.theory['Pk'].hm_calc
+    loglike = model.loglike({'hod_lMmin_0': 12.}, return_derived=False)
+    assert np.isfinite(loglike)
+
+    # Changing the HOD does not recompute the halo tables
+    cosmo = hm_calc.cosmo
+    uM = hm_calc.uM
+    pkgg = hm_calc.get_pk('d1d1')
+    assert model.loglike({'hod_lMmin_0': 12.5},
+                         return_derived=False) != loglike
+    assert hm_calc.cosmo is cosmo
+    assert hm_calc.uM is uM
+    assert hm_calc.get_pk('d1d1') is not pkgg
+
+
 # TODO: Move this test to another file or rename this one
 def test_sigma8():
     info = get_info(bias="Linear", A_sE9=False)
@@ -0,0 +1,237 @@
+import cl_like as cll
+from cl_like.limber import Limber
+from cl_like.power_spectrum import Pk
+from cl_like.cl_final import ClFinal
+import numpy as np
+import pyccl as ccl
+from cobaya.model import get_model
+import pytest
+import os
+import shutil
+
+
+# Cleaning the tmp dir before running and after running the tests
+@pytest.fixture(autouse=True)
+def run_clean_tmp():
+    if os.path.isdir("dum"):
+        shutil.rmtree("dum")
+
+
+def get_info(amplitude='A_sE9', **ccl_kwargs):
+    data = "" if "ClLike" in os.getcwd() else "ClLike/"
+    data += "cl_like/tests/data/linear_halofit_5x2pt.fits.gz"
+    info = {"params": {"Omega_c": 0.26,
+                       "Omega_b": 0.05,
+                       "h": 0.67,
+                       "n_s": {"prior": {"min": 0.9, "max": 1.0}},
+                       "m_nu": 0.15,
+                       "bias_sh0_m": 0.1,
+                       "limber_sh0_dz": 0.2},
+            "theory": {"ccl": {"external": cll.CCL,
+                               "transfer_function": "boltzmann_camb",
+                               "matter_pk": "halofit",
+                               **ccl_kwargs},
+                       "limber": {"external": Limber,
+                                  "nz_model": "NzShift",
+                                  "input_params_prefix": "limber"},
+                       "Pk": {"external": Pk,
+                              "bias_model": "Linear"},
+                       "clfinal": {"external": ClFinal,
+                                   "input_params_prefix": "bias",
+                                   "shape_model": "ShapeMultiplicative"}
+                       },
+            "likelihood": {"ClLike": {"external": cll.ClLike,
+                                      "input_file": data,
+                                      "bins": [{"name": "sh0"}],
+                                      "twopoints": [{"bins": ["sh0", "sh0"]}],
+                                      "defaults": {"lmin": 0,
+                                                   "lmax": 2000},
+                                      }
+                           },
+            "debug": False}
+    if amplitude == 'A_sE9':
+        info['params']['A_sE9'] = {"prior": {"min": 1.5, "max": 2.5}}
+        info['params']['sigma8'] = None
+    else:
+        info['params']['sigma8'] = {"prior": {"min": 0.7, "max": 0.9}}
+
+    return info
+
+
+@pytest.mark.parametrize('amplitude', ['A_sE9', 'sigma8'])
+def test_reuse_transfer(amplitude):
+    model = get_model(get_info(amplitude))
+    model_reuse = get_model(get_info(amplitude, reuse_transfer=True))
+    ccl_th = model_reuse.theory['ccl']
+
+    amp_values = {'A_sE9': [2.1265, 2.0], 'sigma8': [0.8, 0.75]}[amplitude]
+    points = [(amp_values[0], 0.96),
+              # Only the amplitude changes
+              (amp_values[1], 0.96),
+              # Amplitude and tilt change
+              (amp_values[0], 0.97)]
+    for amp, n_s in points:
+        pars = {amplitude: amp, 'n_s': n_s}
+        loglike = model.loglike(pars, return_derived=False)
+        loglike_reuse = model_reuse.loglike(pars, return_derived=False)
+        assert loglike_reuse == pytest.approx(loglike, rel=1e-3, abs=1e-2)
+
+    # Only one Boltzmann computation
+    assert isinstance(model_reuse.provider.get_CCL()['cosmo'],
+                      ccl.CosmologyCalculator)
+    assert ccl_th._transfer_cache['n_s'] == 0.96
+
+
+def test_lazy_results():
+    from cl_like.ccl import LazyCCLResults
+    calls = []
+
+    def method(cosmo):
+        calls.append(cosmo)
+        return 2 * cosmo
+
+    res = LazyCCLResults(1, {'twice': method})
+    assert 'twice' in res
+    assert len(calls) == 0
+    assert res['twice'] == 2
+    assert res.get('twice') == 2
+    assert len(calls) == 1
+    assert res.get('missing') is None
+    with pytest.raises(KeyError):
+        res['missing']
+
+
+def test_derived_only_if_requested():
+    info = get_info('A_sE9')
+    del info['params']['sigma8']
+    info['params']['S8'] = None
+    model = get_model(info)
+    loglikes, derived = model.loglikes({'A_sE9': 2.1265, 'n_s': 0.96})
+    assert len(derived) == 1
+    state = model.theory['ccl'].current_state
+    assert set(state['derived'].keys()) == {'S8'}
+
+
+def test_boltzmann_cache(tmp_path):
+    from cl_like.boltzmann_cache import BoltzmannCache
+    path = str(tmp_path / 'bcache')
+    pars = {'A_sE9': 2.1265, 'n_s': 0.96}
+
+    model = get_model(get_info('A_sE9'))
+    loglike = model.loglike(pars, return_derived=False)
+
+    # First run fills the cache and the second one reads it
+    for i in range(2):
+        model = get_model(get_info('A_sE9', boltzmann_cache=path))
+        loglike_cache = model.loglike(pars, return_derived=False)
+        assert loglike_cache == pytest.approx(loglike, rel=1e-4, abs=1e-3)
+    assert isinstance(model.provider.get_CCL()['cosmo'],
+                      ccl.CosmologyCalculator)
+
+    # LRU limit
+    bcache = BoltzmannCache(str(tmp_path / 'lru'), max_entries=2)
+    keys = [bcache.get_key({'h': h}) for h in [0.6, 0.7, 0.8]]
+    bcache.save(keys[0], {'x': np.zeros(3)})
+    bcache.save(keys[1], {'x': np.ones(3)})
+    # Cache hits do not rewrite the index
+    mtime = os.stat(bcache.index_file).st_mtime_ns
+    assert bcache.load(keys[0])['x'] == pytest.approx(0)
+    assert os.stat(bcache.index_file).st_mtime_ns == mtime
+    # Saving an entry that already exists (e.g. written by another process
+    # that missed the same cosmology) keeps the existing one
+    bcache.save(keys[0], {'x': np.ones(3)})
+    assert bcache.load(keys[0])['x'] == pytest.approx(0)
+    assert not [d for d in os.listdir(bcache.path) if d.endswith('.tmp')]
+    # keys[1] is now the least recently used one
+    bcache.save(keys[2], {'x': np.ones(3)})
+    assert bcache.load(keys[1]) is None
+    assert bcache.load(keys[0]) is not None
+
+
+def test_timing():
+    from cl_like.timing import StageTimer
+    info = get_info('A_sE9', timing=True)
+    info['theory']['limber']['timing'] = True
+    info['likelihood']['ClLike']['timing'] = True
+    info['params'].update({'ccl_time_cosmology': None,
+                           'limber_time_total': None,
+                           'limber_n_angular_cl': None,
+                           'ClLike_time_total': None})
+    model = get_model(info)
+    loglikes, derived = model.loglikes({'A_sE9': 2.1265, 'n_s': 0.96})
+    derived = dict(zip(model.parameterization.derived_params(), derived))
+    # One shear-shear power spectrum
+    assert derived['limber_n_angular_cl'] == 1
+    assert derived['limber_time_total'] > 0
+    assert derived['ccl_time_cosmology'] > 0
+    assert derived['ClLike_time_total'] > 0
+    assert model.theory['limber'].timer.nsteps == 1
+    assert 'angular_cl' in model.theory['limber'].timer.summary()
+
+    # Nothing recorded if disabled
+    timer = StageTimer('test')
+    timer.start_step()
+    with timer.stage('a'):
+        timer.count('b')
+    timer.end_step()
+    assert timer.nsteps == 0
+    assert timer.get_param_names() == []
+    assert timer.get_derived(['test_time_total']) == {}
+
+
+def test_profile(tmp_path):
+    import pstats
+    out = str(tmp_path)
+    info = get_info('A_sE9')
+    info['theory']['limber']['profile'] = {'steps': [2, 2], 'output': out}
+    info['likelihood']['ClLike']['profile'] = {'every': 1,
+                                               'format': 'collapsed',
+                                               'output': out}
+    model = get_model(info)
+    for A_sE9 in [2.0, 2.1, 2.2]:
+        model.loglike({'A_sE9': A_sE9, 'n_s': 0.96}, return_derived=False)
+
+    # Only the second Limber call is profiled
+    assert sorted(f for f in os.listdir(out) if f.startswith('limber')) == \
+        ['limber_rank0_step2.prof']
+    stats = pstats.Stats(os.path.join(out, 'limber_rank0_step2.prof'))
+    assert any(f[2] == '_get_cl_data' for f in stats.stats)
+    for i in range(1, 4):
+        fname = os.path.join(out, f'ClLike_rank0_step{i}.collapsed')
+        with open(fname) as f:
+            lines = f.read().splitlines()
+        assert any('_get_chi2' in line for line in lines)
+        assert all(int(line.split()[-1]) > 0 for line in lines)
+
+    info['theory']['limber']['profile'] = {'every': 1, 'format': 'svg'}
+    with pytest.raises(ValueError):
+        get_model(info)
+
+
+def test_profile_failed_step(tmp_path):
+    import sys
+    out = str(tmp_path)
+    info = get_info('A_sE9')
+    info['theory']['limber']['timing'] = True
+    info['theory']['limber']['profile'] = {'every': 1,
+                                           'format': 'collapsed',
+                                           'output': out}
+    model = get_model(info)
+    limber = model.theory['limber']
+
+    class StepError(Exception):
+        pass
+
+    def failing_get_cl_data(cosmo, **pars):
+        raise StepError()
+
+    limber._get_cl_data = failing_get_cl_data
+    with pytest.raises(StepError):
+        model.loglike({'A_sE9': 2.0, 'n_s': 0.96}, return_derived=False)
+
+    # The step is closed even if calculate raises: the profiler is
+    # disabled, its output saved and the total time recorded
+    assert sys.getprofile() is None
+    assert os.listdir(out) == ['limber_rank0_step1.collapsed']
+    assert limber.timer._t0 is None
+    assert limber.timer.ncalls_total['total'] == 1
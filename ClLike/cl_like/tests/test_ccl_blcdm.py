@@ -14,7 +14,7 @@ import numpy as np
 from cobaya.model import get_model
 import shutil
 import sacc
-from classy import Class
+from classy import Class, CosmoComputationError, CosmoSevereError
 from scipy.interpolate import interp1d
 
 
@@ -286,6 +286,147 @@ def test_get_pks_muSigma(non_linear, pars_smg):
 
     cosmo.struct_cleanup()
 
+def test_worker_pool():
+    info = get_info()
+    model = get_model(info)
+    loglikes, derived = model.loglikes()
+
+    info = get_info()
+    info["theory"]["ccl_blcdm"]["n_workers"] = 2
+    info["theory"]["ccl_blcdm"]["worker_timeout"] = 60
+    model_pool = get_model(info)
+    loglikes_pool, derived_pool = model_pool.loglikes()
+    assert loglikes_pool == pytest.approx(loglikes, rel=1e-6)
+    assert derived_pool == pytest.approx(derived, rel=1e-6)
+
+    # Batch evaluation
+    th = model_pool.theory['ccl_blcdm']
+    points = [{"expansion_smg": e} for e in [0.69, 0.71]]
+    fixed = {p: v for p, v in info["params"].items()
+             if (p in th.input_params) and (p != "expansion_smg")}
+    th.precompute([dict(fixed, **p) for p in points])
+    assert len(th._precomputed) == 2
+
+    # A worker exceeding the timeout is restarted and the point rejected
+    from cl_like.classy_pool import _SHM_PREFIX, _SHM_DIR
+    pids = [w['process'].pid for w in th._pool.workers]
+    th._pool.timeout = 1e-6
+    pars = th._get_params_for_classy(dict(fixed, expansion_smg=0.72))
+    with pytest.raises(CosmoComputationError):
+        th._compute_classy(pars)
+    # Including the shared memory blocks of its result
+    assert th._pool.workers[0]['process'].pid != pids[0]
+    if os.path.isdir(_SHM_DIR):
+        assert not [n for n in os.listdir(_SHM_DIR)
+                    if n.startswith(_SHM_PREFIX)]
+    th._pool.timeout = 60
+    # The restarted worker works
+    assert th._compute_classy(pars).h() == pytest.approx(0.67)
+    model_pool.close()
+
+
+class FailingNonlinearPk(object):
+    """ Wrapper of a Class instance whose nonlinear P(k) fails as when k_max
+    is below hmcode_min_k_max, to force the fallback in CCL_BLCDM.
+    """
+    def __init__(self, hc):
+        self._hc = hc
+
+    def __getattr__(self, name):
+        return getattr(self._hc, name)
+
+    def get_pk_and_k_and_z(self, nonlinear=False):
+        if nonlinear:
+            raise CosmoSevereError("k_max is smaller than hmcode_min_k_max")
+        return self._hc.get_pk_and_k_and_z(nonlinear=False)
+
+
+def test_nonlinear_pk_fallback():
+    from cl_like.classy_pool import ClassyResults, _run_classy
+    info = get_info()
+    model = get_model(info)
+    th = model.theory['ccl_blcdm']
+    fixed = {p: v for p, v in info["params"].items()
+             if p in th.input_params}
+    pars = th._get_params_for_classy(fixed)
+
+    hc = Class()
+    hc.set(dict(th.cosmo_class.pars))
+    hc.set({'halofit_min_k_max': 100})
+    hc.set(pars)
+    hc.compute()
+    hc_fail = FailingNonlinearPk(hc)
+
+    pk = th._get_ccl_kwargs(hc_fail)['pk_nonlin']
+    k = pk['k']
+    z = 1/pk['a'] - 1
+    pk_mm = pk['delta_matter:delta_matter']
+    for ik, iz in [(0, 0), (10, 5), (k.size // 2, z.size - 1),
+                   (k.size - 1, z.size // 2)]:
+        assert pk_mm[iz, ik] == pytest.approx(hc.pk(k[ik], z[iz]), rel=1e-6)
+
+    # Through the worker pool results
+    res = ClassyResults(_run_classy(hc_fail, pars))
+    pk_pool = th._get_ccl_kwargs(res)['pk_nonlin']
+    assert np.allclose(pk_pool['delta_matter:delta_matter'], pk_mm,
+                       rtol=1e-10, atol=0)
+    hc.struct_cleanup()
+
+
+def test_primordial_rescaling():
+    info = get_info(nonlinear_model="Linear")
+    info["params"]["A_s"] = {"prior": {"min": 1e-9, "max": 4e-9}}
+    info["params"]["n_s"] = {"prior": {"min": 0.9, "max": 1.0}}
+    model = get_model(info)
+    th = model.theory['ccl_blcdm']
+    model.loglikes({"A_s": 2.23e-9, "n_s": 0.96})
+    last_pars = th._last_pars
+
+    for A_s, n_s in [(2.5e-9, 0.96), (2.23e-9, 0.97)]:
+        point = {"A_s": A_s, "n_s": n_s}
+        loglikes, derived = model.loglikes(point)
+        # hi_class was not rerun
+        assert th._last_pars is last_pars
+
+        model_full = get_model(info)
+        loglikes_full, derived_full = model_full.loglikes(point)
+        assert loglikes == pytest.approx(loglikes_full, rel=1e-3, abs=1e-2)
+        assert derived == pytest.approx(derived_full, rel=1e-3)
+
+
+@pytest.mark.parametrize('pars_smg', [(0, 0), (1, 1)])
+def test_growth_from_pk(pars_smg):
+    # Compare with the per-redshift classy functions
+    info = get_info(pars_smg=pars_smg)
+    model = get_model(info)
+    th = model.theory['ccl_blcdm']
+    pars = info["params"]
+
+    cosmo = Class()
+    cosmo.set({'output': 'mPk', 'z_max_pk': 4, 'P_k_max_1/Mpc': 2,
+               'output_background_smg': 10})
+    cosmo.set(info['theory']['ccl_blcdm']['classy_arguments'])
+    cosmo.set({"A_s": pars["A_s"],
+               "Omega_cdm": pars["Omega_cdm"],
+               "Omega_b": pars["Omega_b"],
+               "h": pars["h"],
+               "n_s": pars["n_s"],
+               "parameters_smg": ",".join([str(pars["parameters_smg__1"]),
+                                           str(pars["parameters_smg__2"])]),
+               "expansion_smg": pars["expansion_smg"]})
+    cosmo.compute()
+
+    pkln_mm, k, z_pk = cosmo.get_pk_and_k_and_z(nonlinear=False)
+    growth_factor, growth_rate = th._get_growth_from_pk(pkln_mm, k, z_pk)
+    for i, zi in enumerate(z_pk):
+        gf = cosmo.scale_dependent_growth_factor_at_k_and_z(0.01, zi)
+        gr = cosmo.scale_dependent_growth_factor_f_at_k_and_z(0.01, zi)
+        assert growth_factor[i] == pytest.approx(gf, rel=1e-3)
+        assert growth_rate[i] == pytest.approx(gr, rel=1e-2)
+
+    cosmo.struct_cleanup()
+
+
 @pytest.mark.parametrize('non_linear', ['halofit', 'hmcode'])
 def test_dum_P18(non_linear):
     # LCDM
@@ -0,0 +1,58 @@
+from cl_like.halo_model import HaloModelCalculator
+import numpy as np
+import pyccl as ccl
+import pytest
+
+
+HOD = {'hod_lMmin_0': 12.,
+       'hod_siglM_0': 0.4,
+       'hod_lM0_0': 12.,
+       'hod_lM1_0': 13.3,
+       'hod_alpha_0': 1.,
+       'hod_fc_0': 1.}
+
+
+@pytest.fixture(scope='module')
+def cosmo():
+    return ccl.CosmologyVanillaLCDM(transfer_function='eisenstein_hu')
+
+
+def test_ccl_halo_model(cosmo):
+    hmc_cl = HaloModelCalculator(log10k_min=-3, log10k_max=1,
+                                 nk_per_decade=10, a_arr=np.array([0.5, 1.]),
+                                 hm_correction=False)
+    assert hmc_cl.update_pk(cosmo, HOD)
+
+    # Same ingredients and mass grid in CCL
+    hmc = ccl.halos.HMCalculator(cosmo, hmc_cl.mfc(cosmo,
+                                                   mass_def=hmc_cl.massdef),
+                                 hmc_cl.hbc(cosmo, mass_def=hmc_cl.massdef),
+                                 hmc_cl.massdef, log10M_min=8.,
+                                 log10M_max=16., nlog10M=128)
+    hod = ccl.halos.HaloProfileHOD(hmc_cl.cm,
+                                   **{p[4:]: v for p, v in HOD.items()})
+    nfw = ccl.halos.HaloProfileNFW(hmc_cl.cm)
+    k = hmc_cl.ks
+    a = hmc_cl.a_s
+    pgg = ccl.halos.halomod_power_spectrum(cosmo, hmc, k, a, hod,
+                                           prof_2pt=ccl.halos.Profile2ptHOD(),
+                                           normprof1=True)
+    pgm = ccl.halos.halomod_power_spectrum(cosmo, hmc, k, a, hod,
+                                           prof2=nfw, normprof1=True,
+                                           normprof2=True)
+    for i, ai in enumerate(a):
+        assert hmc_cl.get_pk('d1d1').eval(k, ai, cosmo) == \
+            pytest.approx(pgg[i], rel=1e-2)
+        assert hmc_cl.get_pk('md1').eval(k, ai, cosmo) == \
+            pytest.approx(pgm[i], rel=1e-2)
+    assert hmc_cl.get_pk('d1m') is hmc_cl.get_pk('md1')
+
+
+def test_no_galaxies(cosmo):
+    hmc_cl = HaloModelCalculator(nk_per_decade=5, a_arr=np.array([1.]),
+                                 hm_correction=False)
+    # All the centrals above the mass range
+    hod = HOD.copy()
+    hod.update({'hod_lMmin_0': 40., 'hod_lM0_0': 40.})
+    assert not hmc_cl.update_pk(cosmo, hod)
+    assert hmc_cl.pk2d_computed == {}
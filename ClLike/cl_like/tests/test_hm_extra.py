@@ -0,0 +1,66 @@
+from cl_like.hm_extra import HalomodCorrection
+import numpy as np
+import pytest
+import os
+import shutil
+
+
+# Cleaning the tmp dir before running and after running the tests
+@pytest.fixture(autouse=True)
+def run_clean_tmp():
+    if os.path.isdir("dum"):
+        shutil.rmtree("dum")
+
+
+def test_halomod_correction(monkeypatch):
+    os.makedirs('dum')
+    fname = 'dum/hmcorr.npz'
+    hmc = HalomodCorrection(nlk=8, nz=5, fname=fname)
+    assert os.path.isfile(fname)
+
+    k = np.geomspace(0.2, 4, 10)
+    a = np.array([0.6, 0.8, 1.])
+    rk = hmc.rk_interp(k, a)
+    assert rk.shape == (3, 10)
+    assert np.all(np.isfinite(rk))
+    # Scalar scale factor
+    assert np.allclose(hmc.rk_interp(k, 0.8), rk[1])
+    # No correction outside the table
+    assert np.all(hmc.rk_interp(np.array([1E-3, 100.]), 0.8) == 0)
+    assert np.all(hmc.rk_interp(k, 0.1) == 0)
+
+    # Read from file
+    hmc_file = HalomodCorrection(nlk=8, nz=5, fname=fname)
+    assert np.all(hmc_file.ratio == hmc.ratio)
+    assert np.allclose(hmc_file.rk_interp(k, a), rk)
+
+    # Recomputed (and saved) if the settings are different
+    hmc_new = HalomodCorrection(nlk=8, nz=6, fname=fname)
+    assert hmc_new.ratio.shape == (8, 6)
+    assert np.load(fname)['nz'] == 6
+    hmc_new = HalomodCorrection(k_range=[0.1, 2], nlk=8, nz=6, fname=fname)
+    assert hmc_new.lkarr[-1] == np.log10(2)
+
+    # Tables saved without the settings are recomputed
+    np.savez(fname, lkarr=hmc.lkarr, aarr=hmc.aarr, ratio=hmc.ratio)
+    hmc_new = HalomodCorrection(nlk=8, nz=6, fname=fname)
+    assert hmc_new.ratio.shape == (8, 6)
+
+    # Unreadable (e.g. partially written) files are recomputed
+    with open(fname, 'wb') as f:
+        f.write(b'PK\x03\x04 truncated')
+    hmc_new = HalomodCorrection(nlk=8, nz=6, fname=fname)
+    assert hmc_new.ratio.shape == (8, 6)
+
+    # The file name is used as given
+    fname = 'dum/hmcorr.dat'
+    HalomodCorrection(nlk=8, nz=5, fname=fname)
+    assert sorted(os.listdir('dum')) == ['hmcorr.dat', 'hmcorr.npz']
+
+    # ... and read back without recomputing the table
+    def fail(*args):
+        raise AssertionError("The table was recomputed")
+
+    monkeypatch.setattr(HalomodCorrection, '_get_ratio', fail)
+    hmc_file = HalomodCorrection(nlk=8, nz=5, fname=fname)
+    assert np.all(hmc_file.ratio == hmc.ratio)
@@ -0,0 +1,187 @@
+import cl_like as cll
+from cl_like.node_shared import _pack, _write, _unpack, share_on_node
+from cl_like.limber import Limber
+from cl_like.power_spectrum import Pk
+from cl_like.cl_final import ClFinal
+import numpy as np
+from cobaya.model import get_model
+import pytest
+import os
+import shutil
+
+
+# Cleaning the tmp dir before running and after running the tests
+@pytest.fixture(autouse=True)
+def run_clean_tmp():
+    if os.path.isdir("dum"):
+        shutil.rmtree("dum")
+
+
+def get_info(**lkl_kwargs):
+    data = "" if "ClLike" in os.getcwd() else "ClLike/"
+    data += "cl_like/tests/data/linear_halofit_5x2pt.fits.gz"
+    info = {"params": {"A_sE9": 2.1,
+                       "Omega_c": 0.26,
+                       "Omega_b": 0.05,
+                       "h": 0.67,
+                       "n_s": 0.96,
+                       "m_nu": 0.15,
+                       "bias_sh0_m": 0.1,
+                       "limber_sh0_dz": 0.},
+            "theory": {"ccl": {"external": cll.CCL,
+                               "transfer_function": "boltzmann_camb",
+                               "matter_pk": "halofit"},
+                       "limber": {"external": Limber,
+                                  "nz_model": "NzShift",
+                                  "input_params_prefix": "limber"},
+                       "Pk": {"external": Pk,
+                              "bias_model": "Linear"},
+                       "clfinal": {"external": ClFinal,
+                                   "input_params_prefix": "bias",
+                                   "shape_model": "ShapeMultiplicative"}
+                       },
+            "likelihood": {"ClLike": {"external": cll.ClLike,
+                                      "input_file": data,
+                                      "bins": [{"name": "sh0"}],
+                                      "twopoints": [{"bins": ["sh0", "sh0"]}],
+                                      "defaults": {"lmin": 0,
+                                                   "lmax": 2000},
+                                      **lkl_kwargs}
+                           },
+            "debug": False}
+    return info
+
+
+def test_pack_unpack():
+    products = {'a': np.arange(10.),
+                'b': [{'x': np.ones((3, 4), dtype=np.float32),
+                       'name': 'gc0'},
+                      (np.arange(5), None)],
+                'n': 3}
+    packed, nbytes = _pack(products)
+    buf = np.zeros(nbytes, dtype=np.uint8)
+    _write(products, packed, buf)
+    unpacked = _unpack(packed, buf)
+
+    assert np.all(unpacked['a'] == products['a'])
+    assert unpacked['b'][0]['x'].dtype == np.float32
+    assert np.all(unpacked['b'][0]['x'] == 1)
+    assert unpacked['b'][0]['name'] == 'gc0'
+    assert np.all(unpacked['b'][1][0] == np.arange(5))
+    assert unpacked['b'][1][1] is None
+    assert unpacked['n'] == 3
+    # Views of the buffer, read-only
+    assert not unpacked['a'].flags.writeable
+    assert np.shares_memory(unpacked['a'], buf)
+
+    # Repeated arrays are stored once
+    products = {'a': products['a'], 'b': [products['a'], np.ones(2)]}
+    packed, nbytes = _pack(products)
+    buf = np.zeros(nbytes, dtype=np.uint8)
+    _write(products, packed, buf)
+    unpacked = _unpack(packed, buf)
+    assert np.shares_memory(unpacked['a'], unpacked['b'][0])
+    assert not np.shares_memory(unpacked['a'], unpacked['b'][1])
+
+    # Without a communicator the products are built locally
+    products, win = share_on_node(lambda: {'a': np.ones(3)})
+    assert win is None
+    assert np.all(products['a'] == 1)
+
+
+def test_node_shared_data():
+    model = get_model(get_info())
+    model_shared = get_model(get_info(node_shared_data=True))
+    lkl = model.likelihood['ClLike']
+    lkl_shared = model_shared.likelihood['ClLike']
+
+    assert np.all(lkl_shared.data_vec == lkl.data_vec)
+    assert np.all(lkl_shared.inv_cov == lkl.inv_cov)
+    for clm, clm_shared in zip(lkl.cl_meta, lkl_shared.cl_meta):
+        assert np.all(clm['w_bpw'] == clm_shared['w_bpw'])
+    assert model_shared.loglike({}, return_derived=False) == \
+        pytest.approx(model.loglike({}, return_derived=False), rel=1e-8)
+    # The data sacc file can still be recovered
+    assert np.all(lkl_shared.get_cl_data_sacc().mean ==
+                  lkl.get_cl_data_sacc().mean)
+
+
+def test_data_cache():
+    model = get_model(get_info())
+    lkl = model.likelihood['ClLike']
+    loglike = model.loglike({}, return_derived=False)
+
+    # First run writes the cache, second one reads it
+    for i in range(2):
+        model_cache = get_model(get_info(data_cache='dum'))
+        lkl_cache = model_cache.likelihood['ClLike']
+        assert len(os.listdir('dum')) == 2
+        assert lkl_cache.ndata == lkl.ndata
+        assert np.all(lkl_cache.data_vec == lkl.data_vec)
+        assert np.all(lkl_cache.inv_cov == lkl.inv_cov)
+        assert lkl_cache.defaults == lkl.defaults
+        for clm, clm_cache in zip(lkl.cl_meta, lkl_cache.cl_meta):
+            assert np.all(clm['w_bpw'] == clm_cache['w_bpw'])
+            assert np.all(clm['inds'] == clm_cache['inds'])
+        assert model_cache.loglike({}, return_derived=False) == \
+            pytest.approx(loglike, rel=1e-8)
+    # Memory-mapped arrays
+    assert lkl_cache.sacc_file is None
+    assert not lkl_cache.inv_cov.flags.writeable
+
+    # Different scale cuts give a different entry
+    info = get_info(data_cache='dum')
+    info['likelihood']['ClLike']['defaults']['lmax'] = 1000
+    get_model(info)
+    assert len(os.listdir('dum')) == 4
+
+
+def test_data_cache_bpw_operators():
+    info = get_info(data_cache='dum')
+    lkl_info = info['likelihood']['ClLike']
+    lkl_info['bins'] = [{'name': 'sh0'}, {'name': 'sh1'}]
+    lkl_info['twopoints'] = [{'bins': ['sh0', 'sh0']},
+                             {'bins': ['sh0', 'sh1']},
+                             {'bins': ['sh1', 'sh1']}]
+    info['params']['bias_sh1_m'] = 0.1
+    info['params']['limber_sh1_dz'] = 0.
+    # Second run reads the cache
+    for i in range(2):
+        model = get_model(info)
+    cl_meta = model.likelihood['ClLike'].cl_meta
+    bpw_ops = model.theory['limber'].bpw_ops
+
+    # Pairs with the same windows share the operator, even if the windows
+    # are different arrays
+    nshared = 0
+    for i, clm_i in enumerate(cl_meta):
+        for j, clm_j in enumerate(cl_meta[:i]):
+            if np.array_equal(clm_i['w_bpw'], clm_j['w_bpw']) and \
+                    np.array_equal(clm_i['l_bpw'], clm_j['l_bpw']):
+                assert bpw_ops[i] is bpw_ops[j]
+                nshared += 1
+            else:
+                assert bpw_ops[i] is not bpw_ops[j]
+    assert nshared > 0
+
+
+def test_compact_storage():
+    model = get_model(get_info())
+    lkl = model.likelihood['ClLike']
+    loglike = model.loglike({}, return_derived=False)
+    for clm in lkl.cl_meta:
+        assert 'cov' not in clm
+        # The C_ells are views of the data vector
+        assert np.shares_memory(clm['cl'], lkl.data_vec)
+        assert np.all(clm['cl'] == lkl.data_vec[clm['inds']])
+
+    info = get_info(bpw_dtype='float32')
+    info['theory']['limber']['cl_dtype'] = 'float32'
+    model32 = get_model(info)
+    lkl32 = model32.likelihood['ClLike']
+    assert lkl32.cl_meta[0]['w_bpw'].dtype == np.float32
+    model32.loglike({}, return_derived=False)
+    cld = model32.provider.get_Limber()['cl_data']
+    assert cld['cl00'][0].dtype == np.float32
+    assert model32.loglike({}, return_derived=False) == \
+        pytest.approx(loglike, rel=1e-4)
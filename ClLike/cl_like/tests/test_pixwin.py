@@ -0,0 +1,104 @@
+import cl_like as cll
+from cl_like.pixwin import PixelWindow, beam_hpix, read_pixwin_table
+from cl_like.limber import Limber
+from cl_like.power_spectrum import Pk
+from cl_like.cl_final import ClFinal
+from scipy.interpolate import interp1d
+import numpy as np
+from cobaya.model import get_model
+import pytest
+import os
+import shutil
+
+
+# Cleaning the tmp dir before running and after running the tests
+@pytest.fixture(autouse=True)
+def run_clean_tmp():
+    if os.path.isdir("dum"):
+        shutil.rmtree("dum")
+
+
+def get_info(nside=None):
+    data = "" if "ClLike" in os.getcwd() else "ClLike/"
+    data += "cl_like/tests/data/linear_halofit_5x2pt.fits.gz"
+    bin_info = {"name": "sh0"}
+    if nside is not None:
+        bin_info["nside"] = nside
+    info = {"params": {"A_sE9": 2.1,
+                       "Omega_c": 0.26,
+                       "Omega_b": 0.05,
+                       "h": 0.67,
+                       "n_s": 0.96,
+                       "m_nu": 0.15,
+                       "bias_sh0_m": 0.1,
+                       "limber_sh0_dz": 0.},
+            "theory": {"ccl": {"external": cll.CCL,
+                               "transfer_function": "boltzmann_camb",
+                               "matter_pk": "halofit"},
+                       "limber": {"external": Limber,
+                                  "nz_model": "NzShift",
+                                  "input_params_prefix": "limber"},
+                       "Pk": {"external": Pk,
+                              "bias_model": "Linear"},
+                       "clfinal": {"external": ClFinal,
+                                   "input_params_prefix": "bias",
+                                   "shape_model": "ShapeMultiplicative"}
+                       },
+            "likelihood": {"ClLike": {"external": cll.ClLike,
+                                      "input_file": data,
+                                      "bins": [bin_info],
+                                      "twopoints": [{"bins": ["sh0", "sh0"]}],
+                                      "defaults": {"lmin": 0,
+                                                   "lmax": 2000}}
+                           },
+            "debug": False}
+    return info
+
+
+def test_pixel_window():
+    ls = np.arange(100.)
+    pw = PixelWindow()
+    assert pw.get(ls, None, None) is None
+    beam = pw.get(ls, 64, None)
+    assert np.allclose(beam, beam_hpix(ls, 64))
+    assert np.allclose(pw.get(ls, 64, 128),
+                       beam_hpix(ls, 64) * beam_hpix(ls, 128))
+    # Cached and symmetric
+    assert pw.get(ls, None, 64) is beam
+    assert pw.get(ls, 128, 64) is pw.get(ls, 64, 128)
+    assert not beam.flags.writeable
+
+    # Exact tables
+    os.makedirs('dum')
+    w = np.exp(-(np.arange(300.)/200)**2)
+    np.savetxt('dum/pixwin_0064.txt', w)
+    np.save('dum/pixwin_0128.npy', np.array([np.arange(300.), w**2]).T)
+    ll, ww = read_pixwin_table('dum/pixwin_0064.txt')
+    assert np.all(ll == np.arange(300.))
+    pw = PixelWindow('dum/pixwin_{nside:04d}.txt')
+    assert np.allclose(pw.get(ls, 64, 64), w[:100]**2)
+    pw = PixelWindow('dum/pixwin_{nside:04d}.npy')
+    assert np.allclose(pw.get(ls, 128, None), w[:100]**2)
+    with pytest.raises(ValueError):
+        pw.get(np.arange(400.), 128, None)
+
+
+def test_bpw_operators():
+    model = get_model(get_info(nside=512))
+    model.loglike({}, return_derived=False)
+    lkl = model.likelihood['ClLike']
+    limber = model.theory['limber']
+    clm = lkl.cl_meta[0]
+    op = limber.bpw_ops[0]
+
+    # Same as the interpolation and convolution of the sampled C_ell
+    ls = limber.l_sample
+    cl = 1/(ls+10.)**2
+    f = interp1d(np.log(1E-3+ls), cl*beam_hpix(ls, 512)**2)
+    clb = np.dot(clm['w_bpw'], f(np.log(1E-3+clm['l_bpw'])))
+    assert np.allclose(np.dot(op, cl), clb, rtol=1e-10)
+
+    # The pixel window is included in the theory
+    model_nopix = get_model(get_info())
+    assert model_nopix.loglike({}, return_derived=False) != \
+        model.loglike({}, return_derived=False)
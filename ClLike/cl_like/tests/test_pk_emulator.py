@@ -0,0 +1,108 @@
+import cl_like as cll
+from cl_like.limber import Limber
+from cl_like.power_spectrum import Pk
+from cl_like.cl_final import ClFinal
+import numpy as np
+import pyccl as ccl
+import pytest
+import os
+from cobaya.model import get_model
+from cobaya.log import LoggedError
+
+baccoemu = pytest.importorskip('baccoemu')
+from cl_like.pk_emulator import BaccoLinearEmulator  # noqa: E402
+
+
+PARS = {'Omega_c': 0.26, 'Omega_b': 0.05, 'h': 0.67, 'n_s': 0.96,
+        'A_s': 2.1265e-9, 'm_nu': 0.15}
+
+
+def get_info(**ccl_kwargs):
+    data = "" if "ClLike" in os.getcwd() else "ClLike/"
+    data += "cl_like/tests/data/linear_halofit_5x2pt.fits.gz"
+    info = {"params": {"A_sE9": 2.1265,
+                       "Omega_c": 0.26,
+                       "Omega_b": 0.05,
+                       "h": 0.67,
+                       "n_s": 0.96,
+                       "m_nu": 0.15,
+                       "bias_sh0_m": 0.1,
+                       "limber_sh0_dz": 0.2,
+                       "sigma8": None},
+            "theory": {"ccl": {"external": cll.CCL,
+                               "transfer_function": "boltzmann_camb",
+                               "matter_pk": "halofit",
+                               **ccl_kwargs},
+                       "limber": {"external": Limber,
+                                  "nz_model": "NzShift",
+                                  "input_params_prefix": "limber"},
+                       "Pk": {"external": Pk,
+                              "bias_model": "Linear"},
+                       "clfinal": {"external": ClFinal,
+                                   "input_params_prefix": "bias",
+                                   "shape_model": "ShapeMultiplicative"}
+                       },
+            "likelihood": {"ClLike": {"external": cll.ClLike,
+                                      "input_file": data,
+                                      "bins": [{"name": "sh0"}],
+                                      "twopoints": [{"bins": ["sh0", "sh0"]}],
+                                      "defaults": {"lmin": 0,
+                                                   "lmax": 2000},
+                                      }
+                           },
+            "debug": False}
+    return info
+
+
+def test_validate():
+    emu = BaccoLinearEmulator()
+    rel_diff = emu.validate([PARS], a_arr=[0.5, 1])
+    assert rel_diff.shape == (1,)
+    assert rel_diff[0] < 0.01
+
+
+def test_sigma8_input():
+    emu = BaccoLinearEmulator()
+    cosmo = emu.get_cosmology(PARS, matter_pk='linear')
+    pars = PARS.copy()
+    del pars['A_s']
+    pars['sigma8'] = ccl.sigma8(cosmo)
+    cosmo_s8 = emu.get_cosmology(pars, matter_pk='linear')
+    k = np.logspace(-3, 0, 16)
+    assert ccl.linear_matter_power(cosmo_s8, k, 1) == \
+        pytest.approx(ccl.linear_matter_power(cosmo, k, 1), rel=1e-3)
+
+
+def test_ccl_theory():
+    model = get_model(get_info())
+    loglikes, derived = model.loglikes()
+    cl_camb = model.likelihood['ClLike'].get_cl_theory_sacc().mean
+
+    model = get_model(get_info(pk_emulator='baccoemu',
+                               pk_emulator_validation=[PARS]))
+    loglikes_emu, derived_emu = model.loglikes()
+    lkl = model.likelihood['ClLike']
+    assert isinstance(lkl.provider.get_CCL()['cosmo'],
+                      ccl.CosmologyCalculator)
+    assert derived_emu[0] == pytest.approx(derived[0], rel=5e-3)
+    cl_emu = lkl.get_cl_theory_sacc().mean
+    assert cl_emu == pytest.approx(cl_camb, rel=2e-2)
+
+    with pytest.raises(ValueError):
+        get_model(get_info(pk_emulator='baccoemu', baryons_pk='bcm'))
+
+
+def test_unsupported_options():
+    # Options that the emulated cosmology would silently ignore
+    with pytest.raises(LoggedError):
+        get_model(get_info(pk_emulator='baccoemu',
+                           ccl_arguments={'extra_parameters':
+                                          {'camb': {'halofit_version':
+                                                    'mead2020_feedback'}}}))
+    with pytest.raises(LoggedError):
+        get_model(get_info(pk_emulator='baccoemu', matter_pk='bacco'))
+
+    info = get_info(pk_emulator='baccoemu')
+    info['params']['HMCode_logT_AGN'] = 7.8
+    with pytest.raises(LoggedError):
+        get_model(info)
@@ -0,0 +1,160 @@
+"""
+Lightweight instrumentation of the cl_like theory and likelihood classes.
+Each class keeps a StageTimer with the wall time spent in its `calculate`
+method ('total') and in each of its stages, and a set of counters (e.g.
+number of calls to `ccl.angular_cl` or cache hits). The values of the last
+step can be output as derived parameters and a summary is logged when the
+run ends.
+
+When timing is disabled, `stage` returns a shared no-op context manager and
+`count` returns immediately, so the overhead is negligible.
+
+The timer also drives the optional per-step profiler (see profiling.py).
+"""
+from collections import defaultdict
+from contextlib import nullcontext
+import re
+import time
+from .profiling import get_profiler
+
+
+_NULL_CONTEXT = nullcontext()
+
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer._add_time(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class StageTimer(object):
+    """ Per-stage timers and counters.
+
+    Args:
+        name (str): name of the instrumented component. Used as prefix of
+            the derived parameters.
+        stages (list): names of the timed stages. The time between
+            start_step and end_step is always recorded as 'total'.
+        counters (list): names of the counters.
+        enabled (bool): if False, nothing is recorded.
+        profile (dict): options of the step profiler (see profiling.py).
+            None or empty for no profiling.
+    """
+    def __init__(self, name, stages=(), counters=(), enabled=False,
+                 profile=None):
+        self.name = re.sub(r'\W', '_', name)
+        self.profiler = get_profiler(self.name, profile)
+        self.stages = ['total'] + [s for s in stages if s != 'total']
+        self.counters = list(counters)
+        self.enabled = enabled
+        self.nsteps = 0
+        # Totals over the whole run
+        self.time_total = defaultdict(float)
+        self.ncalls_total = defaultdict(int)
+        self.count_total = defaultdict(int)
+        # Values of the current step
+        self.time_step = defaultdict(float)
+        self.count_step = defaultdict(int)
+        self._t0 = None
+
+    def start_step(self):
+        """ Reset the values of the current step. Call at the beginning of
+        each calculate.
+        """
+        if self.profiler is not None:
+            self.profiler.start_step()
+        if not self.enabled:
+            return
+        self.nsteps += 1
+        self.time_step.clear()
+        self.count_step.clear()
+        self._t0 = time.perf_counter()
+
+    def end_step(self):
+        """ Record the total time of the current step. """
+        if self.profiler is not None:
+            self.profiler.end_step()
+        if (not self.enabled) or (self._t0 is None):
+            return
+        self._add_time('total', time.perf_counter() - self._t0)
+        self._t0 = None
+
+    def stage(self, name):
+        """ Return a context manager timing the stage `name`. A stage can be
+        entered several times per step; the times are added.
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, name)
+
+    def _add_time(self, name, dt):
+        self.time_step[name] += dt
+        self.time_total[name] += dt
+        self.ncalls_total[name] += 1
+
+    def count(self, name, n=1):
+        """ Increase the counter `name` by n. """
+        if not self.enabled:
+            return
+        self.count_step[name] += n
+        self.count_total[name] += n
+
+    def get_param_names(self):
+        """ Return the names of the derived parameters that can be output:
+        `<name>_time_<stage>` (seconds spent in the last step) and
+        `<name>_n_<counter>` (counts in the last step).
+        """
+        if not self.enabled:
+            return []
+        return ([f'{self.name}_time_{s}' for s in self.stages] +
+                [f'{self.name}_n_{c}' for c in self.counters])
+
+    def get_derived(self, requested):
+        """ Return the values of the last step of the derived parameters in
+        `requested`.
+        """
+        if not self.enabled:
+            return {}
+        derived = {}
+        for s in self.stages:
+            p = f'{self.name}_time_{s}'
+            if p in requested:
+                derived[p] = self.time_step[s]
+        for c in self.counters:
+            p = f'{self.name}_n_{c}'
+            if p in requested:
+                derived[p] = self.count_step[c]
+        return derived
+
+    def summary(self):
+        """ Return a table with the total and mean time per step of each
+        stage and the total counts.
+        """
+        lines = [f"Timing summary for {self.name} ({self.nsteps} steps)"]
+        nsteps = max(self.nsteps, 1)
+        for s in sorted(self.time_total, key=self.time_total.get,
+                        reverse=True):
+            t = self.time_total[s]
+            lines.append(f"  {s:<24s} {t:10.3f}s total, "
+                         f"{1E3*t/nsteps:10.3f}ms/step, "
+                         f"{self.ncalls_total[s]} calls")
+        for c in sorted(self.count_total):
+            n = self.count_total[c]
+            lines.append(f"  {c:<24s} {n:10d} counts, "
+                         f"{n/nsteps:10.2f}/step")
+        return "\n".join(lines)
+
+    def close(self, log):
+        """ Log the summary and save the profile of an unfinished step. """
+        if self.profiler is not None:
+            self.profiler.end_step()
+        if self.enabled and self.nsteps > 0:
+            log.info(self.summary())
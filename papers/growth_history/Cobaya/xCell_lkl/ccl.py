@@ -39,6 +39,28 @@ import pyccl as ccl
 from cobaya.theory import Theory
 
 
+class LazyCCLResults(dict):
+    """ Dictionary of CCL results. `results['cosmo']` is the CCL cosmology
+    object, and the methods passed in the requirements are evaluated on it
+    the first time their results are accessed.
+    """
+    def __init__(self, cosmo, methods):
+        super().__init__(cosmo=cosmo)
+        self._methods = methods
+
+    def __missing__(self, key):
+        if key not in self._methods:
+            raise KeyError(key)
+        value = self[key] = self._methods[key](self['cosmo'])
+        return value
+
+    def __contains__(self, key):
+        return super().__contains__(key) or (key in self._methods)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
 class CCL(Theory):
     """
     This implements CCL as a `Theory` object that takes in
@@ -99,11 +121,12 @@ class CCL(Theory):
                               matter_power_spectrum=self.matter_pk,
                               baryons_power_spectrum=self.baryons_pk)
 
-        state['CCL'] = {'cosmo': cosmo}
-        # Compute sigma8 (we should actually only do this if required -- TODO)
-        state['derived'] = {'sigma8': ccl.sigma8(cosmo)}
-        for req_res, method in self._required_results.items():
-            state['CCL'][req_res] = method(cosmo)
+        # The methods passed in the requirements are only evaluated when
+        # their results are accessed
+        state['CCL'] = LazyCCLResults(cosmo, self._required_results)
+        # Compute sigma8 only if required
+        if want_derived and ('sigma8' in self.output_params):
+            state['derived'] = {'sigma8': ccl.sigma8(cosmo)}
 
     def get_CCL(self):
         """